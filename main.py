@@ -1,16 +1,39 @@
 import os
-import threading
-import time
-from datetime import datetime, date, timedelta
+from datetime import date, timedelta
 
 import telebot
 from dotenv import load_dotenv
 from telebot.types import InputFile
 
+from utils.archive import archive_summary, find_archived
 from utils.keyboards import main_menu, admin_menu, already_stored, delivery_decision, pickup_decision
 from utils.keyboards import approval_processing_data, return_main_menu as return_main_menu_keyboard, choose_volume, confirm_request, promo_decision
-from utils.db_utils import db_reader, append_order, get_cell_by_number, save_database, sync_cells_occupancy, upsert_user_profile
+from utils.db_utils import (
+    agreement_items,
+    allocate_cell,
+    append_order,
+    check_cells_occupancy,
+    checkpoint_database,
+    db_cache_stats,
+    db_snapshot,
+    ensure_order_ids,
+    find_agreement,
+    find_cell_size,
+    find_order,
+    find_user,
+    find_warehouse,
+    get_cell_by_number,
+    load_models,
+    release_cell,
+    requests_by_status,
+    run_in_transaction,
+    start_checkpointer,
+    upsert_user_profile,
+    user_agreements,
+    warehouse_availability,
+)
 from utils.helpers import (
+    build_availability_text,
     build_storage_confirm_text,
     find_monthly_price,
     get_warehouse_address,
@@ -22,9 +45,24 @@ from utils.helpers import (
     promo_result,
     utc_now_iso,
 )
-from utils.mailer import send_yandex_email_detailed
+from utils.dispatcher import (
+    BackgroundJobs,
+    OrderedDispatcher,
+    background_settings,
+    dispatcher_settings,
+    format_dispatch_stats,
+)
+from utils.outbox import dead_letters, enqueue_email, outbox_stats, requeue_dead, smtp_latency_stats, start_outbox_workers
+from utils.models import parse_iso_date
+from utils.reminder_simulation import simulate_reminders, summarize_simulation
+from utils.reminder_stats import format_run_stats, load_run_stats
 from utils.reminders import process_rent_reminders
-from utils.ui_helpers import warehouse_keyboard, options_keyboard
+from utils.router import MessageRouter
+from utils.sessions import session_store
+from utils.scheduler import start_scheduler
+from utils.telegram_queue import QueuedBot, TelegramSendQueue
+from utils.ui_helpers import options_keyboard
+from utils.webhook import build_webhook_server
 from utils.get_qr import build_pickup_qr_file
 
 
@@ -37,10 +75,28 @@ def main() -> None:
     if not token:
         raise RuntimeError('TG_TOKEN не задан в переменных окружения')
 
-    bot = telebot.TeleBot(token)
-    sessions: dict[int, dict] = {}
-    reminder_lock = threading.Lock()
-    last_reminder_date = {"value": None}
+    bot_mode = (os.getenv('BOT_MODE') or 'polling').lower()
+    bot_runtime = (os.getenv('BOT_RUNTIME') or 'threads').lower()
+    # Обработчики выполняет диспетчер: сообщения одного пользователя по
+    # очереди, разных пользователей — параллельно. Исходящие сообщения в
+    # обоих режимах отправляет синхронный клиент через общую очередь.
+    telegram_bot = telebot.TeleBot(token, threaded=False)
+    if bot_runtime == 'asyncio':
+        # aiohttp нужен только этому режиму, поэтому импорт здесь.
+        from utils.async_runtime import AsyncOrderedDispatcher, async_settings, run_async_bot
+        dispatcher = AsyncOrderedDispatcher(**async_settings())
+    else:
+        dispatcher = OrderedDispatcher(**dispatcher_settings()).start()
+    # Долгие команды оператора идут в отдельный пул, не занимая поток диспетчера.
+    background_jobs = BackgroundJobs(**background_settings())
+    # Все исходящие сообщения идут через общую очередь с лимитами Telegram.
+    bot = QueuedBot(telegram_bot, TelegramSendQueue(telegram_bot).start(), operator_chats=[chat_id])
+    # Сессии хранят только идентификаторы (QR договора, названия складов) и
+    # переживают перезапуск; записи из БД перечитываются по ним.
+    sessions = session_store()
+    # Команды, кнопки и состояния сессии разбираются поиском в словарях.
+    router = MessageRouter()
+    availability_text_cache = {"version": None, "text": None}
     existing_actions = {
         "Забрать частично вещи": {
             "code": "partial_takeout",
@@ -75,11 +131,9 @@ def main() -> None:
     def get_session(user_id: int):
         return sessions.get(user_id)
 
-    def read_db_synced():
-        database = db_reader()
-        if sync_cells_occupancy(database):
-            save_database(database)
-        return database
+    def session_rent(session: dict):
+        qr_code = session["data"]["selected_qr_code"]
+        return find_agreement(db_snapshot(), qr_code) or {"qr_code": qr_code}
 
     def send_storage_confirm(chat_id_value: int, session_data: dict):
         bot.send_message(
@@ -128,24 +182,7 @@ def main() -> None:
             reply_markup=get_main_menu(chat_id_value),
         )
 
-    def run_daily_reminders():
-        with reminder_lock:
-            today_str = date.today().isoformat()
-            if last_reminder_date["value"] == today_str:
-                return None
-            result = process_rent_reminders(bot, chat_id)
-            last_reminder_date["value"] = today_str
-            return result
-
-    def reminders_worker():
-        while True:
-            try:
-                run_daily_reminders()
-            except Exception:
-                pass
-            time.sleep(3600)
-
-    @bot.message_handler(commands=['start'])
+    @router.command('start')
     def start(message):
         source = parse_start_source(message.text)
         upsert_user_profile(
@@ -176,12 +213,12 @@ def main() -> None:
         )
 
 
-    @bot.message_handler(func=lambda m: m.text == "Вернуться в главное меню")
+    @router.text("Вернуться в главное меню")
     def handle_return_main_menu(message):
         start(message)
 
 
-    @bot.message_handler(func=lambda m: m.text == 'Согласен ✅')
+    @router.text('Согласен ✅')
     def pickup_start(message):
         session = get_session(message.from_user.id)
         if not session or session.get('state') != 'WAIT_CONSENT':
@@ -212,14 +249,13 @@ def main() -> None:
             return
 
         session['state'] = 'WAIT_WAREHOUSE'
-        warehouses = session['data'].get('available_warehouses', [])
         bot.send_message(
             message.chat.id,
             'Выберите склад, куда планируете привезти вещи самостоятельно:',
-            reply_markup=warehouse_keyboard(warehouses),
+            reply_markup=options_keyboard(session['data'].get('warehouse_names', [])),
         )
 
-    @bot.message_handler(func=lambda m: m.text == 'Не согласен ❌')
+    @router.text('Не согласен ❌')
     def decline_personal_data_processing(message):
         reset_session(message.from_user.id)
         bot.send_message(
@@ -229,22 +265,13 @@ def main() -> None:
         )
 
 
-    @bot.message_handler(func=lambda m: m.text == 'Хочу хранить вещи')
+    @router.text('Хочу хранить вещи')
     def want_storage(message):
-        database = read_db_synced()
-        warehouses = database["warehouses"]
-        available_warehouses = []
-
-        for warehouse in warehouses:
-            for cell in database["cells"]:
-                if warehouse['name'] == cell["warehouse_name"] and cell["is_occupied"] is False:
-                    available_warehouses.append(warehouse)
-
-        text = 'На данный момент свободные ячейки есть на следующих складах:\n\n'
-        for warehouse in available_warehouses:
-            text = text + f'{warehouse["name"]}\n{warehouse["address"]}\n\n'
-
-        text = text + 'Также у нас есть услуга бесплатной доставки Ваших вещей на склад. Интересует ли Вас данная услуга?'
+        availability = warehouse_availability(db_snapshot())
+        if availability_text_cache["version"] != availability["version"]:
+            availability_text_cache["text"] = build_availability_text(availability)
+            availability_text_cache["version"] = availability["version"]
+        text = availability_text_cache["text"]
 
         bot.send_message(
             message.chat.id,
@@ -252,7 +279,7 @@ def main() -> None:
             reply_markup=pickup_decision(),
         )
 
-    @bot.message_handler(func=lambda m: m.text == 'Услуги для юрлиц')
+    @router.text('Услуги для юрлиц')
     def legal_entities_services(message):
         sessions[message.from_user.id] = {
             'state': 'WAIT_CONSENT',
@@ -277,24 +304,16 @@ def main() -> None:
         )
 
     want_storage_message = ['Необходимо забрать', 'Отвезу сам']
-    @bot.message_handler(func=lambda m: m.text in want_storage_message)
+    @router.text(*want_storage_message)
     def already_stored_menu(message):
-        database = read_db_synced()
-        available_warehouses = []
-        for warehouse in database.get("warehouses", []):
-            has_free_cells = any(
-                warehouse['name'] == cell["warehouse_name"] and cell["is_occupied"] is False
-                for cell in database.get("cells", [])
-            )
-            if has_free_cells:
-                available_warehouses.append(warehouse)
+        warehouse_names = [warehouse['name'] for warehouse in warehouse_availability(db_snapshot())["warehouses"]]
 
         request_type = 'pickup' if message.text == 'Необходимо забрать' else 'self_dropoff'
         sessions[message.from_user.id] = {
             'state': 'WAIT_CONSENT',
             'data': {
                 'request_type': request_type,
-                'available_warehouses': available_warehouses,
+                'warehouse_names': warehouse_names,
             }
         }
 
@@ -317,15 +336,15 @@ def main() -> None:
         
 
 
-    @bot.message_handler(func=lambda m: m.text == 'Мои заказы')
+    @router.text('Мои заказы')
     def look_orders(message):
         '''Бот выводит все аренды клиента'''
         user_id = message.from_user.id
-        database = db_reader()
-        user_rent = []
-        for rent in database["rental_agreements"]:
-            if rent["user_telegram_id"] == user_id and rent.get("status") != "Закончена":
-                user_rent.append(rent)
+        database = db_snapshot()
+        user_rent = [
+            rent for rent in user_agreements(database, user_id)
+            if rent.get("status") != "Закончена"
+        ]
 
         if not user_rent:
             bot.send_message(
@@ -339,24 +358,17 @@ def main() -> None:
                 'Ваши арендованные ячейки: \n\n',
             )
             for rent in user_rent:
-                matched_cell = next(
-                    (cell for cell in database.get('cells', []) if cell.get("number") == rent.get("cell_number")),
-                    None
-                )
+                matched_cell = get_cell_by_number(database, rent.get("cell_number"))
                 warehouse = matched_cell.get("warehouse_name") if matched_cell else "Неизвестный склад"
                 cell_size_code = matched_cell.get("cell_size_code") if matched_cell else "-"
 
-                matched_size = next(
-                    (size for size in database.get("cell_sizes", []) if size.get("code") == cell_size_code),
-                    None
-                )
+                matched_size = find_cell_size(database, cell_size_code)
                 cell_description = matched_size.get("description") if matched_size else "Описание недоступно"
 
                 item_record = next(
                     (
-                        item for item in database.get("items", [])
-                        if item.get("rental_agreement_qr_code") == rent.get("qr_code")
-                        and item.get("removed_at") is None
+                        item for item in agreement_items(database, rent.get("qr_code"))
+                        if item.get("removed_at") is None
                     ),
                     None
                 )
@@ -397,7 +409,7 @@ def main() -> None:
                         reply_markup=get_main_menu(user_id),
                     )
 
-    @bot.message_handler(func=lambda m: m.text == "Уже храню вещи")
+    @router.text("Уже храню вещи")
     def action_with_stored(message):
         text = (
             'Если Вы уже храните вещи в наших кладовках, Вы можете:\n\n'
@@ -419,14 +431,13 @@ def main() -> None:
         "Забрать полностью вещи",
         "Положить обратно в арендованную ячейку"
     ]
-    @bot.message_handler(func=lambda m: m.text in already_stored_message)
+    @router.text(*already_stored_message)
     def delivery_offer(message):
-        database = db_reader()
+        database = db_snapshot()
         user_id = message.from_user.id
-        selected_action = existing_actions[message.text]
         active_rents = [
-            rent for rent in database.get("rental_agreements", [])
-            if rent.get("user_telegram_id") == user_id and rent.get("status") == "Активна"
+            rent for rent in user_agreements(database, user_id)
+            if rent.get("status") == "Активна"
         ]
 
         if not active_rents:
@@ -441,12 +452,12 @@ def main() -> None:
         rent_options = []
         for rent in active_rents:
             label = f"{rent.get('cell_number')} | {rent.get('qr_code')} | до {rent.get('end_date')}"
-            rent_map[label] = rent
+            rent_map[label] = rent.get('qr_code')
             rent_options.append(label)
         sessions[user_id] = {
             "state": "WAIT_EXISTING_RENT_SELECT",
             "data": {
-                "existing_action": selected_action,
+                "existing_action": message.text,
                 "rent_map": rent_map,
             }
         }
@@ -456,7 +467,7 @@ def main() -> None:
             reply_markup=options_keyboard(rent_options),
         )
 
-    @bot.message_handler(func=lambda m: m.text == "Нужна доставка")
+    @router.text("Нужна доставка")
     def existing_need_delivery(message):
         session = get_session(message.from_user.id)
         if not session or session.get("state") != "WAIT_EXISTING_DELIVERY_DECISION":
@@ -467,7 +478,7 @@ def main() -> None:
             )
             return
 
-        action_title = session["data"]["existing_action"]["title"].lower()
+        action_title = existing_actions[session["data"]["existing_action"]]["title"].lower()
         session["state"] = "WAIT_EXISTING_ADDRESS"
         bot.send_message(
             message.chat.id,
@@ -475,7 +486,7 @@ def main() -> None:
             reply_markup=options_keyboard(["Отмена"], include_main_menu=False),
         )
 
-    @bot.message_handler(func=lambda m: m.text == "Заберу сам")
+    @router.text("Заберу сам")
     def existing_self_service(message):
         session = get_session(message.from_user.id)
         if not session or session.get("state") != "WAIT_EXISTING_DELIVERY_DECISION":
@@ -486,9 +497,9 @@ def main() -> None:
             )
             return
 
-        selected_rent = session["data"]["selected_rent"]
-        action = session["data"]["existing_action"]
-        database = db_reader()
+        selected_rent = session_rent(session)
+        action = existing_actions[session["data"]["existing_action"]]
+        database = db_snapshot()
         selected_cell = get_cell_by_number(database, selected_rent.get("cell_number"))
         warehouse_name, warehouse_address = get_warehouse_address(database, selected_cell)
 
@@ -536,7 +547,7 @@ def main() -> None:
             )
 
 
-    @bot.message_handler(func=lambda m: m.text == 'Правила хранения')
+    @router.text('Правила хранения')
     def storage_rules(message):
         text = (
             'Что можно хранить:\n'
@@ -555,19 +566,97 @@ def main() -> None:
         bot.send_message(message.chat.id, text, reply_markup=get_main_menu(message.from_user.id))
 
 
-    @bot.message_handler(commands=['run_reminders'])
+    @router.command('run_reminders')
     def run_reminders_command(message):
         if str(message.from_user.id) != str(admin_id):
             bot.send_message(message.chat.id, 'Команда доступна только оператору.')
             return
 
-        result = process_rent_reminders(bot, chat_id)
+        if background_jobs.stats().get("run_reminders"):
+            bot.send_message(message.chat.id, "Напоминания уже рассылаются, дождитесь итога.")
+            return
+
+        def run():
+            result = process_rent_reminders(bot, chat_id)
+            bot.send_message(
+                message.chat.id,
+                f"Готово.\nTelegram: {result['sent']}\nEmail: {result['email_sent']}\nОшибки: {result['errors']}"
+            )
+
+        background_jobs.submit("run_reminders", run)
+        bot.send_message(message.chat.id, "Рассылка напоминаний запущена, итог придет отдельным сообщением.")
+
+    @router.command('reminder_stats')
+    def reminder_stats_command(message):
+        if str(message.from_user.id) != str(admin_id):
+            bot.send_message(message.chat.id, 'Команда доступна только оператору.')
+            return
+
+        parts = (message.text or "").split()
+        limit = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 10
+        bot.send_message(
+            message.chat.id,
+            format_run_stats(load_run_stats(limit=limit), smtp_latency_stats()),
+            reply_markup=get_main_menu(message.from_user.id),
+        )
+
+    @router.command('dispatch_stats')
+    def dispatch_stats_command(message):
+        if str(message.from_user.id) != str(admin_id):
+            bot.send_message(message.chat.id, 'Команда доступна только оператору.')
+            return
+
+        text = format_dispatch_stats(dispatcher.stats())
+        cache = db_cache_stats()
+        text += (
+            f"\n\nКеш БД: попаданий {cache['hits']}, перечитываний {cache['misses']}, "
+            f"версия снимка {cache['version']}"
+        )
+        running_jobs = background_jobs.stats()
+        if running_jobs:
+            text += "\n\nФоновые задачи: " + ", ".join(f"{name} — {count}" for name, count in running_jobs.items())
         bot.send_message(
             message.chat.id,
-            f"Готово.\nTelegram: {result['sent']}\nEmail: {result['email_sent']}\nОшибки: {result['errors']}"
+            text,
+            reply_markup=get_main_menu(message.from_user.id),
         )
 
-    @bot.message_handler(func=lambda m: m.text == "Команды оператора")
+    @router.command('simulate_reminders')
+    def simulate_reminders_command(message):
+        if str(message.from_user.id) != str(admin_id):
+            bot.send_message(message.chat.id, 'Команда доступна только оператору.')
+            return
+
+        parts = (message.text or "").split()
+        start_date = parse_iso_date(parts[1]) if len(parts) > 1 else date.today()
+        end_date = parse_iso_date(parts[2]) if len(parts) > 2 else start_date + timedelta(days=30)
+        if start_date is None or end_date is None or end_date < start_date:
+            bot.send_message(message.chat.id, "Формат: /simulate_reminders [ГГГГ-ММ-ДД] [ГГГГ-ММ-ДД]")
+            return
+
+        def simulate():
+            planned = simulate_reminders(start_date, end_date)
+            summary = summarize_simulation(planned)
+            lines = [
+                f"Напоминания с {start_date.isoformat()} по {end_date.isoformat()} (без отправки):",
+                f"Всего: {summary['total']}",
+                "По каналам: " + ", ".join(f"{channel} — {count}" for channel, count in summary['by_channel'].items()),
+                "По типам: " + ", ".join(f"{reminder_type} — {count}" for reminder_type, count in sorted(summary['by_type'].items())),
+                "",
+            ]
+            for entry in planned[:20]:
+                rate_text = f", тариф {entry['daily_rate']} руб./день" if entry['daily_rate'] is not None else ""
+                lines.append(
+                    f"{entry['date']} {entry['qr_code']} {entry['reminder_type']} "
+                    f"({'+'.join(entry['channels'])}{rate_text})"
+                )
+            if len(planned) > 20:
+                lines.append(f"... и еще {len(planned) - 20}")
+            bot.send_message(message.chat.id, "\n".join(lines), reply_markup=get_main_menu(message.from_user.id))
+
+        background_jobs.submit("simulate_reminders", simulate)
+
+    @router.text("Команды оператора")
     def operator_commands_help(message):
         if str(message.from_user.id) != str(admin_id):
             bot.send_message(message.chat.id, 'Раздел доступен только оператору.', reply_markup=get_main_menu(message.from_user.id))
@@ -594,7 +683,17 @@ def main() -> None:
             "9. Запустить напоминания вручную:\n"
             "/run_reminders\n\n"
             "10. Отправить ручное напоминание клиенту (TG + email):\n"
-            "/operator_reminder QR-IVAN-M101-2026 14"
+            "/operator_reminder QR-IVAN-M101-2026 14\n\n"
+            "11. Очередь писем и недоставленные письма:\n"
+            "/outbox\n\n"
+            "12. Какие напоминания уйдут за период (без отправки):\n"
+            "/simulate_reminders 2026-05-01 2026-05-31\n\n"
+            "13. Статистика последних запусков напоминаний:\n"
+            "/reminder_stats 10\n\n"
+            "14. Очереди обработки сообщений по потокам:\n"
+            "/dispatch_stats\n\n"
+            "15. Найти заявку в архиве:\n"
+            "/archived_order 5"
         )
         bot.send_message(
             message.chat.id,
@@ -602,7 +701,7 @@ def main() -> None:
             reply_markup=get_main_menu(message.from_user.id),
         )
 
-    @bot.message_handler(commands=['operator_reminder'])
+    @router.command('operator_reminder')
     def operator_reminder(message):
         if str(message.from_user.id) != str(admin_id):
             bot.send_message(message.chat.id, 'Команда доступна только оператору.')
@@ -629,11 +728,8 @@ def main() -> None:
             )
             return
 
-        database = db_reader()
-        agreement = next(
-            (rent for rent in database.get("rental_agreements", []) if rent.get("qr_code") == qr_code),
-            None,
-        )
+        database = db_snapshot()
+        agreement = find_agreement(database, qr_code)
         if agreement is None:
             bot.send_message(
                 message.chat.id,
@@ -643,10 +739,7 @@ def main() -> None:
             return
 
         user_id = agreement.get("user_telegram_id")
-        user = next(
-            (item for item in database.get("users", []) if item.get("telegram_id") == user_id),
-            {}
-        )
+        user = find_user(database, user_id) or {}
         user_name = user.get("full_name") or "Клиент"
         user_email = user.get("email")
         days_text = (
@@ -664,53 +757,79 @@ def main() -> None:
         )
 
         tg_ok = False
-        email_ok = False
-        email_error = ""
         if user_id:
             try:
-                bot.send_message(user_id, reminder_text)
+                bot.send_message(user_id, reminder_text, wait=True)
                 tg_ok = True
             except Exception:
                 tg_ok = False
         if user_email:
-            email_ok, email_error = send_yandex_email_detailed(
+            enqueue_email(
                 user_email,
                 f"SelfStorage: ручное напоминание по договору {agreement.get('qr_code')}",
                 reminder_text,
+                dedup_key=f"operator_reminder:{message.chat.id}:{message.message_id}",
             )
 
         bot.send_message(
             message.chat.id,
             "Ручное напоминание выполнено.\n"
             f"Telegram клиенту: {'успешно' if tg_ok else 'ошибка'}\n"
-            f"Email клиенту: {'успешно' if email_ok else ('пропущен (email не указан)' if not user_email else f'ошибка ({email_error})')}",
+            f"Email клиенту: {'поставлен в очередь отправки' if user_email else 'пропущен (email не указан)'}",
             reply_markup=get_main_menu(message.from_user.id),
         )
 
+    @router.command('outbox')
+    def outbox_status(message):
+        if str(message.from_user.id) != str(admin_id):
+            bot.send_message(message.chat.id, 'Команда доступна только оператору.')
+            return
+
+        parts = (message.text or "").split()
+        if len(parts) > 1 and parts[1] == "retry":
+            requeued = requeue_dead()
+            bot.send_message(message.chat.id, f"Возвращено в очередь писем: {requeued}")
+            return
+
+        stats = outbox_stats()
+        lines = [
+            "Очередь писем:",
+            f"Ожидают отправки: {stats['pending']}",
+            f"Отправляются: {stats['sending']}",
+            f"Отправлены: {stats['sent']}",
+            f"Не доставлены: {stats['dead']}",
+            f"Самое старое в очереди: {stats['oldest_pending_seconds']} сек.",
+        ]
+        for message_id, recipient, subject, attempts, last_error in dead_letters(limit=5):
+            lines.append(f"\n#{message_id} {recipient} — {subject}\nПопыток: {attempts}. Ошибка: {last_error}")
+        if stats['dead']:
+            lines.append("\nПовторить недоставленные: /outbox retry")
+        bot.send_message(message.chat.id, "\n".join(lines), reply_markup=get_main_menu(message.from_user.id))
+
 
-    @bot.message_handler(commands=['orders'])
+    @router.command('orders')
     def orders_count(message):
         if str(message.from_user.id) != str(admin_id):
             bot.send_message(message.chat.id, 'Команда доступна только оператору.')
             return
         else:
-            database = db_reader()
+            database = db_snapshot()
             rent_orders = database["rental_agreements"]
-            orders_count = len(rent_orders)
+            orders_count = len(rent_orders) + archive_summary(database)["counts"].get("rental_agreements", 0)
             bot.send_message(
                 message.chat.id,
                 f'Количество заказов на аренду на данный момент: {orders_count}',
                 reply_markup=get_main_menu(message.from_user.id)
                 )
 
-    @bot.message_handler(commands=['pending_orders'])
+    @router.command('pending_orders')
     def pending_orders(message):
         if str(message.from_user.id) != str(admin_id):
             bot.send_message(message.chat.id, 'Команда доступна только оператору.')
             return
         send_pending_orders(message)
 
-    @bot.message_handler(func=lambda m: m.text == "Новые заявки")
+    @router.text("Новые заявки")
     def pending_orders_button(message):
         if str(message.from_user.id) != str(admin_id):
             bot.send_message(message.chat.id, 'Раздел доступен только оператору.', reply_markup=get_main_menu(message.from_user.id))
@@ -718,12 +837,11 @@ def main() -> None:
         send_pending_orders(message)
 
     def send_pending_orders(message):
-        database = db_reader()
-        pending = []
-        for idx, order in enumerate(database.get("delivery_requests", []), start=1):
-            if order.get("status") != "pending":
-                continue
-            pending.append((order_id_from_record(order, idx), order))
+        database = db_snapshot()
+        pending = [
+            (order_id_from_record(order, position + 1), order)
+            for position, order in requests_by_status(database, "pending")
+        ]
 
         if not pending:
             bot.send_message(
@@ -754,14 +872,14 @@ def main() -> None:
             reply_markup=get_main_menu(message.from_user.id),
         )
 
-    @bot.message_handler(commands=['approved_orders'])
+    @router.command('approved_orders')
     def approved_orders(message):
         if str(message.from_user.id) != str(admin_id):
             bot.send_message(message.chat.id, 'Команда доступна только оператору.')
             return
         send_approved_orders(message)
 
-    @bot.message_handler(func=lambda m: m.text == "Подтверждённые заказы")
+    @router.text("Подтверждённые заказы")
     def approved_orders_button(message):
         if str(message.from_user.id) != str(admin_id):
             bot.send_message(message.chat.id, 'Раздел доступен только оператору.', reply_markup=get_main_menu(message.from_user.id))
@@ -769,7 +887,7 @@ def main() -> None:
         send_approved_orders(message)
 
     def send_approved_orders(message):
-        database = db_reader()
+        database = db_snapshot()
         active_agreements = [
             rent for rent in database.get("rental_agreements", [])
             if rent.get("status") == "Активна"
@@ -806,81 +924,57 @@ def main() -> None:
             reply_markup=get_main_menu(message.from_user.id),
         )
 
-    @bot.message_handler(commands=['approve_order'])
-    def approve_order(message):
+    def missing_order_text(database, target_order_id):
+        # Архив здесь не читается: функция вызывается внутри транзакции.
+        issued = database.get("sequences", {}).get("order_id")
+        if isinstance(issued, int) and isinstance(target_order_id, int) and 0 < target_order_id <= issued:
+            return (
+                f"Заявки #{target_order_id} нет в рабочей БД, возможно, она в архиве: "
+                f"/archived_order {target_order_id}"
+            )
+        return f"Заявка #{target_order_id} не найдена."
+
+    @router.command('archived_order')
+    def archived_order(message):
         if str(message.from_user.id) != str(admin_id):
             bot.send_message(message.chat.id, 'Команда доступна только оператору.')
             return
 
         parts = (message.text or "").split()
         if len(parts) != 2 or not parts[1].isdigit():
-            bot.send_message(
-                message.chat.id,
-                "Формат: /approve_order <id>\nПример: /approve_order 5",
-                reply_markup=get_main_menu(message.from_user.id),
-            )
+            bot.send_message(message.chat.id, "Формат: /archived_order <id>")
             return
 
         target_order_id = int(parts[1])
-        database = read_db_synced()
-        delivery_requests = database.get("delivery_requests", [])
-        order = None
-        for idx, item in enumerate(delivery_requests, start=1):
-            current_id = order_id_from_record(item, idx)
-            if current_id == target_order_id:
-                order = item
-                break
-
+        order = find_archived("delivery_requests", "order_id", target_order_id)
         if order is None:
-            bot.send_message(
-                message.chat.id,
-                f"Заявка #{target_order_id} не найдена.",
-                reply_markup=get_main_menu(message.from_user.id),
-            )
+            bot.send_message(message.chat.id, f"Заявки #{target_order_id} нет и в архиве.")
             return
+        bot.send_message(
+            message.chat.id,
+            f"Заявка #{target_order_id} (в архиве): статус {order.get('status')}, "
+            f"тип {order.get('request_type')}, клиент {order.get('user_telegram_id')}",
+            reply_markup=get_main_menu(message.from_user.id),
+        )
+
+    def approve_order_in_db(database, target_order_id, approved_by):
+        order = find_order(database, target_order_id)
+
+        if order is None:
+            return missing_order_text(database, target_order_id), None
 
         if order.get("status") != "pending":
-            bot.send_message(
-                message.chat.id,
-                f"Заявка #{target_order_id} уже в статусе {order.get('status')}.",
-                reply_markup=get_main_menu(message.from_user.id),
-            )
-            return
+            return f"Заявка #{target_order_id} уже в статусе {order.get('status')}.", None
 
         request_type = order.get("request_type")
         if request_type not in {"pickup", "self_dropoff"}:
             order["status"] = "approved"
             order["approved_at"] = utc_now_iso()
-            save_database(database)
-            bot.send_message(
-                message.chat.id,
-                f"Заявка #{target_order_id} подтверждена (без создания аренды для типа {request_type}).",
-                reply_markup=get_main_menu(message.from_user.id),
-            )
-            return
-
-        requested_size = order.get("volume_code")
-        chosen_cell = None
-        for cell in database.get("cells", []):
-            if cell.get("is_occupied"):
-                continue
-            if requested_size and cell.get("cell_size_code") != requested_size:
-                continue
-            chosen_cell = cell
-            break
-        if chosen_cell is None:
-            for cell in database.get("cells", []):
-                if not cell.get("is_occupied"):
-                    chosen_cell = cell
-                    break
+            return None, {"order": order, "agreement": None, "cell": None}
 
+        chosen_cell = allocate_cell(database, cell_size_code=order.get("volume_code") or None)
         if chosen_cell is None:
-            bot.send_message(
-                message.chat.id,
-                "Нет свободных ячеек для подтверждения заявки.",
-                reply_markup=get_main_menu(message.from_user.id),
-            )
-            return
+            return "Нет свободных ячеек для подтверждения заявки.", None
 
         cell_size_code = chosen_cell.get("cell_size_code")
         monthly_price = find_monthly_price(database, cell_size_code)
@@ -910,7 +1004,6 @@ def main() -> None:
             "created_at": utc_now_iso(),
         }
         database.setdefault("rental_agreements", []).append(agreement)
-        chosen_cell["is_occupied"] = True
         database.setdefault("items", []).append(
             {
                 "rental_agreement_qr_code": qr_code,
@@ -925,10 +1018,49 @@ def main() -> None:
 
         order["status"] = "approved"
         order["approved_at"] = utc_now_iso()
-        order["approved_by"] = message.from_user.id
+        order["approved_by"] = approved_by
         order["rental_agreement_qr_code"] = qr_code
         order["order_id"] = target_order_id
-        save_database(database)
+        return None, {"order": order, "agreement": agreement, "cell": chosen_cell}
+
+    @router.command('approve_order')
+    def approve_order(message):
+        if str(message.from_user.id) != str(admin_id):
+            bot.send_message(message.chat.id, 'Команда доступна только оператору.')
+            return
+
+        parts = (message.text or "").split()
+        if len(parts) != 2 or not parts[1].isdigit():
+            bot.send_message(
+                message.chat.id,
+                "Формат: /approve_order <id>\nПример: /approve_order 5",
+                reply_markup=get_main_menu(message.from_user.id),
+            )
+            return
+
+        target_order_id = int(parts[1])
+        error_text, result = run_in_transaction(approve_order_in_db, target_order_id, message.from_user.id)
+        if error_text:
+            bot.send_message(
+                message.chat.id,
+                error_text,
+                reply_markup=get_main_menu(message.from_user.id),
+            )
+            return
+
+        order = result["order"]
+        if result["agreement"] is None:
+            bot.send_message(
+                message.chat.id,
+                f"Заявка #{target_order_id} подтверждена (без создания аренды для типа {order.get('request_type')}).",
+                reply_markup=get_main_menu(message.from_user.id),
+            )
+            return
+
+        agreement = result["agreement"]
+        chosen_cell = result["cell"]
+        cell_size_code = chosen_cell.get("cell_size_code")
+        qr_code = agreement["qr_code"]
 
         bot.send_message(
             message.chat.id,
@@ -953,7 +1085,44 @@ def main() -> None:
             except Exception:
                 pass
 
-    @bot.message_handler(commands=['complete_order'])
+    def complete_order_in_db(database, target_order_id, completed_by):
+        order = find_order(database, target_order_id)
+
+        if order is None:
+            return missing_order_text(database, target_order_id), None
+
+        current_status = order.get("status")
+        if current_status in {"completed", "rejected"}:
+            return f"Заявка #{target_order_id} уже в статусе {current_status}.", None
+
+        request_type = str(order.get("request_type") or "")
+        if current_status != "approved":
+            return (
+                f"Заявка #{target_order_id} должна быть сначала подтверждена командой /approve_order {target_order_id}. "
+                f"Текущий статус: {current_status}."
+            ), None
+
+        agreement_qr = order.get("item_rental_agreement_qr_code") or order.get("rental_agreement_qr_code")
+        agreement = find_agreement(database, agreement_qr) if agreement_qr else None
+
+        freed_cell_number = None
+        if request_type.startswith("full_takeout_") and agreement:
+            agreement["status"] = "Закончена"
+            agreement["end_date"] = date.today().isoformat()
+            cell = release_cell(database, agreement.get("cell_number"))
+            if cell is not None:
+                freed_cell_number = cell.get("number")
+            for item in agreement_items(database, agreement_qr):
+                if item.get("removed_at") is None:
+                    item["removed_at"] = utc_now_iso()
+                    item["updated_at"] = utc_now_iso()
+
+        order["status"] = "completed"
+        order["completed_at"] = utc_now_iso()
+        order["completed_by"] = completed_by
+        return None, {"order": order, "freed_cell_number": freed_cell_number}
+
+    @router.command('complete_order')
     def complete_order(message):
         if str(message.from_user.id) != str(admin_id):
             bot.send_message(message.chat.id, 'Команда доступна только оператору.')
@@ -969,67 +1138,18 @@ def main() -> None:
             return
 
         target_order_id = int(parts[1])
-        database = db_reader()
-        order = None
-        for idx, item in enumerate(database.get("delivery_requests", []), start=1):
-            if order_id_from_record(item, idx) == target_order_id:
-                order = item
-                break
-
-        if order is None:
-            bot.send_message(
-                message.chat.id,
-                f"Заявка #{target_order_id} не найдена.",
-                reply_markup=get_main_menu(message.from_user.id),
-            )
-            return
-
-        current_status = order.get("status")
-        if current_status in {"completed", "rejected"}:
+        error_text, result = run_in_transaction(complete_order_in_db, target_order_id, message.from_user.id)
+        if error_text:
             bot.send_message(
                 message.chat.id,
-                f"Заявка #{target_order_id} уже в статусе {current_status}.",
+                error_text,
                 reply_markup=get_main_menu(message.from_user.id),
             )
             return
 
+        order = result["order"]
         request_type = str(order.get("request_type") or "")
-        if current_status != "approved":
-            bot.send_message(
-                message.chat.id,
-                f"Заявка #{target_order_id} должна быть сначала подтверждена командой /approve_order {target_order_id}. "
-                f"Текущий статус: {current_status}.",
-                reply_markup=get_main_menu(message.from_user.id),
-            )
-            return
-
-        agreement_qr = order.get("item_rental_agreement_qr_code") or order.get("rental_agreement_qr_code")
-        agreement = None
-        if agreement_qr:
-            agreement = next(
-                (rent for rent in database.get("rental_agreements", []) if rent.get("qr_code") == agreement_qr),
-                None
-            )
-
-        freed_cell_number = None
-        if request_type.startswith("full_takeout_") and agreement:
-            agreement["status"] = "Закончена"
-            agreement["end_date"] = date.today().isoformat()
-            cell_number = agreement.get("cell_number")
-            for cell in database.get("cells", []):
-                if cell.get("number") == cell_number:
-                    cell["is_occupied"] = False
-                    freed_cell_number = cell_number
-                    break
-            for item in database.get("items", []):
-                if item.get("rental_agreement_qr_code") == agreement_qr and item.get("removed_at") is None:
-                    item["removed_at"] = utc_now_iso()
-                    item["updated_at"] = utc_now_iso()
-
-        order["status"] = "completed"
-        order["completed_at"] = utc_now_iso()
-        order["completed_by"] = message.from_user.id
-        save_database(database)
+        freed_cell_number = result["freed_cell_number"]
 
         result_text = f"Заявка #{target_order_id} переведена в completed."
         if freed_cell_number:
@@ -1053,7 +1173,22 @@ def main() -> None:
             except Exception:
                 pass
 
-    @bot.message_handler(commands=['reject_order'])
+    def reject_order_in_db(database, target_order_id, rejected_by, reason):
+        order = find_order(database, target_order_id)
+
+        if order is None:
+            return missing_order_text(database, target_order_id), None
+
+        if order.get("status") == "approved":
+            return f"Заявка #{target_order_id} уже подтверждена и не может быть отменена этой командой.", None
+
+        order["status"] = "rejected"
+        order["rejected_at"] = utc_now_iso()
+        order["rejected_by"] = rejected_by
+        order["rejection_reason"] = reason
+        return None, order
+
+    @router.command('reject_order')
     def reject_order(message):
         if str(message.from_user.id) != str(admin_id):
             bot.send_message(message.chat.id, 'Команда доступна только оператору.')
@@ -1078,36 +1213,15 @@ def main() -> None:
             )
             return
 
-        database = db_reader()
-        order = None
-        for idx, item in enumerate(database.get("delivery_requests", []), start=1):
-            current_id = order_id_from_record(item, idx)
-            if current_id == target_order_id:
-                order = item
-                break
-
-        if order is None:
-            bot.send_message(
-                message.chat.id,
-                f"Заявка #{target_order_id} не найдена.",
-                reply_markup=get_main_menu(message.from_user.id),
-            )
-            return
-
-        if order.get("status") == "approved":
+        error_text, order = run_in_transaction(reject_order_in_db, target_order_id, message.from_user.id, reason)
+        if error_text:
             bot.send_message(
                 message.chat.id,
-                f"Заявка #{target_order_id} уже подтверждена и не может быть отменена этой командой.",
+                error_text,
                 reply_markup=get_main_menu(message.from_user.id),
             )
             return
 
-        order["status"] = "rejected"
-        order["rejected_at"] = utc_now_iso()
-        order["rejected_by"] = message.from_user.id
-        order["rejection_reason"] = reason
-        save_database(database)
-
         bot.send_message(
             message.chat.id,
             f"Заявка #{target_order_id} отменена.\nПричина: {reason}",
@@ -1126,7 +1240,7 @@ def main() -> None:
             except Exception:
                 pass
 
-    @bot.message_handler(commands=['ads_report'])
+    @router.command('ads_report')
     def ads_report(message):
         if str(message.from_user.id) != str(admin_id):
             bot.send_message(message.chat.id, 'Команда доступна только оператору.')
@@ -1134,7 +1248,7 @@ def main() -> None:
 
         send_ads_report(message)
 
-    @bot.message_handler(func=lambda m: m.text == "Отчёт по рекламе")
+    @router.text("Отчёт по рекламе")
     def ads_report_button(message):
         if str(message.from_user.id) != str(admin_id):
             bot.send_message(message.chat.id, 'Раздел доступен только оператору.', reply_markup=main_menu())
@@ -1143,7 +1257,7 @@ def main() -> None:
         send_ads_report(message)
 
     def send_ads_report(message):
-        database = db_reader()
+        database = db_snapshot()
         users_by_id = {
             user.get("telegram_id"): user
             for user in database.get("users", [])
@@ -1154,6 +1268,7 @@ def main() -> None:
             for order in database.get("delivery_requests", [])
             if order.get("user_telegram_id") is not None
         }
+        ordered_users.update(archive_summary(database)["order_users"])
         if not ordered_users:
             bot.send_message(
                 message.chat.id,
@@ -1181,7 +1296,7 @@ def main() -> None:
             reply_markup=get_main_menu(message.from_user.id),
         )
 
-    @bot.message_handler(commands=['overdue_calls'])
+    @router.command('overdue_calls')
     def overdue_contacts(message):
         if str(message.from_user.id) != str(admin_id):
             bot.send_message(message.chat.id, 'Команда доступна только оператору.')
@@ -1189,7 +1304,7 @@ def main() -> None:
 
         send_overdue_contacts(message)
 
-    @bot.message_handler(func=lambda m: m.text == "Просрочки (обзвон)")
+    @router.text("Просрочки (обзвон)")
     def overdue_contacts_button(message):
         if str(message.from_user.id) != str(admin_id):
             bot.send_message(message.chat.id, 'Раздел доступен только оператору.', reply_markup=main_menu())
@@ -1198,7 +1313,7 @@ def main() -> None:
         send_overdue_contacts(message)
 
     def send_overdue_contacts(message):
-        database = db_reader()
+        database = db_snapshot()
         today = date.today()
         users_by_id = {
             user.get("telegram_id"): user
@@ -1207,29 +1322,23 @@ def main() -> None:
         }
         overdue_rents = []
 
-        for rent in database.get("rental_agreements", []):
-            if rent.get("status") != "Активна":
-                continue
-
-            end_date_raw = rent.get("end_date")
-            try:
-                end_date = datetime.strptime(end_date_raw, "%Y-%m-%d").date()
-            except (TypeError, ValueError):
+        for rent in load_models(database, "rental_agreements"):
+            if rent.status != "Активна" or rent.end_date is None:
                 continue
 
-            days_overdue = (today - end_date).days
+            days_overdue = (today - rent.end_date).days
             if days_overdue <= 0:
                 continue
 
-            user = users_by_id.get(rent.get("user_telegram_id"), {})
+            user = users_by_id.get(rent.user_telegram_id, {})
             overdue_rents.append(
                 {
                     "days_overdue": days_overdue,
                     "full_name": user.get("full_name") or "Неизвестный клиент",
                     "phone": user.get("phone") or "Телефон не указан",
-                    "qr_code": rent.get("qr_code") or "—",
-                    "cell_number": rent.get("cell_number") or "—",
-                    "end_date": end_date_raw,
+                    "qr_code": rent.qr_code or "—",
+                    "cell_number": rent.cell_number or "—",
+                    "end_date": rent.end_date.isoformat(),
                 }
             )
 
@@ -1267,9 +1376,8 @@ def main() -> None:
         bot.send_message(message.chat.id, "Список отправлен.", reply_markup=get_main_menu(message.from_user.id))
 
 
-    @bot.message_handler(func=lambda m: True)
+    @router.default
     def pickup_flow(message):
-        database = db_reader()
         user_text = (message.text or '').strip()
         user_id = message.from_user.id
 
@@ -1291,480 +1399,546 @@ def main() -> None:
             )
             return
 
-        state = session['state']
+        router.dispatch_state(message, session)
 
-        if state == 'WAIT_ADDRESS':
-            if len(user_text) < 8:
-                bot.send_message(message.chat.id, 'Адрес слишком короткий. Введите подробнее:')
-                return
+    @router.state('WAIT_ADDRESS')
+    def state_wait_address(message, session):
+        user_text = (message.text or '').strip()
 
-            session['data']['address'] = user_text
-            session['state'] = 'WAIT_PHONE'
-            bot.send_message(message.chat.id, 'Введите телефон в формате +79991234567:')
+        if len(user_text) < 8:
+            bot.send_message(message.chat.id, 'Адрес слишком короткий. Введите подробнее:')
             return
 
-        if state == "WAIT_EXISTING_RENT_SELECT":
-            selected_rent = session["data"]["rent_map"].get(user_text)
-            if not selected_rent:
-                bot.send_message(message.chat.id, 'Выберите договор кнопкой из списка.')
-                return
+        session['data']['address'] = user_text
+        session['state'] = 'WAIT_PHONE'
+        bot.send_message(message.chat.id, 'Введите телефон в формате +79991234567:')
 
-            session["data"]["selected_rent"] = selected_rent
-            session["state"] = "WAIT_EXISTING_DELIVERY_DECISION"
-            action = session["data"]["existing_action"]
-            text = (
-                f"{action['title']}\n"
-                f"Договор: {selected_rent.get('qr_code')}\n"
-                f"Ячейка: {selected_rent.get('cell_number')}\n\n"
-                'Можно оформить доставку (курьер) или выполнить действие самостоятельно.\n'
-                'Как Вам удобнее?'
-            )
-            bot.send_message(message.chat.id, text, reply_markup=delivery_decision())
+    @router.state('WAIT_EXISTING_RENT_SELECT')
+    def state_wait_existing_rent_select(message, session):
+        user_text = (message.text or '').strip()
+
+        selected_qr_code = session["data"]["rent_map"].get(user_text)
+        selected_rent = find_agreement(db_snapshot(), selected_qr_code) if selected_qr_code else None
+        if not selected_rent:
+            bot.send_message(message.chat.id, 'Выберите договор кнопкой из списка.')
             return
 
-        if state == "WAIT_EXISTING_ADDRESS":
-            if len(user_text) < 8:
-                bot.send_message(message.chat.id, 'Адрес слишком короткий. Введите подробнее:')
-                return
+        session["data"]["selected_qr_code"] = selected_qr_code
+        session["state"] = "WAIT_EXISTING_DELIVERY_DECISION"
+        action = existing_actions[session["data"]["existing_action"]]
+        text = (
+            f"{action['title']}\n"
+            f"Договор: {selected_rent.get('qr_code')}\n"
+            f"Ячейка: {selected_rent.get('cell_number')}\n\n"
+            'Можно оформить доставку (курьер) или выполнить действие самостоятельно.\n'
+            'Как Вам удобнее?'
+        )
+        bot.send_message(message.chat.id, text, reply_markup=delivery_decision())
+
+    @router.state('WAIT_EXISTING_ADDRESS')
+    def state_wait_existing_address(message, session):
+        user_text = (message.text or '').strip()
 
-            session["data"]["address"] = user_text
-            session["state"] = "WAIT_EXISTING_PHONE"
-            bot.send_message(message.chat.id, 'Введите телефон в формате +79991234567:')
+        if len(user_text) < 8:
+            bot.send_message(message.chat.id, 'Адрес слишком короткий. Введите подробнее:')
             return
 
-        if state == "WAIT_EXISTING_PHONE":
-            if not user_text.startswith('+') or len(user_text) < 8:
-                bot.send_message(message.chat.id, 'Неверный формат. Пример: +79991234567')
-                return
+        session["data"]["address"] = user_text
+        session["state"] = "WAIT_EXISTING_PHONE"
+        bot.send_message(message.chat.id, 'Введите телефон в формате +79991234567:')
 
-            session["data"]["phone"] = user_text
-            session["state"] = "CONFIRM_EXISTING"
-            action = session["data"]["existing_action"]
-            selected_rent = session["data"]["selected_rent"]
-            bot.send_message(
-                message.chat.id,
-                'Проверьте заявку:\n'
-                f"Тип: {action['title']}\n"
-                f"Договор: {selected_rent.get('qr_code')}\n"
-                f"Ячейка: {selected_rent.get('cell_number')}\n"
-                f"Адрес доставки: {session['data']['address']}\n"
-                f"Телефон: {session['data']['phone']}\n\n"
-                'Нажмите ДА для подтверждения или НЕТ для отмены',
-                reply_markup=confirm_request(),
-            )
+    @router.state('WAIT_EXISTING_PHONE')
+    def state_wait_existing_phone(message, session):
+        user_text = (message.text or '').strip()
+
+        if not user_text.startswith('+') or len(user_text) < 8:
+            bot.send_message(message.chat.id, 'Неверный формат. Пример: +79991234567')
             return
 
-        if state == "WAIT_LEGAL_RACKS":
-            try:
-                racks_count = int(user_text)
-            except ValueError:
-                bot.send_message(message.chat.id, 'Введите целое число, например 3.')
-                return
-            if racks_count <= 0:
-                bot.send_message(message.chat.id, 'Количество стеллажей должно быть больше нуля.')
-                return
+        session["data"]["phone"] = user_text
+        session["state"] = "CONFIRM_EXISTING"
+        action = existing_actions[session["data"]["existing_action"]]
+        selected_rent = session_rent(session)
+        bot.send_message(
+            message.chat.id,
+            'Проверьте заявку:\n'
+            f"Тип: {action['title']}\n"
+            f"Договор: {selected_rent.get('qr_code')}\n"
+            f"Ячейка: {selected_rent.get('cell_number')}\n"
+            f"Адрес доставки: {session['data']['address']}\n"
+            f"Телефон: {session['data']['phone']}\n\n"
+            'Нажмите ДА для подтверждения или НЕТ для отмены',
+            reply_markup=confirm_request(),
+        )
+
+    @router.state('WAIT_LEGAL_RACKS')
+    def state_wait_legal_racks(message, session):
+        user_text = (message.text or '').strip()
 
-            session["data"]["racks_count"] = racks_count
-            session["state"] = "WAIT_LEGAL_MONTHS"
-            bot.send_message(message.chat.id, 'Введите срок аренды в месяцах (например 6):')
+        try:
+            racks_count = int(user_text)
+        except ValueError:
+            bot.send_message(message.chat.id, 'Введите целое число, например 3.')
+            return
+        if racks_count <= 0:
+            bot.send_message(message.chat.id, 'Количество стеллажей должно быть больше нуля.')
             return
 
-        if state == "WAIT_LEGAL_MONTHS":
-            try:
-                rent_months = int(user_text)
-            except ValueError:
-                bot.send_message(message.chat.id, 'Введите целое число месяцев, например 6.')
-                return
-            if rent_months <= 0:
-                bot.send_message(message.chat.id, 'Срок аренды должен быть больше нуля.')
-                return
-
-            session["data"]["rent_months"] = rent_months
-            session["state"] = "WAIT_LEGAL_PHONE"
-            bot.send_message(message.chat.id, 'Введите телефон контактного лица в формате +79991234567:')
-            return
-
-        if state == "WAIT_LEGAL_PHONE":
-            if not user_text.startswith('+') or len(user_text) < 8:
-                bot.send_message(message.chat.id, 'Неверный формат. Пример: +79991234567')
-                return
-
-            session["data"]["phone"] = user_text
-            session["state"] = "WAIT_LEGAL_EMAIL"
-            bot.send_message(message.chat.id, 'Введите email контактного лица:')
-            return
-
-        if state == "WAIT_LEGAL_EMAIL":
-            if not is_valid_email(user_text):
-                bot.send_message(message.chat.id, 'Неверный email. Пример: name@example.com')
-                return
-
-            session["data"]["email"] = user_text.strip()
-            monthly_total = session["data"]["racks_count"] * legal_rack_monthly_price
-            full_total = monthly_total * session["data"]["rent_months"]
-            session["data"]["expected_monthly_price"] = monthly_total
-            session["data"]["expected_total_price"] = full_total
-            session["state"] = "CONFIRM_LEGAL"
-            bot.send_message(
-                message.chat.id,
-                'Проверьте заявку на хранение документов:\n'
-                f"Количество стеллажей: {session['data']['racks_count']}\n"
-                f"Срок аренды: {session['data']['rent_months']} мес.\n"
-                f"Стоимость в месяц: {monthly_total:.2f} руб.\n"
-                f"Общая стоимость: {full_total:.2f} руб.\n"
-                f"Телефон: {session['data']['phone']}\n\n"
-                f"Email: {session['data']['email']}\n\n"
-                'Нажмите ДА для подтверждения или НЕТ для отмены',
-                reply_markup=confirm_request(),
-            )
+        session["data"]["racks_count"] = racks_count
+        session["state"] = "WAIT_LEGAL_MONTHS"
+        bot.send_message(message.chat.id, 'Введите срок аренды в месяцах (например 6):')
+
+    @router.state('WAIT_LEGAL_MONTHS')
+    def state_wait_legal_months(message, session):
+        user_text = (message.text or '').strip()
+
+        try:
+            rent_months = int(user_text)
+        except ValueError:
+            bot.send_message(message.chat.id, 'Введите целое число месяцев, например 6.')
+            return
+        if rent_months <= 0:
+            bot.send_message(message.chat.id, 'Срок аренды должен быть больше нуля.')
             return
 
-        if state == 'WAIT_WAREHOUSE':
-            warehouse_names = {w['name'] for w in session['data'].get('available_warehouses', [])}
-            if user_text not in warehouse_names:
-                bot.send_message(message.chat.id, 'Выберите склад кнопкой из списка.')
-                return
+        session["data"]["rent_months"] = rent_months
+        session["state"] = "WAIT_LEGAL_PHONE"
+        bot.send_message(message.chat.id, 'Введите телефон контактного лица в формате +79991234567:')
 
-            selected_warehouse = next(
-                (w for w in session['data']['available_warehouses'] if w['name'] == user_text),
-                None
-            )
-            session['data']['warehouse_name'] = selected_warehouse['name']
-            session['data']['address'] = selected_warehouse['address']
-            session['state'] = 'WAIT_PHONE'
-            bot.send_message(message.chat.id, 'Введите телефон в формате +79991234567:')
+    @router.state('WAIT_LEGAL_PHONE')
+    def state_wait_legal_phone(message, session):
+        user_text = (message.text or '').strip()
+
+        if not user_text.startswith('+') or len(user_text) < 8:
+            bot.send_message(message.chat.id, 'Неверный формат. Пример: +79991234567')
+            return
+
+        session["data"]["phone"] = user_text
+        session["state"] = "WAIT_LEGAL_EMAIL"
+        bot.send_message(message.chat.id, 'Введите email контактного лица:')
+
+    @router.state('WAIT_LEGAL_EMAIL')
+    def state_wait_legal_email(message, session):
+        user_text = (message.text or '').strip()
+
+        if not is_valid_email(user_text):
+            bot.send_message(message.chat.id, 'Неверный email. Пример: name@example.com')
             return
 
-        if state == 'WAIT_PHONE':
-            if not user_text.startswith('+') or len(user_text) < 8:
-                bot.send_message(message.chat.id, 'Неверный формат. Пример: +79991234567')
-                return
+        session["data"]["email"] = user_text.strip()
+        monthly_total = session["data"]["racks_count"] * legal_rack_monthly_price
+        full_total = monthly_total * session["data"]["rent_months"]
+        session["data"]["expected_monthly_price"] = monthly_total
+        session["data"]["expected_total_price"] = full_total
+        session["state"] = "CONFIRM_LEGAL"
+        bot.send_message(
+            message.chat.id,
+            'Проверьте заявку на хранение документов:\n'
+            f"Количество стеллажей: {session['data']['racks_count']}\n"
+            f"Срок аренды: {session['data']['rent_months']} мес.\n"
+            f"Стоимость в месяц: {monthly_total:.2f} руб.\n"
+            f"Общая стоимость: {full_total:.2f} руб.\n"
+            f"Телефон: {session['data']['phone']}\n\n"
+            f"Email: {session['data']['email']}\n\n"
+            'Нажмите ДА для подтверждения или НЕТ для отмены',
+            reply_markup=confirm_request(),
+        )
+
+    @router.state('WAIT_WAREHOUSE')
+    def state_wait_warehouse(message, session):
+        user_text = (message.text or '').strip()
 
-            session['data']['phone'] = user_text
-            session['state'] = 'WAIT_EMAIL'
-            bot.send_message(message.chat.id, 'Введите email для напоминаний:')
+        selected_warehouse = None
+        if user_text in session['data'].get('warehouse_names', []):
+            selected_warehouse = find_warehouse(db_snapshot(), user_text)
+        if not selected_warehouse:
+            bot.send_message(message.chat.id, 'Выберите склад кнопкой из списка.')
             return
 
-        if state == 'WAIT_EMAIL':
-            if not is_valid_email(user_text):
-                bot.send_message(message.chat.id, 'Неверный email. Пример: name@example.com')
-                return
+        session['data']['warehouse_name'] = selected_warehouse['name']
+        session['data']['address'] = selected_warehouse['address']
+        session['state'] = 'WAIT_PHONE'
+        bot.send_message(message.chat.id, 'Введите телефон в формате +79991234567:')
 
-            session['data']['email'] = user_text.strip()
-            session['state'] = 'WAIT_VOLUME'
-            text = 'Уточните, пожалуйста, какой примерный объем вещей Вы хотите хранить у нас?\n\n'
-            for size in database["cell_sizes"]:
-                text = text + f'{size["code"]} - {size["description"]} ({size["monthly_price"]} руб./мес.)\n'
-            text = text + '\nНажмите на кнопку с подходящим объемом.'
+    @router.state('WAIT_PHONE')
+    def state_wait_phone(message, session):
+        user_text = (message.text or '').strip()
 
-            bot.send_message(message.chat.id, text, reply_markup=choose_volume())
+        if not user_text.startswith('+') or len(user_text) < 8:
+            bot.send_message(message.chat.id, 'Неверный формат. Пример: +79991234567')
             return
 
-        if state == 'WAIT_VOLUME':
-            selected_size = next(
-                (size for size in database.get('cell_sizes', []) if size['code'] == user_text),
-                None
-            )
-            if selected_size is None:
-                bot.send_message(message.chat.id, 'Выберите объём кнопкой: s, m или l.')
-                return
-
-            session['data']['volume'] = user_text
-            session['data']['volume_description'] = selected_size['description']
-            session['data']['expected_monthly_price_base'] = float(selected_size['monthly_price'])
-            session['state'] = 'WAIT_RENT_DAYS'
+        session['data']['phone'] = user_text
+        session['state'] = 'WAIT_EMAIL'
+        bot.send_message(message.chat.id, 'Введите email для напоминаний:')
+
+    @router.state('WAIT_EMAIL')
+    def state_wait_email(message, session):
+        user_text = (message.text or '').strip()
+
+        if not is_valid_email(user_text):
+            bot.send_message(message.chat.id, 'Неверный email. Пример: name@example.com')
+            return
+
+        session['data']['email'] = user_text.strip()
+        session['state'] = 'WAIT_VOLUME'
+        text = 'Уточните, пожалуйста, какой примерный объем вещей Вы хотите хранить у нас?\n\n'
+        database = db_snapshot()
+        for size in database["cell_sizes"]:
+            text = text + f'{size["code"]} - {size["description"]} ({size["monthly_price"]} руб./мес.)\n'
+        text = text + '\nНажмите на кнопку с подходящим объемом.'
+
+        bot.send_message(message.chat.id, text, reply_markup=choose_volume())
+
+    @router.state('WAIT_VOLUME')
+    def state_wait_volume(message, session):
+        user_text = (message.text or '').strip()
+
+        database = db_snapshot()
+        selected_size = next(
+            (size for size in database.get('cell_sizes', []) if size['code'] == user_text),
+            None
+        )
+        if selected_size is None:
+            bot.send_message(message.chat.id, 'Выберите объём кнопкой: s, m или l.')
+            return
+
+        session['data']['volume'] = user_text
+        session['data']['volume_description'] = selected_size['description']
+        session['data']['expected_monthly_price_base'] = float(selected_size['monthly_price'])
+        session['state'] = 'WAIT_RENT_DAYS'
+        bot.send_message(
+            message.chat.id,
+            'Введите срок хранения в днях (например 45):',
+            reply_markup=return_main_menu_keyboard(),
+        )
+
+    @router.state('WAIT_RENT_DAYS')
+    def state_wait_rent_days(message, session):
+        user_text = (message.text or '').strip()
+
+        try:
+            rent_days = int(user_text)
+        except ValueError:
+            bot.send_message(message.chat.id, 'Введите целое число дней, например 45.')
+            return
+
+        if rent_days <= 0:
+            bot.send_message(message.chat.id, 'Срок хранения должен быть больше 0 дней.')
+            return
+
+        if rent_days > 3650:
+            bot.send_message(message.chat.id, 'Слишком большой срок. Введите значение до 3650 дней.')
+            return
+
+        session['data']['rent_days'] = rent_days
+        session['state'] = 'WAIT_PROMO'
+        bot.send_message(
+            message.chat.id,
+            'Если у вас есть промокод, введите его сейчас.\n'
+            'Или нажмите "Пропустить".',
+            reply_markup=promo_decision(),
+        )
+
+    @router.state('WAIT_PROMO')
+    def state_wait_promo(message, session):
+        user_text = (message.text or '').strip()
+
+        promo_input = None if user_text == "Пропустить" else user_text
+        promo = promo_result(promo_input, promo_catalog)
+        base_price = float(session['data'].get('expected_monthly_price_base', 0))
+
+        if promo["status"] == "unknown":
             bot.send_message(
                 message.chat.id,
-                'Введите срок хранения в днях (например 45):',
-                reply_markup=return_main_menu_keyboard(),
+                'Промокод не найден. Проверьте ввод или нажмите "Пропустить".',
+                reply_markup=promo_decision(),
             )
             return
 
-        if state == 'WAIT_RENT_DAYS':
-            try:
-                rent_days = int(user_text)
-            except ValueError:
-                bot.send_message(message.chat.id, 'Введите целое число дней, например 45.')
-                return
+        if promo["status"] == "inactive":
+            bot.send_message(
+                message.chat.id,
+                f"Промокод {promo['code']} неактивен. "
+                f"Период действия: {promo['valid_from']} - {promo['valid_until']}. "
+                'Введите другой код или нажмите "Пропустить".',
+                reply_markup=promo_decision(),
+            )
+            return
 
-            if rent_days <= 0:
-                bot.send_message(message.chat.id, 'Срок хранения должен быть больше 0 дней.')
-                return
+        discount_percent = promo.get("discount_percent", 0)
+        discount_value = round(base_price * discount_percent / 100, 2)
+        final_price = round(base_price - discount_value, 2)
+        rent_days = int(session['data'].get('rent_days', 30))
+        expected_total_price = round((final_price / 30) * rent_days, 2)
+        session['data']['promo_code'] = promo.get("code")
+        session['data']['promo_discount_percent'] = discount_percent
+        session['data']['expected_monthly_price'] = final_price
+        session['data']['expected_total_price'] = expected_total_price
+        session['state'] = 'WAIT_SEASONAL_FLAG'
+        bot.send_message(
+            message.chat.id,
+            'Планируете хранить сезонные вещи?\n'
+            'Выберите вариант кнопкой.',
+            reply_markup=options_keyboard(["Да, сезонные вещи", "Нет, обычные вещи"]),
+        )
 
-            if rent_days > 3650:
-                bot.send_message(message.chat.id, 'Слишком большой срок. Введите значение до 3650 дней.')
-                return
+    @router.state('WAIT_SEASONAL_FLAG')
+    def state_wait_seasonal_flag(message, session):
+        user_text = (message.text or '').strip()
 
-            session['data']['rent_days'] = rent_days
-            session['state'] = 'WAIT_PROMO'
+        if user_text == "Да, сезонные вещи":
+            session['state'] = 'WAIT_SEASONAL_LIST'
             bot.send_message(
                 message.chat.id,
-                'Если у вас есть промокод, введите его сейчас.\n'
-                'Или нажмите "Пропустить".',
-                reply_markup=promo_decision(),
+                'Перечислите все сезонные вещи текстом (через запятую или с новой строки):',
+                reply_markup=return_main_menu_keyboard(),
             )
             return
 
-        if state == 'WAIT_PROMO':
-            promo_input = None if user_text == "Пропустить" else user_text
-            promo = promo_result(promo_input, promo_catalog)
-            base_price = float(session['data'].get('expected_monthly_price_base', 0))
+        if user_text == "Нет, обычные вещи":
+            session['data']['has_seasonal_items'] = False
+            session['data']['seasonal_item_list'] = []
+            session['state'] = 'CONFIRM'
+            send_storage_confirm(message.chat.id, session['data'])
+            return
+
+        bot.send_message(message.chat.id, 'Выберите один из вариантов кнопкой.')
 
-            if promo["status"] == "unknown":
-                bot.send_message(
-                    message.chat.id,
-                    'Промокод не найден. Проверьте ввод или нажмите "Пропустить".',
-                    reply_markup=promo_decision(),
-                )
-                return
+    @router.state('WAIT_SEASONAL_LIST')
+    def state_wait_seasonal_list(message, session):
+        user_text = (message.text or '').strip()
 
-            if promo["status"] == "inactive":
-                bot.send_message(
-                    message.chat.id,
-                    f"Промокод {promo['code']} неактивен. "
-                    f"Период действия: {promo['valid_from']} - {promo['valid_until']}. "
-                    'Введите другой код или нажмите "Пропустить".',
-                    reply_markup=promo_decision(),
-                )
-                return
-
-            discount_percent = promo.get("discount_percent", 0)
-            discount_value = round(base_price * discount_percent / 100, 2)
-            final_price = round(base_price - discount_value, 2)
-            rent_days = int(session['data'].get('rent_days', 30))
-            expected_total_price = round((final_price / 30) * rent_days, 2)
-            session['data']['promo_code'] = promo.get("code")
-            session['data']['promo_discount_percent'] = discount_percent
-            session['data']['expected_monthly_price'] = final_price
-            session['data']['expected_total_price'] = expected_total_price
-            session['state'] = 'WAIT_SEASONAL_FLAG'
+        items = parse_items_list(user_text)
+        if not items:
             bot.send_message(
                 message.chat.id,
-                'Планируете хранить сезонные вещи?\n'
-                'Выберите вариант кнопкой.',
-                reply_markup=options_keyboard(["Да, сезонные вещи", "Нет, обычные вещи"]),
+                'Список пустой. Перечислите вещи через запятую или с новой строки.',
             )
             return
 
-        if state == 'WAIT_SEASONAL_FLAG':
-            if user_text == "Да, сезонные вещи":
-                session['state'] = 'WAIT_SEASONAL_LIST'
-                bot.send_message(
-                    message.chat.id,
-                    'Перечислите все сезонные вещи текстом (через запятую или с новой строки):',
-                    reply_markup=return_main_menu_keyboard(),
-                )
-                return
+        session['data']['has_seasonal_items'] = True
+        session['data']['seasonal_item_list'] = items
+        session['state'] = 'CONFIRM'
+        send_storage_confirm(message.chat.id, session['data'])
 
-            if user_text == "Нет, обычные вещи":
-                session['data']['has_seasonal_items'] = False
-                session['data']['seasonal_item_list'] = []
-                session['state'] = 'CONFIRM'
-                send_storage_confirm(message.chat.id, session['data'])
-                return
+    @router.state('CONFIRM')
+    def state_confirm(message, session):
+        user_text = (message.text or '').strip()
+        user_id = message.from_user.id
 
-            bot.send_message(message.chat.id, 'Выберите один из вариантов кнопкой.')
-            return
+        answer = user_text.lower()
+        if answer.startswith('да') or answer in {'yes', 'y'}:
+            upsert_user_profile(
+                telegram_id=user_id,
+                full_name=normalize_full_name(message.from_user),
+                username=message.from_user.username,
+                phone=session['data'].get('phone'),
+                address=session['data'].get('address'),
+                email=session['data'].get('email'),
+            )
+            order = {
+                'user_telegram_id': user_id,
+                'item_rental_agreement_qr_code': None,
+                'request_type': session['data'].get('request_type', 'pickup'),
+                'address': session['data']['address'],
+                'phone': session['data'].get('phone'),
+                'email': session['data'].get('email'),
+                'volume_code': session['data'].get('volume'),
+                'has_seasonal_items': bool(session['data'].get('has_seasonal_items')),
+                'seasonal_item_list': session['data'].get('seasonal_item_list', []),
+                'rent_days': session['data'].get('rent_days'),
+                'promo_code': session['data'].get('promo_code'),
+                'promo_discount_percent': session['data'].get('promo_discount_percent', 0),
+                'expected_monthly_price': session['data'].get('expected_monthly_price'),
+                'expected_total_price': session['data'].get('expected_total_price'),
+                'requested_at': utc_now_iso(),
+                'status': 'pending',
+            }
+            order_id = append_order(order)
+            reset_session(user_id)
+
+            bot.send_message(
+                message.chat.id,
+                f'Заявка №{order_id} создана ✅ Оператор свяжется с вами.',
+                reply_markup=get_main_menu(user_id),
+            )
 
-        if state == 'WAIT_SEASONAL_LIST':
-            items = parse_items_list(user_text)
-            if not items:
+            if chat_id:
+                promo_admin_text = (
+                    f"Промокод: {session['data'].get('promo_code')} (-{session['data'].get('promo_discount_percent', 0)}%)\n"
+                    if session['data'].get('promo_code')
+                    else "Промокод: не применён\n"
+                )
                 bot.send_message(
-                    message.chat.id,
-                    'Список пустой. Перечислите вещи через запятую или с новой строки.',
+                    chat_id,
+                    'Новая заявка на вывоз:\n'
+                    f'№{order_id}\n'
+                    f"Клиент: {(message.from_user.first_name or '')} {(message.from_user.last_name or '')}\n"
+                    f"@{message.from_user.username or 'без username'}\n"
+                    f"Телефон: {session['data']['phone']}\n"
+                    f"Email: {session['data']['email']}\n"
+                    f"Адрес: {session['data']['address']}\n"
+                    f"Объём: {session['data']['volume']} - {session['data']['volume_description']}\n"
+                    f"Срок хранения: {session['data'].get('rent_days')} дн.\n"
+                    f"Сезонные вещи: {', '.join(session['data'].get('seasonal_item_list', [])) if session['data'].get('has_seasonal_items') else 'нет'}\n"
+                    f"{promo_admin_text}"
+                    f"Ожидаемая стоимость: {session['data']['expected_monthly_price']} руб./мес.\n"
+                    f"Ожидаемая стоимость за весь срок: {session['data'].get('expected_total_price')} руб.",
                 )
-                return
+            return
 
-            session['data']['has_seasonal_items'] = True
-            session['data']['seasonal_item_list'] = items
-            session['state'] = 'CONFIRM'
-            send_storage_confirm(message.chat.id, session['data'])
+        if answer.startswith('нет') or answer in {'no', 'n'}:
+            reset_session(user_id)
+            bot.send_message(message.chat.id, 'Ок, заявка отменена.', reply_markup=get_main_menu(user_id))
             return
 
-        if state == 'CONFIRM':
-            answer = user_text.lower()
-            if answer.startswith('да') or answer in {'yes', 'y'}:
-                upsert_user_profile(
-                    telegram_id=user_id,
-                    full_name=normalize_full_name(message.from_user),
-                    username=message.from_user.username,
-                    phone=session['data'].get('phone'),
-                    address=session['data'].get('address'),
-                    email=session['data'].get('email'),
-                )
-                order = {
-                    'user_telegram_id': user_id,
-                    'item_rental_agreement_qr_code': None,
-                    'request_type': session['data'].get('request_type', 'pickup'),
-                    'address': session['data']['address'],
-                    'phone': session['data'].get('phone'),
-                    'email': session['data'].get('email'),
-                    'volume_code': session['data'].get('volume'),
-                    'has_seasonal_items': bool(session['data'].get('has_seasonal_items')),
-                    'seasonal_item_list': session['data'].get('seasonal_item_list', []),
-                    'rent_days': session['data'].get('rent_days'),
-                    'promo_code': session['data'].get('promo_code'),
-                    'promo_discount_percent': session['data'].get('promo_discount_percent', 0),
-                    'expected_monthly_price': session['data'].get('expected_monthly_price'),
-                    'expected_total_price': session['data'].get('expected_total_price'),
-                    'requested_at': utc_now_iso(),
-                    'status': 'pending',
-                }
-                order_id = append_order(order)
-                reset_session(user_id)
+        bot.send_message(message.chat.id, 'Ответьте ДА или НЕТ.')
 
-                bot.send_message(
-                    message.chat.id,
-                    f'Заявка №{order_id} создана ✅ Оператор свяжется с вами.',
-                    reply_markup=get_main_menu(user_id),
-                )
+    @router.state('CONFIRM_LEGAL')
+    def state_confirm_legal(message, session):
+        user_text = (message.text or '').strip()
+        user_id = message.from_user.id
 
-                if chat_id:
-                    promo_admin_text = (
-                        f"Промокод: {session['data'].get('promo_code')} (-{session['data'].get('promo_discount_percent', 0)}%)\n"
-                        if session['data'].get('promo_code')
-                        else "Промокод: не применён\n"
-                    )
-                    bot.send_message(
-                        chat_id,
-                        'Новая заявка на вывоз:\n'
-                        f'№{order_id}\n'
-                        f"Клиент: {(message.from_user.first_name or '')} {(message.from_user.last_name or '')}\n"
-                        f"@{message.from_user.username or 'без username'}\n"
-                        f"Телефон: {session['data']['phone']}\n"
-                        f"Email: {session['data']['email']}\n"
-                        f"Адрес: {session['data']['address']}\n"
-                        f"Объём: {session['data']['volume']} - {session['data']['volume_description']}\n"
-                        f"Срок хранения: {session['data'].get('rent_days')} дн.\n"
-                        f"Сезонные вещи: {', '.join(session['data'].get('seasonal_item_list', [])) if session['data'].get('has_seasonal_items') else 'нет'}\n"
-                        f"{promo_admin_text}"
-                        f"Ожидаемая стоимость: {session['data']['expected_monthly_price']} руб./мес.\n"
-                        f"Ожидаемая стоимость за весь срок: {session['data'].get('expected_total_price')} руб.",
-                    )
-                return
+        answer = user_text.lower()
+        if answer.startswith('да') or answer in {'yes', 'y'}:
+            upsert_user_profile(
+                telegram_id=user_id,
+                full_name=normalize_full_name(message.from_user),
+                username=message.from_user.username,
+                phone=session['data'].get('phone'),
+                email=session['data'].get('email'),
+            )
+            order = {
+                "user_telegram_id": user_id,
+                "item_rental_agreement_qr_code": None,
+                "request_type": "legal_docs_storage",
+                "address": None,
+                "phone": session["data"]["phone"],
+                "email": session["data"]["email"],
+                "racks_count": session["data"]["racks_count"],
+                "rent_months": session["data"]["rent_months"],
+                "monthly_price": session["data"]["expected_monthly_price"],
+                "total_price": session["data"]["expected_total_price"],
+                "requested_at": utc_now_iso(),
+                "status": "pending",
+            }
+            order_id = append_order(order)
+            reset_session(user_id)
 
-            if answer.startswith('нет') or answer in {'no', 'n'}:
-                reset_session(user_id)
-                bot.send_message(message.chat.id, 'Ок, заявка отменена.', reply_markup=get_main_menu(user_id))
-                return
+            bot.send_message(
+                message.chat.id,
+                f"Заявка №{order_id} на услуги для юрлиц создана ✅",
+                reply_markup=get_main_menu(user_id),
+            )
 
-            bot.send_message(message.chat.id, 'Ответьте ДА или НЕТ.')
+            if chat_id:
+                bot.send_message(
+                    chat_id,
+                    f"Новая заявка юрлица №{order_id}\n"
+                    "Тип: хранение документов (стеллажи)\n"
+                    f"Клиент: {(message.from_user.first_name or '')} {(message.from_user.last_name or '')}\n"
+                    f"@{message.from_user.username or 'без username'}\n"
+                    f"Телефон: {session['data']['phone']}\n"
+                    f"Email: {session['data']['email']}\n"
+                    f"Стеллажей: {session['data']['racks_count']}\n"
+                    f"Срок: {session['data']['rent_months']} мес.\n"
+                    f"В месяц: {session['data']['expected_monthly_price']:.2f} руб.\n"
+                    f"Итого: {session['data']['expected_total_price']:.2f} руб.",
+                )
             return
 
-        if state == "CONFIRM_LEGAL":
-            answer = user_text.lower()
-            if answer.startswith('да') or answer in {'yes', 'y'}:
-                upsert_user_profile(
-                    telegram_id=user_id,
-                    full_name=normalize_full_name(message.from_user),
-                    username=message.from_user.username,
-                    phone=session['data'].get('phone'),
-                    email=session['data'].get('email'),
-                )
-                order = {
-                    "user_telegram_id": user_id,
-                    "item_rental_agreement_qr_code": None,
-                    "request_type": "legal_docs_storage",
-                    "address": None,
-                    "phone": session["data"]["phone"],
-                    "email": session["data"]["email"],
-                    "racks_count": session["data"]["racks_count"],
-                    "rent_months": session["data"]["rent_months"],
-                    "monthly_price": session["data"]["expected_monthly_price"],
-                    "total_price": session["data"]["expected_total_price"],
-                    "requested_at": utc_now_iso(),
-                    "status": "pending",
-                }
-                order_id = append_order(order)
-                reset_session(user_id)
+        if answer.startswith('нет') or answer in {'no', 'n'}:
+            reset_session(user_id)
+            bot.send_message(message.chat.id, 'Ок, заявка отменена.', reply_markup=get_main_menu(user_id))
+            return
 
-                bot.send_message(
-                    message.chat.id,
-                    f"Заявка №{order_id} на услуги для юрлиц создана ✅",
-                    reply_markup=get_main_menu(user_id),
-                )
+        bot.send_message(message.chat.id, 'Ответьте ДА или НЕТ.')
 
-                if chat_id:
-                    bot.send_message(
-                        chat_id,
-                        f"Новая заявка юрлица №{order_id}\n"
-                        "Тип: хранение документов (стеллажи)\n"
-                        f"Клиент: {(message.from_user.first_name or '')} {(message.from_user.last_name or '')}\n"
-                        f"@{message.from_user.username or 'без username'}\n"
-                        f"Телефон: {session['data']['phone']}\n"
-                        f"Email: {session['data']['email']}\n"
-                        f"Стеллажей: {session['data']['racks_count']}\n"
-                        f"Срок: {session['data']['rent_months']} мес.\n"
-                        f"В месяц: {session['data']['expected_monthly_price']:.2f} руб.\n"
-                        f"Итого: {session['data']['expected_total_price']:.2f} руб.",
-                    )
-                return
-
-            if answer.startswith('нет') or answer in {'no', 'n'}:
-                reset_session(user_id)
-                bot.send_message(message.chat.id, 'Ок, заявка отменена.', reply_markup=get_main_menu(user_id))
-                return
-
-            bot.send_message(message.chat.id, 'Ответьте ДА или НЕТ.')
-            return
-
-        if state == "CONFIRM_EXISTING":
-            answer = user_text.lower()
-            if answer.startswith('да') or answer in {'yes', 'y'}:
-                action = session["data"]["existing_action"]
-                selected_rent = session["data"]["selected_rent"]
-                upsert_user_profile(
-                    telegram_id=user_id,
-                    full_name=normalize_full_name(message.from_user),
-                    username=message.from_user.username,
-                    phone=session["data"].get("phone"),
-                    address=session["data"].get("address"),
-                )
-                order = {
-                    "user_telegram_id": user_id,
-                    "item_rental_agreement_qr_code": selected_rent.get("qr_code"),
-                    "request_type": f"{action['code']}_delivery",
-                    "address": session["data"]["address"],
-                    "phone": session["data"].get("phone"),
-                    "requested_at": utc_now_iso(),
-                    "status": "pending",
-                }
-                order_id = append_order(order)
-                reset_session(user_id)
+    @router.state('CONFIRM_EXISTING')
+    def state_confirm_existing(message, session):
+        user_text = (message.text or '').strip()
+        user_id = message.from_user.id
 
-                bot.send_message(
-                    message.chat.id,
-                    f"Заявка №{order_id} создана ✅ Оператор свяжется с вами.",
-                    reply_markup=get_main_menu(user_id),
-                )
+        answer = user_text.lower()
+        if answer.startswith('да') or answer in {'yes', 'y'}:
+            action = existing_actions[session["data"]["existing_action"]]
+            selected_rent = session_rent(session)
+            upsert_user_profile(
+                telegram_id=user_id,
+                full_name=normalize_full_name(message.from_user),
+                username=message.from_user.username,
+                phone=session["data"].get("phone"),
+                address=session["data"].get("address"),
+            )
+            order = {
+                "user_telegram_id": user_id,
+                "item_rental_agreement_qr_code": selected_rent.get("qr_code"),
+                "request_type": f"{action['code']}_delivery",
+                "address": session["data"]["address"],
+                "phone": session["data"].get("phone"),
+                "requested_at": utc_now_iso(),
+                "status": "pending",
+            }
+            order_id = append_order(order)
+            reset_session(user_id)
 
-                if chat_id:
-                    bot.send_message(
-                        chat_id,
-                        f"Новая заявка на доставку №{order_id}\n"
-                        f"Тип: {action['title']}\n"
-                        f"Клиент: {(message.from_user.first_name or '')} {(message.from_user.last_name or '')}\n"
-                        f"@{message.from_user.username or 'без username'}\n"
-                        f"Телефон: {session['data']['phone']}\n"
-                        f"Адрес: {session['data']['address']}\n"
-                        f"Договор: {selected_rent.get('qr_code')}\n"
-                        f"Ячейка: {selected_rent.get('cell_number')}",
-                    )
-                return
+            bot.send_message(
+                message.chat.id,
+                f"Заявка №{order_id} создана ✅ Оператор свяжется с вами.",
+                reply_markup=get_main_menu(user_id),
+            )
 
-            if answer.startswith('нет') or answer in {'no', 'n'}:
-                reset_session(user_id)
-                bot.send_message(message.chat.id, 'Ок, заявка отменена.', reply_markup=get_main_menu(user_id))
-                return
+            if chat_id:
+                bot.send_message(
+                    chat_id,
+                    f"Новая заявка на доставку №{order_id}\n"
+                    f"Тип: {action['title']}\n"
+                    f"Клиент: {(message.from_user.first_name or '')} {(message.from_user.last_name or '')}\n"
+                    f"@{message.from_user.username or 'без username'}\n"
+                    f"Телефон: {session['data']['phone']}\n"
+                    f"Адрес: {session['data']['address']}\n"
+                    f"Договор: {selected_rent.get('qr_code')}\n"
+                    f"Ячейка: {selected_rent.get('cell_number')}",
+                )
+            return
 
-            bot.send_message(message.chat.id, 'Ответьте ДА или НЕТ.')
+        if answer.startswith('нет') or answer in {'no', 'n'}:
+            reset_session(user_id)
+            bot.send_message(message.chat.id, 'Ок, заявка отменена.', reply_markup=get_main_menu(user_id))
             return
 
-    run_daily_reminders()
-    threading.Thread(target=reminders_worker, daemon=True).start()
+        bot.send_message(message.chat.id, 'Ответьте ДА или НЕТ.')
 
-    bot.infinity_polling(skip_pending=True)
+    def handle_message(message):
+        with sessions.activity(message.from_user.id):
+            router.dispatch(message)
 
+    @bot.message_handler(func=lambda m: True)
+    def route_message(message):
+        # Сообщение только ставится в очередь потока этого пользователя.
+        dispatcher.submit(message.from_user.id, handle_message, message)
+
+    ensure_order_ids()
+    check_cells_occupancy()
+    checkpoint_database()
+    start_checkpointer()
+    start_outbox_workers()
+    # Напоминания, архивация, сверка ячеек и ежедневный срез отчетов.
+    start_scheduler(bot, chat_id)
+
+    if bot_runtime == 'asyncio':
+        run_async_bot(token, handle_message, dispatcher, bot_mode)
+    elif bot_mode == 'webhook':
+        server, settings = build_webhook_server(
+            lambda update: bot.process_new_updates([telebot.types.Update.de_json(update)]),
+        )
+        bot.remove_webhook()
+        bot.set_webhook(url=settings['url'], secret_token=settings['secret'], drop_pending_updates=True)
+        server.serve_forever()
+    else:
+        bot.remove_webhook()
+        bot.infinity_polling(skip_pending=True)
 
 if __name__ == '__main__':
     main()
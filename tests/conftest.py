@@ -0,0 +1,42 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import db_utils, journal  # noqa: E402
+
+
+@pytest.fixture
+def database_file(tmp_path, monkeypatch):
+    """Пустая database.json во временном каталоге; возвращает функцию записи начальных данных."""
+    path = tmp_path / "database.json"
+    monkeypatch.setattr(db_utils, "DATABASE_FILE", path)
+    monkeypatch.setenv("DB_BACKEND", "json")
+    db_utils.invalidate_db_cache()
+    journal._state.update({"seq": 0, "entries": 0})
+
+    def write(database):
+        path.write_text(json.dumps(database, ensure_ascii=False), encoding="utf-8")
+        db_utils.invalidate_db_cache()
+        return path
+
+    yield write
+    db_utils.invalidate_db_cache()
+
+
+@pytest.fixture
+def outbox_path(tmp_path, monkeypatch):
+    """Очередь писем во временном файле; соединение закрывается после теста."""
+    from utils import outbox
+
+    path = tmp_path / "outbox.sqlite3"
+    monkeypatch.setenv("OUTBOX_PATH", str(path))
+    yield path
+    with outbox._lock:
+        if outbox._connection is not None:
+            outbox._connection.close()
+        outbox._connection = None
+        outbox._connection_path = None
@@ -0,0 +1,123 @@
+import gzip
+from datetime import date
+
+import pytest
+
+from utils import archive, db_utils
+
+
+TODAY = date(2026, 10, 1)
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", tmp_path / "archive")
+    return tmp_path / "archive"
+
+
+def _agreement(qr_code, status="Закончена", end_date="2025-01-10"):
+    return {"qr_code": qr_code, "status": status, "end_date": end_date}
+
+
+def _item(qr_code, removed_at="2025-01-10T10:00:00Z"):
+    return {"rental_agreement_qr_code": qr_code, "removed_at": removed_at}
+
+
+def test_items_of_earlier_archived_agreements_are_archived(database_file, archive_dir):
+    database_file(
+        {
+            "rental_agreements": [_agreement("QR-1"), _agreement("QR-2", status="Активна")],
+            "items": [_item("QR-1"), _item("QR-2"), _item("QR-GONE", removed_at=None) | {"added_at": "2024-12-01"}],
+            "delivery_requests": [],
+            "reminders": [],
+        }
+    )
+
+    moved = archive.archive_closed_records(max_age_days=180, today=TODAY)
+
+    assert moved == {"rental_agreements": 1, "items": 2}
+    snapshot = db_utils.db_snapshot()
+    assert snapshot["items"] == [_item("QR-2")]
+    assert {item["rental_agreement_qr_code"] for item in archive.iter_archive("items")} == {"QR-1", "QR-GONE"}
+
+
+def test_summary_counts_archived_records(database_file, archive_dir):
+    database_file(
+        {
+            "rental_agreements": [_agreement("QR-1")],
+            "delivery_requests": [
+                {"order_id": 1, "status": "completed", "completed_at": "2025-01-05", "user_telegram_id": 7},
+                {"order_id": 2, "status": "pending", "user_telegram_id": 8},
+            ],
+            "items": [],
+            "reminders": [],
+        }
+    )
+    archive.archive_closed_records(max_age_days=180, today=TODAY)
+
+    summary = archive.archive_summary(db_utils.db_snapshot())
+    assert summary["counts"] == {"rental_agreements": 1, "delivery_requests": 1}
+    assert summary["order_users"] == [7]
+
+
+def test_summary_is_backfilled_from_existing_archive(database_file, archive_dir):
+    database_file({"rental_agreements": [], "delivery_requests": [], "items": [], "reminders": []})
+    archive._append_archive(archive.archive_path("rental_agreements", "2024-01"), [_agreement("QR-OLD")])
+    archive._append_archive(
+        archive.archive_path("delivery_requests", "2024-01"),
+        [{"order_id": 1, "status": "rejected", "user_telegram_id": 5}],
+    )
+
+    archive.archive_closed_records(max_age_days=180, today=TODAY)
+
+    summary = archive.archive_summary(db_utils.db_snapshot())
+    assert summary["counts"]["rental_agreements"] == 1
+    assert summary["order_users"] == [5]
+
+
+def test_crash_before_summary_update_does_not_double_count(database_file, archive_dir, monkeypatch):
+    database_file({"rental_agreements": [_agreement("QR-1")], "delivery_requests": [], "items": [], "reminders": []})
+    archive.archive_closed_records(max_age_days=180, today=TODAY)
+    finish_pending = archive._finish_pending
+
+    def crash(database, pending_id):
+        raise OSError("процесс упал")
+
+    # Второй запуск: пачка уже в файлах, но сводка не обновлена.
+    with db_utils.transaction() as database:
+        database["rental_agreements"].append(_agreement("QR-2"))
+    monkeypatch.setattr(archive, "_finish_pending", crash)
+    with pytest.raises(OSError):
+        archive.archive_closed_records(max_age_days=180, today=TODAY)
+    assert db_utils.db_snapshot()[archive.PENDING_KEY]
+    monkeypatch.setattr(archive, "_finish_pending", finish_pending)
+
+    archive.archive_closed_records(max_age_days=180, today=TODAY)
+
+    snapshot = db_utils.db_snapshot()
+    assert archive.PENDING_KEY not in snapshot
+    assert archive.archive_summary(snapshot)["counts"] == {"rental_agreements": 2}
+    assert [record["qr_code"] for record in archive.iter_archive("rental_agreements")] == ["QR-1", "QR-2"]
+
+
+def test_conflict_retry_does_not_write_the_archive_twice(database_file, archive_dir, monkeypatch):
+    path = database_file({"rental_agreements": [_agreement("QR-1")], "delivery_requests": [], "items": [], "reminders": []})
+    take_closed_records = archive._take_closed_records
+    attempts = []
+
+    def conflicting(database, cutoff):
+        attempts.append(cutoff)
+        moved = take_closed_records(database, cutoff)
+        if len(attempts) == 1:
+            # Другой процесс изменил файл БД во время первой попытки.
+            path.write_text(path.read_text(encoding="utf-8"), encoding="utf-8")
+            path.touch()
+        return moved
+
+    monkeypatch.setattr(archive, "_take_closed_records", conflicting)
+    assert archive.archive_closed_records(max_age_days=180, today=TODAY) == {"rental_agreements": 1}
+
+    assert len(attempts) == 2
+    lines = gzip.decompress(archive.archive_path("rental_agreements", "2025-01").read_bytes()).splitlines()
+    assert len(lines) == 1
+    assert archive.archive_summary(db_utils.db_snapshot())["counts"] == {"rental_agreements": 1}
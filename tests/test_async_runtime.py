@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("telebot")
+
+from utils.async_runtime import AsyncOrderedDispatcher  # noqa: E402
+from utils.telegram_queue import QueuedBot, TelegramSendQueue  # noqa: E402
+
+
+class SlowBot:
+    """Отправка в чат 1 ждет release — как очередь, упершаяся в лимит чата."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        if chat_id == 1:
+            self.release.wait(5)
+        self.sent.append((chat_id, text))
+        return text
+
+
+def test_handlers_do_not_hold_executor_threads_while_sending():
+    telegram_bot = SlowBot()
+    bot = QueuedBot(telegram_bot, TelegramSendQueue(telegram_bot, workers=2).start())
+    handled = []
+
+    def handle(chat_id, text):
+        handled.append((chat_id, text))
+        bot.send_message(chat_id, f"ответ на {text}")
+
+    async def scenario():
+        dispatcher = AsyncOrderedDispatcher(executor_workers=1)
+        await dispatcher.submit(1, handle, 1, "первое")
+        await dispatcher.submit(1, handle, 1, "второе")
+        await dispatcher.submit(2, handle, 2, "другой чат")
+        # Единственный поток executor свободен, хотя ответ в чат 1 еще не ушел.
+        for _ in range(100):
+            if (2, "ответ на другой чат") in telegram_bot.sent:
+                break
+            await asyncio.sleep(0.01)
+        assert handled == [(1, "первое"), (2, "другой чат")]
+        telegram_bot.release.set()
+        await dispatcher.join()
+        dispatcher.stop()
+        return dispatcher
+
+    dispatcher = asyncio.run(scenario())
+    assert handled[-1] == (1, "второе")
+    assert [text for chat_id, text in telegram_bot.sent if chat_id == 1] == ["ответ на первое", "ответ на второе"]
+    assert dispatcher.stats()[0]["failed"] == 0
+
+
+def test_explicit_wait_still_blocks_for_result():
+    telegram_bot = SlowBot()
+    telegram_bot.release.set()
+    bot = QueuedBot(telegram_bot, TelegramSendQueue(telegram_bot, workers=1).start())
+    results = []
+
+    async def scenario():
+        dispatcher = AsyncOrderedDispatcher(executor_workers=1)
+        await dispatcher.submit(1, lambda: results.append(bot.send_message(1, "текст", wait=True)))
+        await dispatcher.join()
+        dispatcher.stop()
+
+    asyncio.run(scenario())
+    assert results == ["текст"]
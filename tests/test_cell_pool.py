@@ -0,0 +1,33 @@
+from utils import db_utils
+from utils.cell_pool import FreeCellPool
+
+
+def _cell(number, size="S", warehouse="Центр", occupied=False):
+    return {"number": number, "warehouse_name": warehouse, "cell_size_code": size, "is_occupied": occupied}
+
+
+def test_candidates_follow_table_order_after_release():
+    cells = [_cell("A-1"), _cell("B-1", warehouse="Север"), _cell("A-2"), _cell("B-2", size="M", warehouse="Север")]
+    pool = FreeCellPool()
+    for position, cell in enumerate(cells):
+        pool.add(position, cell)
+
+    pool.discard(0, cells[0])
+    pool.add(0, cells[0])
+
+    assert list(pool.candidates()) == [0, 1, 2, 3]
+    assert list(pool.candidates(cell_size_code="S")) == [0, 1, 2]
+    assert list(pool.candidates("Север", "M")) == [3]
+
+
+def test_allocate_cell_takes_first_free_cell_like_a_table_scan(database_file):
+    database_file({"cells": [_cell("A-1", occupied=True), _cell("B-1", size="M"), _cell("A-2"), _cell("A-3")]})
+
+    with db_utils.transaction() as database:
+        assert db_utils.allocate_cell(database, "S")["number"] == "A-2"
+    with db_utils.transaction() as database:
+        assert db_utils.allocate_cell(database, "L")["number"] == "B-1"
+    with db_utils.transaction() as database:
+        db_utils.release_cell(database, "A-2")
+    with db_utils.transaction() as database:
+        assert db_utils.allocate_cell(database, "S")["number"] == "A-2"
@@ -0,0 +1,48 @@
+import logging
+
+from utils.dispatcher import BackgroundJobs, OrderedDispatcher
+
+
+def test_handler_errors_are_logged_and_counted(caplog):
+    dispatcher = OrderedDispatcher(workers=2).start()
+    done = []
+
+    def broken():
+        raise ValueError("нет ячейки")
+
+    with caplog.at_level(logging.ERROR, logger="utils.dispatcher"):
+        dispatcher.submit(1, broken)
+        dispatcher.submit(1, done.append, "next")
+        dispatcher.join()
+    dispatcher.stop()
+
+    assert done == ["next"]
+    assert sum(item["failed"] for item in dispatcher.stats()) == 1
+    assert "ValueError: нет ячейки" in caplog.text
+
+
+def test_messages_of_one_key_keep_order():
+    dispatcher = OrderedDispatcher(workers=4).start()
+    seen = []
+    for number in range(50):
+        dispatcher.submit("user", seen.append, number)
+    dispatcher.join()
+    dispatcher.stop()
+
+    assert seen == list(range(50))
+
+
+def test_background_jobs_run_outside_dispatcher_and_log_errors(caplog):
+    jobs = BackgroundJobs(workers=1)
+
+    def broken():
+        raise RuntimeError("SMTP недоступен")
+
+    with caplog.at_level(logging.ERROR, logger="utils.dispatcher"):
+        future = jobs.submit("run_reminders", broken)
+        assert isinstance(future.exception(timeout=5), RuntimeError)
+    assert jobs.submit("simulate_reminders", lambda: 7).result(timeout=5) == 7
+    jobs.stop()
+
+    assert jobs.stats() == {}
+    assert "run_reminders" in caplog.text
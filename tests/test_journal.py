@@ -0,0 +1,57 @@
+from utils import db_utils, journal
+
+
+def _reminders(count):
+    return [{"rental_agreement_qr_code": f"QR-{n}", "reminder_type": "3d_before"} for n in range(count)]
+
+
+def test_load_applies_journal_over_snapshot(database_file):
+    path = database_file({"reminders": _reminders(2)})
+    with db_utils.transaction() as database:
+        database["reminders"].append({"rental_agreement_qr_code": "QR-new"})
+
+    db_utils.invalidate_db_cache()
+    assert [record["rental_agreement_qr_code"] for record in journal.load(path)["reminders"]] == [
+        "QR-0", "QR-1", "QR-new",
+    ]
+
+
+def test_crash_between_snapshot_and_compact_after_truncation(database_file):
+    path = database_file({"reminders": _reminders(4)})
+    with db_utils.transaction() as database:
+        database["reminders"].append({"rental_agreement_qr_code": "QR-4"})
+    with db_utils.transaction() as database:
+        # Как при архивации: таблица становится короче, чем позиции в журнале.
+        database["reminders"] = database["reminders"][:2]
+    expected = db_utils.db_snapshot()
+
+    # Снимок записан, а журнал не очищен — процесс упал посреди чекпоинта.
+    journal.write_snapshot(path, expected, journal.last_seq())
+    db_utils.invalidate_db_cache()
+
+    assert journal.load(path) == expected
+    assert db_utils.db_snapshot() == expected
+
+
+def test_checkpoint_compacts_journal_and_keeps_data(database_file):
+    path = database_file({"users": [{"telegram_id": 1}]})
+    db_utils.upsert_user_profile(2, full_name="Анна")
+    assert db_utils.checkpoint_database()
+
+    assert journal.journal_path(path).read_bytes() == b""
+    db_utils.invalidate_db_cache()
+    assert [user["telegram_id"] for user in db_utils.db_snapshot()["users"]] == [1, 2]
+
+    db_utils.upsert_user_profile(3)
+    db_utils.invalidate_db_cache()
+    assert [user["telegram_id"] for user in db_utils.db_snapshot()["users"]] == [1, 2, 3]
+
+
+def test_torn_last_line_is_dropped(database_file):
+    path = database_file({"users": []})
+    db_utils.upsert_user_profile(1)
+    with journal.journal_path(path).open("ab") as file:
+        file.write(b'{"seq": 99, "changes": [{"op": "set"')
+
+    db_utils.invalidate_db_cache()
+    assert [user["telegram_id"] for user in journal.load(path)["users"]] == [1]
@@ -0,0 +1,205 @@
+import socketserver
+import threading
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+from utils import mailer, outbox  # noqa: E402
+from utils.mailer import MailSettings, SMTPPool, _build_message  # noqa: E402
+from utils.reminder_stats import format_run_stats  # noqa: E402
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Минимальный SMTP без AUTH: EHLO, MAIL, RCPT, DATA, NOOP, RSET, QUIT.
+
+    Получатели refused@… отклоняются навсегда (550), busy@… — временно (450).
+    """
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            server.sockets.append(self.connection)
+        self.reply("220 stub ready")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 stub")
+            elif verb == "MAIL":
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipient = command.split(":", 1)[1].strip(" <>")
+                if recipient.startswith("refused@"):
+                    self.reply("550 no such user")
+                elif recipient.startswith("busy@"):
+                    self.reply("450 mailbox busy")
+                else:
+                    recipients.append(recipient)
+                    self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 end with .")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                with server.lock:
+                    server.delivered.extend(recipients)
+                self.reply("250 queued")
+            elif verb in ("NOOP", "RSET"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+class _SMTPStub(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.delivered = []
+        self.sockets = []
+
+    def drop_connections(self):
+        """Обрывает открытые соединения, как сервер после таймаута простоя."""
+        with self.lock:
+            sockets, self.sockets = self.sockets, []
+        for sock in sockets:
+            try:
+                sock.shutdown(2)
+            except OSError:
+                pass
+
+
+@pytest.fixture
+def smtp_stub():
+    stub = _SMTPStub()
+    thread = threading.Thread(target=stub.serve_forever, daemon=True)
+    thread.start()
+    yield stub
+    stub.shutdown()
+    stub.server_close()
+
+
+def _pool(stub, **overrides):
+    settings = MailSettings(
+        sender_email="bot@example.com",
+        app_password="secret",
+        host="127.0.0.1",
+        port=stub.server_address[1],
+        use_ssl=False,
+        timeout=5,
+        **overrides,
+    )
+    return SMTPPool(settings)
+
+
+def _messages(*recipients):
+    return [(recipient, _build_message("bot@example.com", recipient, "Тема", "Текст")) for recipient in recipients]
+
+
+def test_pool_reuses_one_connection_for_batches(smtp_stub):
+    pool = _pool(smtp_stub)
+    assert pool.send(_messages("a@example.com", "b@example.com")) == [(True, ""), (True, "")]
+    assert pool.send(_messages("c@example.com")) == [(True, "")]
+    pool.close()
+
+    assert smtp_stub.delivered == ["a@example.com", "b@example.com", "c@example.com"]
+    assert pool.connects == 1
+
+
+def test_broken_idle_connection_is_replaced(smtp_stub):
+    # check_after_seconds=0: перед каждым использованием соединение проверяется NOOP.
+    pool = _pool(smtp_stub, check_after_seconds=0)
+    assert pool.send(_messages("a@example.com")) == [(True, "")]
+    smtp_stub.drop_connections()
+
+    assert pool.send(_messages("b@example.com")) == [(True, "")]
+    pool.close()
+    assert smtp_stub.delivered == ["a@example.com", "b@example.com"]
+    assert pool.connects == 2
+
+
+def test_disconnect_during_send_is_retried_on_new_connection(smtp_stub):
+    # Без NOOP-проверки разрыв обнаруживается только при отправке.
+    pool = _pool(smtp_stub, check_after_seconds=3600)
+    assert pool.send(_messages("a@example.com")) == [(True, "")]
+    smtp_stub.drop_connections()
+
+    assert pool.send(_messages("b@example.com")) == [(True, "")]
+    pool.close()
+    assert smtp_stub.delivered == ["a@example.com", "b@example.com"]
+    assert pool.connects == 2
+
+
+def test_unreachable_server_reports_errors(smtp_stub):
+    pool = _pool(smtp_stub)
+    smtp_stub.shutdown()
+    smtp_stub.server_close()
+
+    results = pool.send(_messages("a@example.com"))
+    assert results[0][0] is False
+    assert results[0][1]
+
+
+def test_refused_recipients_keep_the_connection(smtp_stub):
+    pool = _pool(smtp_stub)
+    results = pool.send(_messages("refused@example.com", "busy@example.com", "a@example.com"))
+    pool.close()
+
+    assert [ok for ok, _ in results] == [False, False, True]
+    assert results[0][1].startswith("SMTP 550")
+    assert results[1][1].startswith("SMTP 450")
+    assert smtp_stub.delivered == ["a@example.com"]
+    assert pool.connects == 1
+
+
+def test_permanent_refusal_is_dead_lettered_at_once(outbox_path):
+    for recipient in ("refused@example.com", "busy@example.com"):
+        outbox.enqueue_email(recipient, "Тема", "Текст")
+    claimed = outbox.claim_batch(10)
+    errors = {"refused@example.com": "SMTP 550 SMTPRecipientsRefused", "busy@example.com": "SMTP 450 SMTPRecipientsRefused"}
+
+    outbox.record_results(claimed, [(False, errors[row[1]]) for row in claimed])
+
+    stats = outbox.outbox_stats()
+    assert (stats["dead"], stats["pending"]) == (1, 1)
+    assert [row[1] for row in outbox.dead_letters()] == ["refused@example.com"]
+
+
+def test_outbox_worker_records_smtp_latency(smtp_stub, outbox_path, monkeypatch):
+    for name, value in {
+        "YANDEX_LOGIN": "bot@example.com",
+        "YANDEX_TOKEN": "secret",
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(smtp_stub.server_address[1]),
+        "SMTP_SSL": "0",
+    }.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(mailer, "load_dotenv", lambda: None)
+    monkeypatch.setattr(outbox, "_smtp_latencies", outbox.deque(maxlen=10))
+    mailer.reset_mailer()
+    try:
+        outbox.enqueue_email("a@example.com", "Тема", "Текст")
+        outbox.enqueue_email("b@example.com", "Тема", "Текст")
+        assert outbox.process_outbox_once() == 2
+    finally:
+        mailer.reset_mailer()
+
+    assert smtp_stub.delivered == ["a@example.com", "b@example.com"]
+    latency = outbox.smtp_latency_stats()
+    assert latency["count"] == 2
+    assert "SMTP (outbox, последние письма): 2 писем" in format_run_stats([], latency)
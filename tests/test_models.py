@@ -0,0 +1,34 @@
+from datetime import date
+
+from utils.models import RentalAgreement, User
+
+
+def test_non_padded_date_round_trips_unchanged():
+    record = {"qr_code": "QR-1", "start_date": "2026-1-5", "end_date": "2026-02-05", "note": "x"}
+    rent = RentalAgreement.from_dict(record)
+
+    assert rent.start_date == date(2026, 1, 5)
+    assert rent.to_dict() == record
+
+
+def test_changed_date_is_written_in_iso_format():
+    rent = RentalAgreement.from_dict({"qr_code": "QR-1", "end_date": "2026-1-5"})
+    rent.end_date = date(2026, 2, 1)
+
+    assert rent.to_dict() == {"qr_code": "QR-1", "end_date": "2026-02-01"}
+
+
+def test_unparsed_values_are_kept():
+    record = {"qr_code": "QR-1", "end_date": "бессрочно"}
+    assert RentalAgreement.from_dict(record).to_dict() == record
+    assert User.from_dict({"telegram_id": 1, "role": "admin"}).to_dict() == {"telegram_id": 1, "role": "admin"}
+
+
+def test_models_of_same_shape_share_service_fields():
+    first, second = (
+        RentalAgreement.from_dict({"qr_code": qr_code, "end_date": "2026-02-05"}) for qr_code in ("QR-1", "QR-2")
+    )
+
+    assert first.key_order is second.key_order
+    assert first.extra is second.extra and not first.extra
+    assert first.raw_dates is second.raw_dates and not first.raw_dates
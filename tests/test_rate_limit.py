@@ -0,0 +1,32 @@
+import time
+
+from utils import rate_limit
+from utils.rate_limit import KeyedRateLimiter, TokenBucket
+
+
+def test_bucket_allows_burst_then_waits():
+    bucket = TokenBucket(rate=1, capacity=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() > 0.5
+
+
+def test_per_chat_limit_has_burst(monkeypatch):
+    monkeypatch.setattr(rate_limit, "_telegram_limits", {})
+    monkeypatch.delenv("TG_PER_CHAT_BURST", raising=False)
+    _, per_chat = rate_limit.telegram_limits()
+
+    started = time.monotonic()
+    for _ in range(3):
+        assert per_chat.acquire("chat", timeout=0.1)
+    assert time.monotonic() - started < 0.1
+    assert per_chat.peek("chat") > 0.5
+    assert per_chat.peek("other chat") == 0.0
+
+
+def test_idle_buckets_are_evicted():
+    limiter = KeyedRateLimiter(rate=1000, capacity=1, max_keys=2)
+    limiter.acquire("a")
+    limiter.acquire("b")
+    time.sleep(0.01)
+    limiter.acquire("c")
+    assert len(limiter._buckets) <= 2
@@ -0,0 +1,50 @@
+import pytest
+
+pytest.importorskip("dotenv")
+
+from utils import outbox  # noqa: E402
+from utils.reminder_delivery import ReminderJob, deliver_reminders  # noqa: E402
+
+
+class FakeBot:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.failing:
+            raise RuntimeError("chat not found")
+        self.sent.append((chat_id, text))
+
+
+def _job(user_id, email=None):
+    return ReminderJob(
+        qr_code=f"QR-{user_id}",
+        reminder_type="3d_before",
+        user_id=user_id,
+        text="Напоминание",
+        email=email,
+        email_subject="SelfStorage",
+        due_on="2026-10-18",
+    )
+
+
+def test_reminder_emails_go_through_outbox(outbox_path):
+    bot = FakeBot(failing={2})
+    jobs = [_job(1, "a@example.com"), _job(2, "b@example.com"), _job(3)]
+
+    results, counters = deliver_reminders(bot, jobs, workers=2)
+
+    assert [result.delivered for result in results] == [True, True, True]
+    assert counters == {"sent": 2, "email_sent": 2, "errors": 1}
+    assert outbox.outbox_stats()["pending"] == 2
+    recipients = [row[1] for row in outbox.claim_batch(10)]
+    assert sorted(recipients) == ["a@example.com", "b@example.com"]
+
+
+def test_repeated_run_does_not_queue_the_same_email_twice(outbox_path):
+    deliver_reminders(FakeBot(), [_job(1, "a@example.com")], workers=1)
+    results, _ = deliver_reminders(FakeBot(), [_job(1, "a@example.com")], workers=1)
+
+    assert results[0].email_ok
+    assert outbox.outbox_stats()["pending"] == 1
@@ -0,0 +1,43 @@
+from datetime import date
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+from utils import reminder_partitions  # noqa: E402
+from utils.reminder_partitions import split_candidates  # noqa: E402
+
+
+ON_DATE = date(2026, 3, 1)
+
+
+def _database():
+    return {
+        # Не-словарь перед договором сдвигает позиции моделей относительно сырой таблицы.
+        "rental_agreements": [
+            "битая запись",
+            {"qr_code": "QR-2", "user_telegram_id": 2, "cell_number": 2, "status": "Активна", "end_date": "2026-03-04"},
+            {"qr_code": "QR-1", "user_telegram_id": 1, "cell_number": 1, "status": "Активна", "end_date": "2026-03-31"},
+        ],
+        "users": [{"telegram_id": 1, "full_name": "Анна"}, {"telegram_id": 2, "full_name": "Борис"}],
+        "cells": [],
+        "overdue_tariffs": [],
+    }
+
+
+def test_split_keeps_candidate_numbers():
+    candidates = [("QR-%d" % n, "1m") for n in range(20)]
+    parts = split_candidates(candidates, 3)
+
+    numbered = sorted(item for part in parts for item in part)
+    assert numbered == [(n, qr_code, reminder_type) for n, (qr_code, reminder_type) in enumerate(candidates)]
+
+
+def test_partition_finds_agreements_by_qr_code():
+    reminder_partitions._init_worker(_database())
+    prepared = reminder_partitions._prepare_partition([(0, "QR-1", "1m"), (1, "QR-2", "3d")], ON_DATE, ON_DATE)
+
+    assert [(number, job.qr_code, job.user_id) for number, job in prepared] == [
+        (0, "QR-1", 1),
+        (1, "QR-2", 2),
+    ]
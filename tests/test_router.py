@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils.router import MessageRouter
+
+
+def _router(calls, session):
+    router = MessageRouter()
+
+    @router.command("start")
+    def start(message):
+        calls.append("start")
+
+    @router.text("📦 Мои заказы")
+    def orders(message):
+        calls.append("orders")
+
+    @router.state("WAIT_ADDRESS")
+    def wait_address(message, session):
+        calls.append(("address", message.text))
+
+    @router.default
+    def fallback(message):
+        # Как pickup_flow в main.py: состояние разбирается внутри обработчика по умолчанию.
+        if not router.dispatch_state(message, session):
+            calls.append("default")
+
+    return router
+
+
+def test_commands_and_button_texts_win_over_session_state():
+    calls = []
+    router = _router(calls, {"state": "WAIT_ADDRESS"})
+
+    for text in ("/start", "/start@storage_bot", "/start promo", "📦 Мои заказы"):
+        router.dispatch(SimpleNamespace(text=text))
+
+    assert calls == ["start", "start", "start", "orders"]
+
+
+def test_other_text_goes_to_default_then_state():
+    calls = []
+    session = {"state": "WAIT_ADDRESS"}
+    router = _router(calls, session)
+
+    router.dispatch(SimpleNamespace(text="Москва, ул. Ленина, 1"))
+    router.dispatch(SimpleNamespace(text="/unknown"))
+    session["state"] = None
+    router.dispatch(SimpleNamespace(text="Москва, ул. Ленина, 1"))
+    router.dispatch(SimpleNamespace(text=None))
+
+    assert calls == [
+        ("address", "Москва, ул. Ленина, 1"),
+        ("address", "/unknown"),
+        "default",
+        "default",
+    ]
+
+
+def test_duplicate_registration_is_rejected():
+    router = MessageRouter()
+    router.command("start")(lambda message: None)
+
+    with pytest.raises(ValueError, match="start"):
+        router.command("help", "start")(lambda message: None)
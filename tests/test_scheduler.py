@@ -0,0 +1,33 @@
+from datetime import date, datetime
+
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("apscheduler")
+
+from apscheduler.triggers.cron import CronTrigger  # noqa: E402
+
+from utils.reminders import pending_reminder_days  # noqa: E402
+from utils.scheduler import fired_today  # noqa: E402
+
+
+TODAY = date(2026, 10, 18)
+
+
+def test_catch_up_without_today_leaves_it_to_the_cron():
+    database = {"scheduler": {"reminders_last_day": "2026-10-15"}}
+
+    assert pending_reminder_days(database, TODAY, max_days=7) == [date(2026, 10, 16), date(2026, 10, 17), TODAY]
+    assert pending_reminder_days(database, TODAY, max_days=7, include_today=False) == [
+        date(2026, 10, 16),
+        date(2026, 10, 17),
+    ]
+    assert pending_reminder_days({"scheduler": {"reminders_last_day": "2026-10-17"}}, TODAY, include_today=False) == []
+
+
+def test_fired_today_compares_with_the_cron_time():
+    trigger = CronTrigger.from_crontab("0 10 * * *", timezone="UTC")
+    before, after = (datetime(2026, 10, 18, hour, tzinfo=trigger.timezone) for hour in (9, 11))
+
+    assert not fired_today(trigger, before)
+    assert fired_today(trigger, after)
@@ -0,0 +1,86 @@
+from utils import sessions
+from utils.sessions import SessionStore
+
+
+def _store(tmp_path, monkeypatch, **limits):
+    clock = [1000.0]
+    monkeypatch.setattr(sessions.time, "time", lambda: clock[0])
+    store = SessionStore(tmp_path / "sessions.sqlite3", **limits)
+    return store, clock
+
+
+def test_lru_evicts_least_recently_used_and_reloads_from_disk(tmp_path, monkeypatch):
+    store, _ = _store(tmp_path, monkeypatch, max_cached=2)
+    store[1] = {"state": "WAIT_ADDRESS"}
+    store[2] = {"state": "WAIT_PHONE"}
+    store.get(1)
+    store[3] = {"state": None}
+
+    # Вытеснена сессия 2: к ней обращались раньше всех.
+    assert list(store._cache) == [1, 3]
+    assert store.counters["evicted"] == 1
+    assert store.get(2) == {"state": "WAIT_PHONE"}
+    assert store.counters["loads"] == 1
+    assert list(store._cache) == [3, 2]
+    store.close()
+
+
+def test_byte_cap_evicts_but_keeps_active_sessions(tmp_path, monkeypatch):
+    store, _ = _store(tmp_path, monkeypatch, max_cached_bytes=250)
+    with store.activity(1):
+        store[1] = {"data": "a" * 100}
+        store[2] = {"data": "b" * 100}
+        store[3] = {"data": "c" * 100}
+
+        # Сессия 1 обрабатывается — вытесняется следующая по давности.
+        assert list(store._cache) == [1, 3]
+        assert store.stats()["cached_bytes"] <= 250
+
+    assert store.stats()["stored"] == 3
+    assert store.get(2) == {"data": "b" * 100}
+    assert store.stats()["cached_bytes"] <= 250
+    store.close()
+
+
+def test_expired_session_is_dropped_on_read(tmp_path, monkeypatch):
+    store, clock = _store(tmp_path, monkeypatch, ttl_seconds=60)
+    store[1] = {"state": "WAIT_PHONE"}
+
+    clock[0] += 61
+    assert store.get(1) is None
+    assert store.counters["expired"] == 1
+    assert store.stats()["stored"] == 0
+    store.close()
+
+
+def test_purge_removes_only_expired_sessions(tmp_path, monkeypatch):
+    store, clock = _store(tmp_path, monkeypatch, ttl_seconds=60)
+    store[1] = {"state": "WAIT_ADDRESS"}
+    clock[0] += 50
+    store[2] = {"state": "WAIT_PHONE"}
+
+    clock[0] += 20
+    assert store.purge_expired() == 1
+    assert store.stats()["cached"] == 1
+    assert store.get(1) is None
+    assert store.get(2) == {"state": "WAIT_PHONE"}
+    store.close()
+
+
+def test_activity_writes_only_changed_sessions(tmp_path, monkeypatch):
+    store, clock = _store(tmp_path, monkeypatch)
+    store[1] = {"state": None}
+    writes = store.counters["writes"]
+
+    with store.activity(1):
+        store.get(1)
+    assert store.counters["writes"] == writes
+
+    with store.activity(1):
+        store.get(1)["state"] = "WAIT_ADDRESS"
+    assert store.counters["writes"] == writes + 1
+
+    store.close()
+    reopened = SessionStore(tmp_path / "sessions.sqlite3")
+    assert reopened.get(1) == {"state": "WAIT_ADDRESS"}
+    reopened.close()
@@ -0,0 +1,92 @@
+import json
+import sqlite3
+
+import pytest
+
+from utils import db_utils, journal, sqlite_storage
+
+
+@pytest.fixture
+def sqlite_database(tmp_path, monkeypatch):
+    path = tmp_path / "database.sqlite3"
+    monkeypatch.setenv("DB_BACKEND", "sqlite")
+    monkeypatch.setenv("SQLITE_PATH", str(path))
+    db_utils.invalidate_db_cache()
+
+    def load(database):
+        json_path = tmp_path / "database.json"
+        json_path.write_text(json.dumps({journal.SEQ_KEY: 3, **database}, ensure_ascii=False), encoding="utf-8")
+        sqlite_storage.import_json_database(json_path, path)
+        db_utils.invalidate_db_cache()
+        return path
+
+    yield load
+    db_utils.invalidate_db_cache()
+
+
+def _rows(path, sql, *params):
+    with sqlite3.connect(str(path)) as connection:
+        return connection.execute(sql, params).fetchall()
+
+
+def test_import_replaces_data_and_keeps_collections(sqlite_database):
+    sqlite_database({"users": [{"telegram_id": 1}], "sequences": {"order_id": 1}, "old": [1]})
+    path = sqlite_database({"users": [{"telegram_id": 2}], "sequences": {"order_id": 5}})
+
+    assert db_utils.db_snapshot()["users"] == [{"telegram_id": 2}]
+    assert db_utils.db_snapshot()["sequences"] == {"order_id": 5}
+    assert _rows(path, "SELECT name FROM collections") == [("sequences",)]
+
+
+def test_transaction_writes_only_changed_rows(sqlite_database):
+    path = sqlite_database({"users": [{"telegram_id": n} for n in range(3)], "delivery_requests": []})
+    db_utils.upsert_user_profile(1, email="a@example.com")
+    db_utils.append_order({"status": "pending", "user_telegram_id": 1})
+
+    assert _rows(path, "SELECT position, email FROM users WHERE telegram_id = 1") == [(1, "a@example.com")]
+    assert _rows(path, "SELECT order_id, status FROM delivery_requests") == [(1, "pending")]
+    assert json.loads(_rows(path, "SELECT payload FROM collections WHERE name = 'sequences'")[0][0]) == {
+        "order_id": 1
+    }
+
+    db_utils.invalidate_db_cache()
+    snapshot = db_utils.db_snapshot()
+    assert snapshot["users"][1] == {"telegram_id": 1, "email": "a@example.com"}
+    assert snapshot["delivery_requests"] == [{"status": "pending", "user_telegram_id": 1, "order_id": 1}]
+
+
+def test_truncate_and_drop_are_persisted(sqlite_database):
+    path = sqlite_database({"reminders": [{"reminder_type": str(n)} for n in range(4)], "scheduler": {}})
+    with db_utils.transaction() as database:
+        database["reminders"] = database["reminders"][:1]
+        del database["scheduler"]
+
+    assert _rows(path, "SELECT COUNT(*) FROM reminders") == [(1,)]
+    assert _rows(path, "SELECT name FROM collections") == []
+    db_utils.invalidate_db_cache()
+    snapshot = db_utils.db_snapshot()
+    assert snapshot["reminders"] == [{"reminder_type": "0"}]
+    assert "scheduler" not in snapshot
+
+
+def test_import_applies_journal_entries_not_yet_checkpointed(sqlite_database, tmp_path):
+    json_path = tmp_path / "database.json"
+    json_path.write_text(
+        json.dumps({journal.SEQ_KEY: 1, "users": [{"telegram_id": 1}], "delivery_requests": []}),
+        encoding="utf-8",
+    )
+    entries = [
+        {"seq": 1, "changes": [{"op": "set", "table": "users", "pos": 0, "record": {"telegram_id": 0}}]},
+        {"seq": 2, "changes": [{"op": "set", "table": "delivery_requests", "pos": 0, "record": {"order_id": 1}}]},
+        {"seq": 3, "changes": [{"op": "set", "table": "users", "pos": 0, "record": {"telegram_id": 1, "phone": "+7"}}]},
+    ]
+    journal.journal_path(json_path).write_text("".join(json.dumps(entry) + "\n" for entry in entries), encoding="utf-8")
+    path = tmp_path / "database.sqlite3"
+
+    counts = sqlite_storage.import_json_database(json_path, path)
+
+    assert counts["delivery_requests"] == 1
+    db_utils.invalidate_db_cache()
+    snapshot = db_utils.db_snapshot()
+    assert snapshot["users"] == [{"telegram_id": 1, "phone": "+7"}]
+    assert snapshot["delivery_requests"] == [{"order_id": 1}]
@@ -0,0 +1,67 @@
+import logging
+import threading
+import time
+
+from utils.telegram_queue import QueuedBot, TelegramSendQueue
+
+
+class GatedBot:
+    """Отправки ждут release; в чат 13 отправка падает."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.release.wait(5)
+        if chat_id == 13:
+            raise RuntimeError("chat not found")
+        self.sent.append((chat_id, text))
+        return text
+
+
+def _bot(telegram_bot):
+    return QueuedBot(telegram_bot, TelegramSendQueue(telegram_bot, workers=2).start())
+
+
+def test_send_does_not_wait_by_default_and_keeps_chat_order():
+    telegram_bot = GatedBot()
+    bot = _bot(telegram_bot)
+
+    # Три сообщения укладываются в burst лимита чата.
+    futures = [bot.send_message(21, f"сообщение {number}") for number in range(3)]
+    assert not any(future.done() for future in futures)
+
+    telegram_bot.release.set()
+    assert [future.result(timeout=5) for future in futures] == [f"сообщение {number}" for number in range(3)]
+    assert telegram_bot.sent == [(21, f"сообщение {number}") for number in range(3)]
+
+
+def test_explicit_wait_returns_result_or_raises():
+    telegram_bot = GatedBot()
+    telegram_bot.release.set()
+    bot = _bot(telegram_bot)
+
+    assert bot.send_message(22, "текст", wait=True) == "текст"
+    try:
+        bot.send_message(13, "текст", wait=True)
+    except RuntimeError as exc:
+        assert str(exc) == "chat not found"
+    else:
+        raise AssertionError("ошибка отправки не дошла до вызывающего")
+
+
+def test_failed_fire_and_forget_send_is_logged(caplog):
+    telegram_bot = GatedBot()
+    telegram_bot.release.set()
+    bot = _bot(telegram_bot)
+
+    with caplog.at_level(logging.ERROR, logger="utils.telegram_queue"):
+        bot.send_message(13, "текст").exception(timeout=5)
+        # Колбэк Future выполняется в потоке очереди сразу после set_exception.
+        for _ in range(100):
+            if "chat not found" in caplog.text:
+                break
+            time.sleep(0.01)
+
+    assert "RuntimeError: chat not found" in caplog.text
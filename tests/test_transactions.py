@@ -0,0 +1,96 @@
+import json
+import threading
+
+import pytest
+
+from utils import db_utils, journal
+
+
+def _external_write(path, database):
+    # Другой процесс переписал БД в обход блокировки писателя.
+    path.write_text(json.dumps(database, ensure_ascii=False) + "\n", encoding="utf-8")
+
+
+def test_external_change_raises_conflict_and_keeps_data(database_file):
+    path = database_file({"users": [{"telegram_id": 1}]})
+    with pytest.raises(db_utils.TransactionConflict):
+        with db_utils.transaction() as database:
+            database["users"].append({"telegram_id": 2})
+            _external_write(path, {"users": [{"telegram_id": 1}, {"telegram_id": 3}]})
+
+    assert [user["telegram_id"] for user in db_utils.db_snapshot()["users"]] == [1, 3]
+
+
+def test_run_in_transaction_retries_on_conflict(database_file):
+    path = database_file({"users": [{"telegram_id": 1}]})
+    attempts = []
+
+    def add_user(database, telegram_id):
+        attempts.append(len(database["users"]))
+        database["users"].append({"telegram_id": telegram_id})
+        if len(attempts) == 1:
+            _external_write(path, {"users": [{"telegram_id": 1}, {"telegram_id": 3}]})
+        return telegram_id
+
+    assert db_utils.run_in_transaction(add_user, 2) == 2
+    assert attempts == [1, 2]
+    db_utils.invalidate_db_cache()
+    assert [user["telegram_id"] for user in db_utils.db_snapshot()["users"]] == [1, 3, 2]
+
+
+def test_run_in_transaction_gives_up_after_retries(database_file):
+    path = database_file({"users": []})
+
+    def always_conflicts(database):
+        _external_write(path, {"users": [], "touched": len(database)})
+
+    with pytest.raises(db_utils.TransactionConflict):
+        db_utils.run_in_transaction(always_conflicts, retries=2)
+
+
+def test_checkpoint_does_not_conflict_with_writers(database_file):
+    database_file({"users": [], "delivery_requests": []})
+    db_utils.upsert_user_profile(1)
+    started = threading.Event()
+    checkpoint = threading.Thread(target=lambda: (started.wait(), db_utils.checkpoint_database()))
+    checkpoint.start()
+
+    with db_utils.transaction() as database:
+        started.set()
+        # Чекпоинт ждет блокировку писателя и не меняет файлы под транзакцией.
+        checkpoint.join(timeout=0.2)
+        database["users"].append({"telegram_id": 2})
+    checkpoint.join()
+
+    assert db_utils.append_order({"status": "pending"}) == 1
+    db_utils.upsert_user_profile(3, full_name="Анна")
+    db_utils.invalidate_db_cache()
+    snapshot = db_utils.db_snapshot()
+    assert [user["telegram_id"] for user in snapshot["users"]] == [1, 2, 3]
+    assert snapshot["delivery_requests"] == [{"status": "pending", "order_id": 1}]
+
+
+def test_writers_are_not_blocked_while_checkpoint_dumps_snapshot(database_file, monkeypatch):
+    path = database_file({"users": []})
+    db_utils.upsert_user_profile(1)
+    dumping = threading.Event()
+    release = threading.Event()
+    dump_snapshot = journal.dump_snapshot
+
+    def slow_dump(*args):
+        dumping.set()
+        release.wait(5)
+        return dump_snapshot(*args)
+
+    monkeypatch.setattr(journal, "dump_snapshot", slow_dump)
+    checkpoint = threading.Thread(target=db_utils.checkpoint_database)
+    checkpoint.start()
+    assert dumping.wait(5)
+    # Запись проходит, пока снимок сериализуется.
+    db_utils.upsert_user_profile(2)
+    release.set()
+    checkpoint.join()
+
+    assert [entry["seq"] for entry in map(json.loads, journal.journal_path(path).read_text().splitlines())] == [2]
+    db_utils.invalidate_db_cache()
+    assert [user["telegram_id"] for user in db_utils.db_snapshot()["users"]] == [1, 2]
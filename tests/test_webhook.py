@@ -0,0 +1,68 @@
+import json
+import threading
+
+import pytest
+
+from utils.webhook import WebhookServer, replay_updates
+
+
+def _update(update_id, text="/start"):
+    return {"update_id": update_id, "message": {"message_id": update_id, "text": text}}
+
+
+@pytest.fixture
+def webhook():
+    servers = []
+
+    def start(dispatch, **kwargs):
+        server = WebhookServer(dispatch, "s3cret", host="127.0.0.1", port=0, **kwargs).start()
+        servers.append(server)
+        return server, f"http://127.0.0.1:{server.port}/telegram"
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def _write_updates(path, lines):
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return path
+
+
+def test_replay_delivers_recorded_updates(webhook, tmp_path):
+    received = []
+    done = threading.Event()
+
+    def dispatch(update):
+        received.append(update["update_id"])
+        if len(received) == 3:
+            done.set()
+
+    server, url = webhook(dispatch)
+    path = _write_updates(tmp_path / "updates.jsonl", [json.dumps(_update(n)) for n in (1, 2, 3)] + [""])
+
+    assert replay_updates(path, url, "s3cret") == {200: 3}
+    assert done.wait(5)
+    assert sorted(received) == [1, 2, 3]
+    assert server.stats()["accepted"] == 3
+
+
+def test_replay_reports_rejected_and_malformed_updates(webhook, tmp_path):
+    server, url = webhook(lambda update: None)
+    path = _write_updates(tmp_path / "updates.jsonl", [json.dumps(_update(1)), "{не json"])
+
+    assert replay_updates(path, url, "wrong") == {403: 2}
+    assert replay_updates(path, url, "s3cret") == {200: 1, 400: 1}
+    assert server.stats()["rejected"] == 2
+
+
+def test_full_queue_answers_503(webhook, tmp_path):
+    release = threading.Event()
+    server, url = webhook(lambda update: release.wait(5), workers=1, queue_size=1, accept_timeout=0.05)
+    path = _write_updates(tmp_path / "updates.jsonl", [json.dumps(_update(n)) for n in (1, 2)])
+
+    try:
+        assert replay_updates(path, url, "s3cret") == {200: 1, 503: 1}
+    finally:
+        release.set()
+    assert server.stats()["busy"] == 1
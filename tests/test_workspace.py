@@ -0,0 +1,93 @@
+import json
+
+from utils import db_utils, journal
+from utils.workspace import Workspace
+
+
+def _last_changes(path):
+    lines = journal.journal_path(path).read_text(encoding="utf-8").splitlines()
+    return json.loads(lines[-1])["changes"]
+
+
+def test_transaction_journals_only_touched_records(database_file):
+    path = database_file({"users": [{"telegram_id": n} for n in range(100)], "cells": []})
+    db_utils.upsert_user_profile(42, full_name="Анна")
+
+    assert _last_changes(path) == [
+        {"op": "set", "table": "users", "pos": 42, "record": {"telegram_id": 42, "full_name": "Анна"}},
+    ]
+    snapshot = db_utils.db_snapshot()
+    assert snapshot["users"][42]["full_name"] == "Анна"
+    assert len(snapshot["users"]) == 100
+
+
+def test_workspace_does_not_change_cached_snapshot(database_file):
+    database_file({"items": [{"rental_agreement_qr_code": "QR-1", "item_list": ["лыжи"]}]})
+    before = db_utils.db_snapshot()
+
+    with db_utils.transaction() as database:
+        database["items"][0]["item_list"].append("санки")
+        kept = database["items"][0]
+
+    assert before["items"][0]["item_list"] == ["лыжи"]
+    after = db_utils.db_snapshot()
+    assert after["items"][0]["item_list"] == ["лыжи", "санки"]
+    # Запись, оставшаяся у вызывающего, не связана с новым снимком.
+    kept["item_list"].append("велосипед")
+    assert after["items"][0]["item_list"] == ["лыжи", "санки"]
+
+
+def test_reshaped_table_is_diffed_as_a_whole(database_file):
+    path = database_file({"reminders": [{"n": n} for n in range(5)]})
+    with db_utils.transaction() as database:
+        del database["reminders"][1]
+
+    assert _last_changes(path) == [
+        {"op": "set", "table": "reminders", "pos": 1, "record": {"n": 2}},
+        {"op": "set", "table": "reminders", "pos": 2, "record": {"n": 3}},
+        {"op": "set", "table": "reminders", "pos": 3, "record": {"n": 4}},
+        {"op": "truncate", "table": "reminders", "length": 4},
+    ]
+    db_utils.invalidate_db_cache()
+    assert db_utils.db_snapshot()["reminders"] == [{"n": 0}, {"n": 2}, {"n": 3}, {"n": 4}]
+
+
+def test_workspace_changes_for_keys():
+    base = {"sequences": {"order_id": 1}, "old": [1], "users": [{"telegram_id": 1}]}
+    workspace = Workspace(base)
+    workspace["sequences"]["order_id"] = 2
+    workspace.pop("old")
+    workspace.setdefault("reminders", []).append({"n": 1})
+    list(workspace["users"])
+
+    assert workspace.changes() == [
+        {"op": "put", "key": "sequences", "value": {"order_id": 2}},
+        {"op": "drop", "key": "old"},
+        {"op": "put", "key": "reminders", "value": [{"n": 1}]},
+    ]
+    assert base == {"sequences": {"order_id": 1}, "old": [1], "users": [{"telegram_id": 1}]}
+
+
+def test_db_reader_copies_nested_values(database_file):
+    database_file({"items": [{"rental_agreement_qr_code": "QR-1", "item_list": ["лыжи"]}]})
+    copied = db_utils.db_reader()
+    copied["items"][0]["item_list"].append("санки")
+
+    assert db_utils.db_snapshot()["items"][0]["item_list"] == ["лыжи"]
+
+
+def test_cells_check_reads_snapshot_and_fixes_only_mismatches(database_file):
+    database_file(
+        {
+            "cells": [{"number": "A-1", "is_occupied": False}, {"number": "A-2", "is_occupied": True}],
+            "rental_agreements": [{"qr_code": "QR-1", "cell_number": "A-1", "status": "Активна"}],
+        }
+    )
+    before = db_utils.db_snapshot()
+    misses = db_utils.db_cache_stats()["misses"]
+
+    assert db_utils.check_cells_occupancy()
+    assert before["cells"][0]["is_occupied"] is False
+    assert [cell["is_occupied"] for cell in db_utils.db_snapshot()["cells"]] == [True, False]
+    assert not db_utils.check_cells_occupancy()
+    assert db_utils.db_cache_stats()["misses"] == misses
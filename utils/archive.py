@@ -0,0 +1,214 @@
+import gzip
+import json
+import os
+import uuid
+from datetime import date, timedelta
+from pathlib import Path
+
+from .db_utils import db_snapshot, run_in_transaction
+from .models import parse_iso_date
+
+
+ARCHIVE_DIR = Path("archive")
+ARCHIVED_TABLES = ("rental_agreements", "delivery_requests", "items", "reminders")
+# Сводка по архиву в рабочей БД: отчеты берут ее, не читая архивные файлы.
+SUMMARY_KEY = "archive_summary"
+# Записи, убранные из рабочих таблиц, но еще не подтвержденные в архиве.
+PENDING_KEY = "archive_pending"
+
+
+def archive_after_days():
+    return int(os.getenv("ARCHIVE_AFTER_DAYS") or 180)
+
+
+def _parse_date(value):
+    """Дата из "YYYY-MM-DD" или начала отметки времени "YYYY-MM-DDTHH:MM:SSZ"."""
+    return parse_iso_date(value[:10]) if isinstance(value, str) else None
+
+
+def _closed_on(table, record, live_agreements):
+    """Дата закрытия записи или None, если запись еще нужна в рабочей БД."""
+    if table == "rental_agreements":
+        if record.get("status") != "Закончена":
+            return None
+        return _parse_date(record.get("end_date"))
+    if table == "delivery_requests":
+        status = record.get("status")
+        if status == "completed":
+            return _parse_date(record.get("completed_at")) or _parse_date(record.get("requested_at"))
+        if status == "rejected":
+            return _parse_date(record.get("rejected_at")) or _parse_date(record.get("requested_at"))
+        return None
+    if table == "items":
+        # Вещи уходят в архив вслед за договором: и в этот запуск, и если
+        # договор заархивирован раньше или вовсе отсутствует в рабочей БД.
+        if record.get("rental_agreement_qr_code") in live_agreements:
+            return None
+        return (
+            _parse_date(record.get("removed_at"))
+            or _parse_date(record.get("updated_at"))
+            or _parse_date(record.get("added_at"))
+        )
+    if table == "reminders":
+        return _parse_date(record.get("sent_at"))
+    return None
+
+
+def archive_path(table, month):
+    return ARCHIVE_DIR / table / f"{month}.jsonl.gz"
+
+
+def archive_closed_records(max_age_days=None, today=None):
+    """Переносит закрытые записи старше max_age_days в архив, помесячно, в gzip.
+
+    Первая транзакция только перекладывает записи из рабочих таблиц в пачку
+    database["archive_pending"] с новым id, поэтому ее повтор после конфликта
+    безопасен. После нее пачка дописывается в файлы архива (с fsync), а
+    вторая транзакция, если id пачки не сменился, добавляет ее в сводку и
+    удаляет. Если процесс упадет между ними, пачка останется в БД и будет
+    дописана при следующем запуске: дубли строк в файлах убирает чтение
+    архива, а в сводку каждая пачка попадает ровно один раз.
+    """
+    if max_age_days is None:
+        max_age_days = archive_after_days()
+    cutoff = (today or date.today()) - timedelta(days=max_age_days)
+    _flush_pending()
+    moved = run_in_transaction(_take_closed_records, cutoff)
+    if not _flush_pending():
+        _backfill_summary()
+    return moved
+
+
+def _take_closed_records(database, cutoff):
+    moved = {}
+    live_agreements = set()
+    batches = {}
+    for table in ARCHIVED_TABLES:
+        records = database.get(table, [])
+        kept = []
+        for record in records:
+            closed_on = _closed_on(table, record, live_agreements) if isinstance(record, dict) else None
+            if closed_on is None or closed_on > cutoff:
+                kept.append(record)
+                continue
+            batches.setdefault((table, closed_on.strftime("%Y-%m")), []).append(record)
+        if table == "rental_agreements":
+            live_agreements = {record.get("qr_code") for record in kept if isinstance(record, dict)}
+        if len(kept) != len(records):
+            moved[table] = len(records) - len(kept)
+            database[table] = kept
+
+    if batches:
+        pending = database.get(PENDING_KEY) or {"batches": []}
+        pending["batches"].extend([table, month, records] for (table, month), records in batches.items())
+        # Новый id: завершение, начатое по старому содержимому пачки, ее не удалит.
+        pending["id"] = uuid.uuid4().hex
+        database[PENDING_KEY] = pending
+    return moved
+
+
+def _flush_pending():
+    """Дописывает отложенную пачку в файлы архива и переносит ее в сводку."""
+    database = db_snapshot()
+    pending = database.get(PENDING_KEY) if isinstance(database, dict) else None
+    if not pending:
+        return False
+    for table, month, records in pending["batches"]:
+        _append_archive(archive_path(table, month), records)
+    return run_in_transaction(_finish_pending, pending["id"])
+
+
+def _backfill_summary():
+    """Сводка по архиву, накопленному до ее появления, считается один раз по файлам."""
+    database = db_snapshot()
+    if not isinstance(database, dict) or SUMMARY_KEY in database:
+        return
+    if any(archived_months(table) for table in ARCHIVED_TABLES):
+        run_in_transaction(_set_summary_from_archive)
+
+
+def _set_summary_from_archive(database):
+    if SUMMARY_KEY not in database:
+        database[SUMMARY_KEY] = _summary_from_archive()
+
+
+def _finish_pending(database, pending_id):
+    pending = database.get(PENDING_KEY)
+    if not pending or pending.get("id") != pending_id:
+        return False
+    summary = database.get(SUMMARY_KEY)
+    if summary is None:
+        # Первая сводка считается по файлам целиком (пачка в них уже есть): так
+        # учитывается и архив, накопленный до ее появления.
+        database[SUMMARY_KEY] = _summary_from_archive()
+    else:
+        for table, _, records in pending["batches"]:
+            _add_to_summary(summary, table, records)
+        database[SUMMARY_KEY] = summary
+    del database[PENDING_KEY]
+    return True
+
+
+def archive_summary(database):
+    """Сводка по архиву: {"counts": {таблица: записей}, "order_users": [клиенты с заявками]}."""
+    summary = database.get(SUMMARY_KEY) if isinstance(database, dict) else None
+    return summary or {"counts": {}, "order_users": []}
+
+
+def _add_to_summary(summary, table, records):
+    if not records:
+        return
+    counts = summary.setdefault("counts", {})
+    counts[table] = counts.get(table, 0) + len(records)
+    if table == "delivery_requests":
+        users = set(summary.get("order_users", []))
+        users.update(record.get("user_telegram_id") for record in records)
+        users.discard(None)
+        summary["order_users"] = sorted(users, key=str)
+
+
+def _summary_from_archive():
+    summary = {"counts": {}, "order_users": []}
+    for table in ARCHIVED_TABLES:
+        _add_to_summary(summary, table, list(iter_archive(table)))
+    return summary
+
+
+def _append_archive(path, records):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+    with open(path, "ab") as raw_file:
+        with gzip.GzipFile(fileobj=raw_file, mode="ab") as file:
+            file.write(payload.encode("utf-8"))
+        raw_file.flush()
+        os.fsync(raw_file.fileno())
+
+
+def archived_months(table):
+    table_dir = ARCHIVE_DIR / table
+    if not table_dir.exists():
+        return []
+    return sorted(path.name[: -len(".jsonl.gz")] for path in table_dir.glob("*.jsonl.gz"))
+
+
+def iter_archive(table, months=None):
+    """Записи из архива таблицы (все месяцы или только перечисленные "YYYY-MM")."""
+    seen = set()
+    for month in months or archived_months(table):
+        path = archive_path(table, month)
+        if not path.exists():
+            continue
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            for line in file:
+                line = line.strip()
+                if not line or line in seen:
+                    continue
+                seen.add(line)
+                yield json.loads(line)
+
+
+def find_archived(table, field, value):
+    for record in iter_archive(table):
+        if record.get(field) == value:
+            return record
+    return None
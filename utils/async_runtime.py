@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import Update
+
+from .telegram_queue import deferred_sends
+from .webhook import build_webhook_server
+
+
+logger = logging.getLogger(__name__)
+
+
+def async_settings():
+    return {
+        # Потоки для блокирующей работы обработчиков: БД, QR, SMTP.
+        "executor_workers": int(os.getenv("ASYNC_EXECUTOR_WORKERS") or 16),
+        # Сколько сообщений может ждать обработки; сверх — прием обновлений ждет.
+        "max_pending": int(os.getenv("ASYNC_MAX_PENDING") or 10000),
+    }
+
+
+class AsyncOrderedDispatcher:
+    """Очередность как у OrderedDispatcher, но ожидание — корутины в event loop.
+
+    Сообщения одного ключа (id пользователя) выстраиваются в цепочку задач:
+    каждая ждет предыдущую, поэтому обработка идет строго по очереди.
+    Ожидающие сообщения не занимают потоков — поток из executor берется
+    только на время самого обработчика, который остается обычной
+    синхронной функцией, общей с потоковым режимом. Отправки QueuedBot
+    внутри обработчика не ждут очереди Telegram в потоке: их Future
+    ожидаются в event loop (asyncio.wrap_future), и только после этого
+    начинается следующее сообщение того же ключа.
+    """
+
+    def __init__(self, executor_workers=16, max_pending=10000):
+        self._executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix="async-blocking")
+        self._slots = asyncio.Semaphore(max_pending)
+        self._tails = {}
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.max_pending_seen = 0
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.last_error = None
+
+    async def submit(self, key, func, *args):
+        """Ставит func(*args) после предыдущих задач ключа; ждет только при переполнении.
+
+        Задача создается до ожидания места, чтобы очередность ключа не
+        зависела от семафора, поэтому max_pending — мягкий предел: пачка
+        обновлений от Telegram может ненадолго его превысить.
+        """
+        previous = self._tails.get(key)
+        task = asyncio.get_running_loop().create_task(self._run(key, previous, func, args))
+        self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._finished)
+        with self._lock:
+            self.pending += 1
+            self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        await self._slots.acquire()
+        return task
+
+    def _finished(self, task):
+        self._tasks.discard(task)
+        self._slots.release()
+
+    @staticmethod
+    def _timed_call(func, args):
+        started = time.perf_counter()
+        with deferred_sends() as sends:
+            try:
+                func(*args)
+                return None, time.perf_counter() - started, sends
+            except Exception as exc:
+                logger.exception("Ошибка обработчика в executor asyncio-режима")
+                return f"{type(exc).__name__}: {exc}", time.perf_counter() - started, sends
+
+    async def _run(self, key, previous, func, args):
+        if previous is not None:
+            await asyncio.wait([previous])
+        error, seconds = "CancelledError", 0.0
+        try:
+            error, seconds, sends = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._timed_call, func, args
+            )
+            if sends:
+                results = await asyncio.gather(
+                    *(asyncio.wrap_future(future) for future in sends), return_exceptions=True
+                )
+                send_errors = [result for result in results if isinstance(result, Exception)]
+                for send_error in send_errors:
+                    logger.error("Сообщение не отправлено: %s: %s", type(send_error).__name__, send_error)
+                if send_errors and error is None:
+                    error = f"{type(send_errors[0]).__name__}: {send_errors[0]}"
+        finally:
+            if self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+            with self._lock:
+                self.pending -= 1
+                self.processed += 1
+                self.busy_seconds += seconds
+                if error:
+                    self.failed += 1
+                    self.last_error = error
+
+    async def join(self):
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    def stop(self):
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        """Тот же формат, что у OrderedDispatcher.stats(): одна запись на event loop."""
+        with self._lock:
+            return [
+                {
+                    "worker": "asyncio",
+                    "depth": self.pending,
+                    "max_depth": self.max_pending_seen,
+                    "processed": self.processed,
+                    "failed": self.failed,
+                    "busy_seconds": round(self.busy_seconds, 3),
+                    "last_error": self.last_error,
+                }
+            ]
+
+
+def build_async_bot(token, handle_message, dispatcher):
+    """AsyncTeleBot, который передает каждое текстовое сообщение в dispatcher."""
+    async_bot = AsyncTeleBot(token)
+
+    @async_bot.message_handler(func=lambda message: True)
+    async def route_message(message):
+        await dispatcher.submit(message.from_user.id, handle_message, message)
+
+    return async_bot
+
+
+async def serve_async_bot(async_bot, bot_mode="polling"):
+    if bot_mode != "webhook":
+        await async_bot.remove_webhook()
+        await async_bot.infinity_polling(skip_pending=True)
+        return
+
+    loop = asyncio.get_running_loop()
+
+    def dispatch(update):
+        # Поток webhook-сервера ждет только постановки сообщения в очередь.
+        future = asyncio.run_coroutine_threadsafe(
+            async_bot.process_new_updates([Update.de_json(update)]), loop
+        )
+        future.result()
+
+    server, settings = build_webhook_server(dispatch)
+    await async_bot.remove_webhook()
+    await async_bot.set_webhook(url=settings["url"], secret_token=settings["secret"], drop_pending_updates=True)
+    server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await loop.run_in_executor(None, server.stop)
+
+
+def run_async_bot(token, handle_message, dispatcher, bot_mode="polling"):
+    """Запускает прием обновлений в одном event loop (BOT_RUNTIME=asyncio)."""
+    async def main():
+        async_bot = build_async_bot(token, handle_message, dispatcher)
+        try:
+            await serve_async_bot(async_bot, bot_mode)
+        finally:
+            await dispatcher.join()
+            await async_bot.close_session()
+
+    try:
+        asyncio.run(main())
+    finally:
+        dispatcher.stop()
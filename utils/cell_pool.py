@@ -0,0 +1,78 @@
+import heapq
+from bisect import bisect_left, insort
+
+
+class FreeCellPool:
+    """Свободные ячейки, разложенные по (склад, размер): номер ячейки -> позиция в cells.
+
+    Позиции каждой корзины дополнительно хранятся отсортированными, чтобы
+    candidates() отдавал ячейки в порядке таблицы cells — в том же порядке,
+    в каком их находит последовательный поиск первой свободной ячейки.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.ordered = {}
+
+    @staticmethod
+    def _bucket_key(cell):
+        return cell.get("warehouse_name"), cell.get("cell_size_code")
+
+    def add(self, position, cell):
+        if not isinstance(cell, dict) or cell.get("is_occupied") or cell.get("number") is None:
+            return
+        key = self._bucket_key(cell)
+        bucket = self.buckets.setdefault(key, {})
+        ordered = self.ordered.setdefault(key, [])
+        previous = bucket.get(cell.get("number"))
+        if previous is not None:
+            self._drop_position(ordered, previous)
+        bucket[cell.get("number")] = position
+        insort(ordered, position)
+
+    def discard(self, position, cell):
+        if not isinstance(cell, dict):
+            return
+        key = self._bucket_key(cell)
+        bucket = self.buckets.get(key)
+        if bucket is None or bucket.get(cell.get("number")) != position:
+            return
+        del bucket[cell.get("number")]
+        self._drop_position(self.ordered[key], position)
+        if not bucket:
+            del self.buckets[key]
+            del self.ordered[key]
+
+    @staticmethod
+    def _drop_position(ordered, position):
+        at = bisect_left(ordered, position)
+        if at < len(ordered) and ordered[at] == position:
+            del ordered[at]
+
+    def clear(self):
+        self.buckets = {}
+        self.ordered = {}
+
+    def candidates(self, warehouse_name=None, cell_size_code=None):
+        """Позиции свободных ячеек по возрастанию; None в фильтре означает «любой».
+
+        Генератор ленивый и читает корзины без копирования: первая позиция
+        стоит O(число корзин), а не O(число свободных ячеек). Дочитывать его
+        нужно до изменения пула (пул меняется только при сохранении БД).
+        """
+        if warehouse_name is not None and cell_size_code is not None:
+            return iter(self.ordered.get((warehouse_name, cell_size_code), ()))
+        matching = [
+            ordered
+            for (bucket_warehouse, bucket_size), ordered in self.ordered.items()
+            if (warehouse_name is None or bucket_warehouse == warehouse_name)
+            and (cell_size_code is None or bucket_size == cell_size_code)
+        ]
+        return heapq.merge(*matching)
+
+    def free_counts(self):
+        """{склад: {размер: количество свободных ячеек}}."""
+        counts = {}
+        for (warehouse_name, cell_size_code), bucket in self.buckets.items():
+            counts.setdefault(warehouse_name, {})[cell_size_code] = len(bucket)
+        return counts
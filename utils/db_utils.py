@@ -1,59 +1,390 @@
-import json
+import copy
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
+from . import journal, sqlite_storage
+from .indexes import DatabaseIndex
+from .models import MODELS, ModelView
+from .workspace import Workspace, copy_record, detach_changes
+
 
 DATABASE_FILE = Path("database.json")
 
+logger = logging.getLogger(__name__)
+
+_cache_lock = threading.RLock()
+_writer_lock = threading.RLock()
+_checkpoint_lock = threading.Lock()
+_transaction_local = threading.local()
+_cache = {
+    "database": None,
+    "index": None,
+    "models": None,
+    "stamp": None,
+    "version": 0,
+    "hits": 0,
+    "misses": 0,
+    # Во время чекпоинта файлы меняет сам процесс, снимок в кеше актуален.
+    "checkpointing": False,
+}
+
+
+def storage_backend():
+    """Хранилище выбирается переменной окружения DB_BACKEND: json (по умолчанию) или sqlite."""
+    backend = (os.getenv("DB_BACKEND") or "json").strip().lower()
+    return backend if backend in {"json", "sqlite"} else "json"
+
+
+def _sqlite_path():
+    return os.getenv("SQLITE_PATH") or None
+
 
 def db_reader():
-    """Достает информацию из БД."""
-    if not DATABASE_FILE.exists():
-        return []
+    """Достает информацию из БД.
+
+    Снимок БД кешируется в памяти процесса и перечитывается, только если файл
+    изменили извне (mtime/размер) или сменилась версия. Возвращается копия
+    снимка, поэтому её можно менять и передавать в save_database().
+    """
+    database = db_snapshot()
+    return copy_database(database) if isinstance(database, dict) else database
 
-    try:
-        with DATABASE_FILE.open("r", encoding="utf-8") as file:
-            database = json.load(file)
-    except json.JSONDecodeError:
-        return []
 
-    return database if isinstance(database, dict) else []
+def db_snapshot():
+    """Последний сохраненный снимок БД без копирования — только для чтения."""
+    with _cache_lock:
+        if _cache["database"] is not None and _cache["checkpointing"]:
+            _cache["hits"] += 1
+            return _cache["database"]
+        stamp = _storage_stamp()
+        if _cache["database"] is not None and _cache["stamp"] == stamp:
+            _cache["hits"] += 1
+            return _cache["database"]
+
+        _cache["misses"] += 1
+        database = _load_database()
+        if not isinstance(database, dict):
+            _cache["database"] = None
+            _cache["index"] = None
+            _cache["models"] = None
+            return database
+        _cache["database"] = database
+        _cache["index"] = DatabaseIndex(database)
+        _cache["models"] = ModelView()
+        _cache["stamp"] = stamp
+        _cache["version"] += 1
+        return database
 
 
 def save_database(database):
-    with DATABASE_FILE.open("w", encoding="utf-8") as file:
-        json.dump(database, file, ensure_ascii=False, indent=2)
+    """Сохраняет БД.
 
+    Для database.json в журнал дописываются только изменившиеся записи,
+    сам файл перезаписывается фоновым чекпоинтом (см. checkpoint_database).
+    Запись идет под блокировкой писателя, читатели в это время получают
+    последний сохраненный снимок. Рабочая копия транзакции (Workspace) сама
+    знает, какие записи затронуты; обычный словарь сравнивается целиком.
+    Новый снимок делит с прежним все неизменившиеся таблицы и записи.
+    """
+    with _writer_lock:
+        with _cache_lock:
+            committed = _cache["database"]
+            index = _cache["index"]
+            models = _cache["models"]
+            if committed is None or _cache["stamp"] != _storage_stamp():
+                committed = _load_database()
+                if not isinstance(committed, dict):
+                    committed = {}
+                index = DatabaseIndex(committed)
+                models = ModelView()
+        if isinstance(database, Workspace) and database.base is committed:
+            changes = database.changes()
+        else:
+            changes = journal.diff_database(committed, database)
+        if not changes:
+            return
+        changes = detach_changes(changes)
 
-def sync_cells_occupancy(database):
-    cells = database.get("cells", [])
+        snapshot = dict(committed)
+        for table in {change["table"] for change in changes if "table" in change}:
+            snapshot[table] = list(committed.get(table) or [])
+        journal.apply_changes(snapshot, changes)
+
+        if storage_backend() == "sqlite":
+            sqlite_storage.save_changes(snapshot, changes, _sqlite_path())
+        else:
+            journal.append(DATABASE_FILE, changes)
+
+        index.apply_changes(committed, snapshot, changes)
+        models.apply_changes(changes)
+        with _cache_lock:
+            _cache["database"] = snapshot
+            _cache["index"] = index
+            _cache["models"] = models
+            _cache["stamp"] = _storage_stamp()
+            _cache["version"] += 1
+
+
+class TransactionConflict(RuntimeError):
+    """БД изменилась в обход транзакции (например, другим процессом)."""
+
+
+@contextmanager
+def transaction():
+    """Read-modify-write под единственной блокировкой писателя.
+
+    Внутри блока доступна рабочая копия БД (Workspace: записи снимка
+    копируются при обращении), при выходе без исключения она сохраняется. Вложенные вызовы в том же потоке используют внешнюю
+    транзакцию. Если БД изменилась в обход блокировки, поднимается
+    TransactionConflict и ничего не сохраняется; писатели поэтому вызывают
+    run_in_transaction(), который повторяет транзакцию. Чекпоинт сам
+    обновляет отметку хранилища под той же блокировкой и конфликтов не
+    вызывает.
+    """
+    current = getattr(_transaction_local, "database", None)
+    if current is not None:
+        yield current
+        return
+
+    with _writer_lock:
+        snapshot = db_snapshot()
+        database = Workspace(snapshot if isinstance(snapshot, dict) else {})
+        with _cache_lock:
+            version = _cache["version"]
+
+        _transaction_local.database = database
+        try:
+            yield database
+        finally:
+            _transaction_local.database = None
+
+        with _cache_lock:
+            conflict = _cache["version"] != version or _cache["stamp"] != _storage_stamp()
+            if conflict:
+                _cache["database"] = None
+                _cache["index"] = None
+                _cache["models"] = None
+                _cache["stamp"] = None
+        if conflict:
+            raise TransactionConflict("БД изменилась во время транзакции, изменения не сохранены")
+        save_database(database)
+
+
+def run_in_transaction(func, *args, retries=3, **kwargs):
+    """Выполняет func(database, *args, **kwargs) в транзакции, повторяя её при конфликте."""
+    for attempt in range(retries + 1):
+        try:
+            with transaction() as database:
+                return func(database, *args, **kwargs)
+        except TransactionConflict:
+            if attempt == retries:
+                raise
+
+
+def checkpoint_database():
+    """Переносит накопленный журнал в database.json (атомарно) и очищает журнал.
+
+    Под блокировкой писателя берутся только снимок и номер последней записи
+    журнала. Снимок в кеше не меняется на месте (сохранение создает новый),
+    поэтому он сериализуется во временный файл без блокировки, пока писатели
+    дописывают журнал. Подмена файла и чистка журнала от записей, вошедших в
+    снимок, снова идут под блокировкой и с транзакциями не пересекаются.
+    В снимок записывается номер последней учтенной записи журнала: если
+    процесс упадет между подменой снимка и чисткой журнала, эти записи при
+    чтении будут пропущены, а не применены второй раз.
+    """
+    with _checkpoint_lock:
+        with _writer_lock:
+            if storage_backend() != "json" or not journal.pending_entries():
+                return False
+            database = db_snapshot()
+            if not isinstance(database, dict):
+                return False
+            upto_seq = journal.last_seq()
+            snapshot_stamp = _file_stamp(DATABASE_FILE)
+
+        tmp_path = journal.dump_snapshot(DATABASE_FILE, database, upto_seq)
+
+        with _writer_lock:
+            if _file_stamp(DATABASE_FILE) != snapshot_stamp:
+                # database.json переписали в обход бота — его не затираем.
+                tmp_path.unlink(missing_ok=True)
+                return False
+            with _cache_lock:
+                _cache["checkpointing"] = True
+            try:
+                journal.install_snapshot(DATABASE_FILE, tmp_path)
+                journal.compact(DATABASE_FILE, upto_seq)
+            finally:
+                with _cache_lock:
+                    _cache["stamp"] = _storage_stamp()
+                    _cache["checkpointing"] = False
+    return True
+
+
+def start_checkpointer(interval_seconds=None):
+    """Фоновый поток, периодически сворачивающий журнал в снимок."""
+    if interval_seconds is None:
+        interval_seconds = int(os.getenv("JOURNAL_CHECKPOINT_SECONDS") or 60)
+
+    def worker():
+        while True:
+            time.sleep(interval_seconds)
+            try:
+                checkpoint_database()
+            except Exception:
+                logger.exception("Чекпоинт журнала не удался, журнал продолжает расти")
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    return thread
+
+
+def db_cache_stats():
+    """Счетчики кеша снимка (db_snapshot/db_reader): попадания, промахи (перечитывания БД) и версия снимка."""
+    with _cache_lock:
+        return {
+            "hits": _cache["hits"],
+            "misses": _cache["misses"],
+            "version": _cache["version"],
+        }
+
+
+def invalidate_db_cache():
+    with _cache_lock:
+        _cache["database"] = None
+        _cache["index"] = None
+        _cache["models"] = None
+        _cache["stamp"] = None
+
+
+def copy_database(database):
+    """Полная копия БД: записи копируются вместе с вложенными списками (item_list и т.п.),
+    поэтому никакие изменения копии не затрагивают кеш."""
+    copied = {}
+    for key, value in database.items():
+        if isinstance(value, list):
+            copied[key] = [copy_record(record) for record in value]
+        else:
+            copied[key] = copy.deepcopy(value)
+    return copied
+
+
+def _load_database():
+    if storage_backend() == "sqlite":
+        return sqlite_storage.load_database(_sqlite_path())
+    return journal.load(DATABASE_FILE)
+
+
+def _storage_stamp():
+    if storage_backend() == "sqlite":
+        return ("sqlite", _sqlite_path(), sqlite_storage.data_version(_sqlite_path()))
+    return ("json", _file_stamp(DATABASE_FILE), _file_stamp(journal.journal_path(DATABASE_FILE)))
+
+
+def _file_stamp(path):
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return (str(path), stat.st_mtime_ns, stat.st_size)
+
+
+def check_cells_occupancy():
+    """Периодическая сверка занятости ячеек с активными договорами.
+
+    В обычной работе занятость поддерживают approve_order/complete_order
+    через allocate_cell/release_cell, здесь исправляются только расхождения.
+    Проверка читает снимок без копирования; транзакция открывается, только
+    если расхождения есть.
+    """
+    database = db_snapshot()
+    if not isinstance(database, dict) or not _occupancy_mismatches(database):
+        return False
+    run_in_transaction(sync_cells_occupancy)
+    return True
+
+
+def _occupancy_mismatches(database):
+    """[(ячейка, какой должна быть is_occupied)] для ячеек, расходящихся с договорами. Ничего не меняет."""
     active_cell_numbers = {
         rent.get("cell_number")
         for rent in database.get("rental_agreements", [])
         if rent.get("status") == "Активна"
     }
-    changed = False
-    for cell in cells:
+    mismatches = []
+    for cell in database.get("cells", []):
         should_be_occupied = cell.get("number") in active_cell_numbers
         if bool(cell.get("is_occupied")) != should_be_occupied:
-            cell["is_occupied"] = should_be_occupied
-            changed = True
-    return changed
+            mismatches.append((cell, should_be_occupied))
+    return mismatches
+
+
+def sync_cells_occupancy(database):
+    mismatches = _occupancy_mismatches(database)
+    for cell, should_be_occupied in mismatches:
+        cell["is_occupied"] = should_be_occupied
+    return bool(mismatches)
 
 
 def append_order(order):
-    database = db_reader()
-    if not isinstance(database, dict):
-        database = {}
+    has_order_id = isinstance(order, dict) and "order_id" in order
+    return run_in_transaction(_append_order, order, has_order_id)
+
 
+def _append_order(database, order, has_order_id):
     delivery_requests = database.setdefault("delivery_requests", [])
-    order_id = len(delivery_requests) + 1
-    if isinstance(order, dict):
-        order.setdefault("order_id", order_id)
+    order_id = next_sequence_value(database, "order_id")
+    # При повторе транзакции номер выдается заново, а не берется из прошлой попытки.
+    if isinstance(order, dict) and not has_order_id:
+        order["order_id"] = order_id
     delivery_requests.append(order)
-    save_database(database)
     return order_id
 
 
+def next_sequence_value(database, name):
+    """Следующее значение счетчика из database["sequences"].
+
+    Счетчик сохраняется в той же транзакции, что и новая запись, поэтому
+    номера не повторяются ни после удаления записей, ни после сбоя.
+    """
+    sequences = database.setdefault("sequences", {})
+    current = sequences.get(name)
+    if not isinstance(current, int):
+        current = _sequence_floor(database, name)
+    sequences[name] = current + 1
+    return current + 1
+
+
+def _sequence_floor(database, name):
+    if name != "order_id":
+        return 0
+    floor = 0
+    for idx, order in enumerate(database.get("delivery_requests", []), start=1):
+        order_id = order.get("order_id") if isinstance(order, dict) else None
+        floor = max(floor, order_id if isinstance(order_id, int) else idx)
+    return floor
+
+
+def ensure_order_ids():
+    """Проставляет order_id старым заявкам (раньше номером считалась позиция в списке)."""
+    run_in_transaction(_ensure_order_ids)
+
+
+def _ensure_order_ids(database):
+    for idx, order in enumerate(database.get("delivery_requests", []), start=1):
+        if isinstance(order, dict) and not isinstance(order.get("order_id"), int):
+            order["order_id"] = idx
+    sequences = database.setdefault("sequences", {})
+    if not isinstance(sequences.get("order_id"), int):
+        sequences["order_id"] = _sequence_floor(database, "order_id")
+
+
 def upsert_user_profile(
     telegram_id,
     full_name=None,
@@ -63,67 +394,193 @@ def upsert_user_profile(
     email=None,
     acquisition_source=None,
 ):
-    database = db_reader()
-    if not isinstance(database, dict):
-        database = {}
+    fields = {
+        "full_name": full_name,
+        "username": username,
+        "phone": phone,
+        "address": address,
+        "email": email,
+        "acquisition_source": acquisition_source,
+    }
+    run_in_transaction(_upsert_user_profile, telegram_id, fields)
 
-    users = database.setdefault("users", [])
-    user = None
-    for item in users:
-        if item.get("telegram_id") == telegram_id:
-            user = item
-            break
 
+def _upsert_user_profile(database, telegram_id, fields):
+    users = database.setdefault("users", [])
+    user = find_user(database, telegram_id)
     if user is None:
         user = {"telegram_id": telegram_id}
         users.append(user)
+    for field, value in fields.items():
+        if value:
+            user[field] = value
 
-    if full_name:
-        user["full_name"] = full_name
-    if username:
-        user["username"] = username
-    if phone:
-        user["phone"] = phone
-    if address:
-        user["address"] = address
-    if email:
-        user["email"] = email
-    if acquisition_source:
-        user["acquisition_source"] = acquisition_source
 
-    save_database(database)
+_EMPTY_INDEX = DatabaseIndex({})
+_availability_cache = {"version": None, "summary": None}
+
+
+def _index():
+    with _cache_lock:
+        return _cache["index"] or _EMPTY_INDEX
 
 
 def find_user(database, telegram_id):
-    for user in database.get("users", []):
-        if user.get("telegram_id") == telegram_id:
-            return user
-    return None
+    found = _index().lookup(database, "users_by_telegram_id", telegram_id)
+    return found[0] if found else None
 
 
 def get_cell_by_number(database, cell_number):
-    for cell in database.get("cells", []):
-        if cell.get("number") == cell_number:
+    found = _index().lookup(database, "cells_by_number", cell_number)
+    return found[0] if found else None
+
+
+def allocate_cell(database, cell_size_code=None):
+    """Занимает первую свободную ячейку нужного размера, а если таких нет — первую свободную.
+
+    «Первую» — в порядке таблицы cells, как при последовательном просмотре;
+    пул отдает позиции кандидатов уже по возрастанию.
+    """
+    index = _index()
+    cells = database.get("cells", [])
+    preferences = [cell_size_code, None] if cell_size_code is not None else [None]
+    for preferred_size in preferences:
+        # Ячейки, добавленные после построения индекса, в пул еще не попали.
+        positions = itertools.chain(
+            index.free_cells.candidates(cell_size_code=preferred_size),
+            range(index.lengths.get("cells", 0), len(cells)),
+        )
+        for position in positions:
+            if position >= len(cells):
+                continue
+            cell = cells[position]
+            if not isinstance(cell, dict) or cell.get("is_occupied"):
+                continue
+            if preferred_size is not None and cell.get("cell_size_code") != preferred_size:
+                continue
+            cell["is_occupied"] = True
             return cell
     return None
 
 
-def get_overdue_daily_rate(database, cell_size_code, on_date):
-    for tariff in database.get("overdue_tariffs", []):
-        if tariff.get("cell_size_code") != cell_size_code:
-            continue
+def due_reminders(on_date):
+    """Снимок БД и договоры, которым в день on_date положено напоминание.
 
-        valid_from = _parse_iso_date(tariff.get("valid_from"))
-        valid_until = _parse_iso_date(tariff.get("valid_until"))
-        if valid_from and valid_until and valid_from <= on_date <= valid_until:
-            return tariff.get("daily_rate")
-    return None
+    Возвращает (database, [(позиция договора, qr_code, тип напоминания)]);
+    позиции относятся именно к этому снимку.
+    """
+    with _cache_lock:
+        database = db_snapshot()
+        if not isinstance(database, dict):
+            return database, []
+        return database, _index().reminder_calendar.due_on(on_date)
 
 
-def _parse_iso_date(value):
-    from datetime import datetime
+def reminder_already_sent(qr_code, reminder_type, on_date):
+    """Есть ли сохраненная запись о напоминании этого типа по договору за день on_date."""
+    with _cache_lock:
+        db_snapshot()
+        dedup = _index().reminder_dedup
+        dedup.prune()
+        return dedup.was_sent(qr_code, reminder_type, on_date)
 
-    try:
-        return datetime.strptime(value, "%Y-%m-%d").date()
-    except (ValueError, TypeError):
+
+def release_cell(database, cell_number):
+    cell = get_cell_by_number(database, cell_number)
+    if cell is None:
         return None
+    cell["is_occupied"] = False
+    return cell
+
+
+def warehouse_availability(database):
+    """Сводка свободных ячеек по складам.
+
+    Пересчитывается только после изменения ячеек или складов, в остальное
+    время это чтение готового словаря.
+    """
+    index = _index()
+    with _cache_lock:
+        cached = _availability_cache
+        if cached["version"] == index.availability_version and index is not _EMPTY_INDEX:
+            return cached["summary"]
+
+    if index is _EMPTY_INDEX:
+        index = DatabaseIndex(database)
+    free_counts = index.free_cells.free_counts()
+    summary = {
+        "version": index.availability_version,
+        "warehouses": [
+            dict(warehouse)
+            for warehouse in database.get("warehouses", [])
+            if free_counts.get(warehouse.get("name"))
+        ],
+        "free_counts": free_counts,
+    }
+    with _cache_lock:
+        _availability_cache["version"] = index.availability_version
+        _availability_cache["summary"] = summary
+    return summary
+
+
+def find_cell_size(database, cell_size_code):
+    found = _index().lookup(database, "cell_sizes_by_code", cell_size_code)
+    return found[0] if found else None
+
+
+def find_warehouse(database, name):
+    found = _index().lookup(database, "warehouses_by_name", name)
+    return found[0] if found else None
+
+
+def find_agreement(database, qr_code):
+    found = _index().lookup(database, "agreements_by_qr_code", qr_code)
+    return found[0] if found else None
+
+
+def user_agreements(database, telegram_id):
+    return _index().lookup(database, "agreements_by_user", telegram_id)
+
+
+def agreement_items(database, qr_code):
+    return _index().lookup(database, "items_by_agreement", qr_code)
+
+
+def find_order(database, order_id):
+    found = _index().lookup(database, "requests_by_order_id", order_id)
+    if found:
+        return found[0]
+    # Заявки, сохраненные до появления order_id, нумеровались по позиции.
+    delivery_requests = database.get("delivery_requests", [])
+    if isinstance(order_id, int) and 0 < order_id <= len(delivery_requests):
+        order = delivery_requests[order_id - 1]
+        if isinstance(order, dict) and "order_id" not in order:
+            return order
+    return None
+
+
+def requests_by_status(database, status):
+    """Пары (позиция, заявка) с указанным статусом в порядке добавления."""
+    return _index().lookup(database, "requests_by_status", status, with_positions=True)
+
+
+def load_models(database, table):
+    """Типизированные модели таблицы (utils/models.py) с уже разобранными датами.
+
+    Для сохраненного снимка (db_snapshot()) модели строятся один раз и
+    обновляются при сохранениях; для других словарей разбираются на месте.
+    """
+    with _cache_lock:
+        if database is _cache["database"] and _cache["models"] is not None:
+            return _cache["models"].table(database, table)
+    model_class = MODELS[table]
+    return [model_class.from_dict(record) for record in database.get(table, []) if isinstance(record, dict)]
+
+
+def get_overdue_daily_rate(database, cell_size_code, on_date):
+    for tariff in load_models(database, "overdue_tariffs"):
+        if tariff.cell_size_code != cell_size_code:
+            continue
+        if tariff.valid_from and tariff.valid_until and tariff.valid_from <= on_date <= tariff.valid_until:
+            return tariff.daily_rate
+    return None
@@ -0,0 +1,176 @@
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+def dispatcher_settings():
+    return {
+        "workers": max(int(os.getenv("DISPATCH_WORKERS") or 8), 1),
+        # Очередь одного потока; при переполнении submit ждет (давит на прием обновлений).
+        "queue_size": int(os.getenv("DISPATCH_QUEUE") or 1000),
+    }
+
+
+def background_settings():
+    return {"workers": max(int(os.getenv("BACKGROUND_JOB_WORKERS") or 2), 1)}
+
+
+def worker_of(key, workers):
+    """Номер потока для ключа; crc32 не зависит от PYTHONHASHSEED процесса."""
+    return zlib.crc32(str(key).encode("utf-8")) % workers
+
+
+class _Worker:
+    __slots__ = ("index", "queue", "thread", "processed", "failed", "max_depth", "busy_seconds", "last_error")
+
+    def __init__(self, index, queue_size):
+        self.index = index
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.processed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.busy_seconds = 0.0
+        self.last_error = None
+
+
+class OrderedDispatcher:
+    """Пул потоков, в котором задачи одного ключа идут строго по очереди.
+
+    Ключ (id пользователя) закреплен за одним потоком по crc32, у каждого
+    потока своя FIFO-очередь. Поэтому два быстрых нажатия одного
+    пользователя обрабатываются последовательно и в порядке поступления, а
+    разные пользователи — параллельно в разных потоках.
+    """
+
+    def __init__(self, workers=8, queue_size=1000):
+        self._workers = [_Worker(index, queue_size) for index in range(workers)]
+        self._lock = threading.Lock()
+
+    def start(self):
+        for worker in self._workers:
+            worker.thread = threading.Thread(
+                target=self._run, args=(worker,), name=f"dispatch-{worker.index}", daemon=True
+            )
+            worker.thread.start()
+        return self
+
+    def submit(self, key, func, *args, **kwargs):
+        worker = self._workers[worker_of(key, len(self._workers))]
+        worker.queue.put((func, args, kwargs))
+        depth = worker.queue.qsize()
+        with self._lock:
+            worker.max_depth = max(worker.max_depth, depth)
+
+    def _run(self, worker):
+        while True:
+            item = worker.queue.get()
+            if item is None:
+                worker.queue.task_done()
+                return
+            func, args, kwargs = item
+            started = time.perf_counter()
+            error = None
+            try:
+                func(*args, **kwargs)
+            except Exception as exc:
+                logger.exception("Ошибка обработчика в потоке dispatch-%s", worker.index)
+                error = f"{type(exc).__name__}: {exc}"
+            with self._lock:
+                worker.processed += 1
+                worker.busy_seconds += time.perf_counter() - started
+                if error:
+                    worker.failed += 1
+                    worker.last_error = error
+            worker.queue.task_done()
+
+    def join(self):
+        """Ждет, пока все поставленные задачи будут выполнены."""
+        for worker in self._workers:
+            worker.queue.join()
+
+    def stop(self):
+        for worker in self._workers:
+            worker.queue.put(None)
+        for worker in self._workers:
+            if worker.thread is not None:
+                worker.thread.join()
+
+    def stats(self):
+        with self._lock:
+            return [
+                {
+                    "worker": worker.index,
+                    "depth": worker.queue.qsize(),
+                    "max_depth": worker.max_depth,
+                    "processed": worker.processed,
+                    "failed": worker.failed,
+                    "busy_seconds": round(worker.busy_seconds, 3),
+                    "last_error": worker.last_error,
+                }
+                for worker in self._workers
+            ]
+
+
+class BackgroundJobs:
+    """Отдельный пул для долгих команд оператора (рассылка и симуляция напоминаний).
+
+    Такие команды не выполняются в потоке диспетчера: иначе все пользователи,
+    закрепленные за этим потоком, ждали бы их завершения.
+    """
+
+    def __init__(self, workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="background-job")
+        self._lock = threading.Lock()
+        self.running = {}
+
+    def submit(self, name, func, *args, **kwargs):
+        with self._lock:
+            self.running[name] = self.running.get(name, 0) + 1
+        return self._executor.submit(self._run, name, func, args, kwargs)
+
+    def _run(self, name, func, args, kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            logger.exception("Ошибка фоновой задачи %s", name)
+            raise
+        finally:
+            with self._lock:
+                if self.running[name] == 1:
+                    del self.running[name]
+                else:
+                    self.running[name] -= 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.running)
+
+    def stop(self):
+        self._executor.shutdown(wait=True)
+
+
+def format_dispatch_stats(stats):
+    """Текст для /dispatch_stats: глубина очередей и нагрузка по потокам."""
+    lines = [
+        f"Очередь: {sum(item['depth'] for item in stats)}, "
+        f"обработано: {sum(item['processed'] for item in stats)}, "
+        f"ошибок: {sum(item['failed'] for item in stats)}"
+    ]
+    for item in stats:
+        lines.append(
+            f"#{item['worker']}: в очереди {item['depth']} (макс. {item['max_depth']}), "
+            f"обработано {item['processed']}, ошибок {item['failed']}, {item['busy_seconds']:.1f} сек."
+        )
+    errors = [item for item in stats if item["last_error"]]
+    if errors:
+        lines.append("")
+        lines.extend(f"#{item['worker']}: {item['last_error']}" for item in errors)
+    return "\n".join(lines)
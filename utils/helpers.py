@@ -84,6 +84,18 @@ def get_warehouse_address(database: dict, cell):
     return warehouse_name, warehouse_address
 
 
+def build_availability_text(availability: dict) -> str:
+    text = 'На данный момент свободные ячейки есть на следующих складах:\n\n'
+    for warehouse in availability.get("warehouses", []):
+        free_counts = availability.get("free_counts", {}).get(warehouse.get("name"), {})
+        sizes_text = ", ".join(
+            f"{size_code} — {count}" for size_code, count in sorted(free_counts.items(), key=lambda item: str(item[0]))
+        )
+        text += f'{warehouse["name"]}\n{warehouse["address"]}\nСвободно ячеек: {sizes_text}\n\n'
+    text += 'Также у нас есть услуга бесплатной доставки Ваших вещей на склад. Интересует ли Вас данная услуга?'
+    return text
+
+
 def build_storage_confirm_text(session_data: dict) -> str:
     measure_text = (
         "Курьер замерит габариты на месте."
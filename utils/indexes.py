@@ -0,0 +1,152 @@
+# Вторичные индексы по сохраненному снимку БД: значение поля -> позиции записей.
+# Индекс строится один раз при загрузке и обновляется по списку изменений
+# из journal.diff_database() при каждом сохранении.
+import itertools
+
+from .cell_pool import FreeCellPool
+from .reminder_calendar import ReminderCalendar
+from .reminder_dedup import ReminderDedup
+
+INDEXES = {
+    "users_by_telegram_id": ("users", "telegram_id"),
+    "cells_by_number": ("cells", "number"),
+    "cell_sizes_by_code": ("cell_sizes", "code"),
+    "warehouses_by_name": ("warehouses", "name"),
+    "agreements_by_qr_code": ("rental_agreements", "qr_code"),
+    "agreements_by_user": ("rental_agreements", "user_telegram_id"),
+    "items_by_agreement": ("items", "rental_agreement_qr_code"),
+    "requests_by_status": ("delivery_requests", "status"),
+    "requests_by_order_id": ("delivery_requests", "order_id"),
+}
+# Таблицы, от которых зависит сводка свободных ячеек по складам.
+AVAILABILITY_TABLES = {"cells", "warehouses"}
+
+_generations = itertools.count(1)
+
+
+def _key(record, field):
+    if not isinstance(record, dict):
+        return None
+    value = record.get(field)
+    try:
+        hash(value)
+    except TypeError:
+        return None
+    return value
+
+
+class DatabaseIndex:
+    def __init__(self, database):
+        self.positions = {name: {} for name in INDEXES}
+        self.free_cells = FreeCellPool()
+        self.reminder_calendar = ReminderCalendar()
+        self.reminder_dedup = ReminderDedup()
+        # Меняется при любом изменении ячеек или складов: по нему
+        # инвалидируются производные данные (сводка свободных ячеек).
+        self.availability_version = (next(_generations), 0)
+        self.lengths = {}
+        self._tables = {}
+        for name, (table, _) in INDEXES.items():
+            self._tables.setdefault(table, []).append(name)
+        # Без вторичных индексов, только для производных структур.
+        self._tables.setdefault("reminders", [])
+        for table in self._tables:
+            self._rebuild_table(database, table)
+
+    def _rebuild_table(self, database, table):
+        self._touch(table)
+        for name in self._tables[table]:
+            self.positions[name] = {}
+        if table == "cells":
+            self.free_cells.clear()
+        if table == "rental_agreements":
+            self.reminder_calendar.clear()
+        if table == "reminders":
+            self.reminder_dedup.clear()
+        records = database.get(table, [])
+        if not isinstance(records, list):
+            records = []
+        for position, record in enumerate(records):
+            self._add(table, position, record)
+        self.lengths[table] = len(records)
+
+    def _touch(self, table):
+        if table in AVAILABILITY_TABLES:
+            generation, counter = self.availability_version
+            self.availability_version = (generation, counter + 1)
+
+    def _add(self, table, position, record):
+        self._touch(table)
+        if table == "cells":
+            self.free_cells.add(position, record)
+        if table == "rental_agreements":
+            self.reminder_calendar.add(position, record)
+        if table == "reminders":
+            self.reminder_dedup.add(record)
+        for name in self._tables[table]:
+            key = _key(record, INDEXES[name][1])
+            if key is not None:
+                self.positions[name].setdefault(key, set()).add(position)
+
+    def _remove(self, table, position, record):
+        self._touch(table)
+        if table == "cells":
+            self.free_cells.discard(position, record)
+        if table == "rental_agreements":
+            self.reminder_calendar.remove(position, record)
+        if table == "reminders":
+            self.reminder_dedup.remove(record)
+        for name in self._tables[table]:
+            key = _key(record, INDEXES[name][1])
+            bucket = self.positions[name].get(key)
+            if bucket is None:
+                continue
+            bucket.discard(position)
+            if not bucket:
+                del self.positions[name][key]
+
+    def apply_changes(self, old_database, new_database, changes):
+        for change in changes:
+            op = change.get("op")
+            table = change.get("table") or change.get("key")
+            if table not in self._tables:
+                continue
+            if op == "set":
+                position = change["pos"]
+                old_records = old_database.get(table, [])
+                if position < len(old_records):
+                    self._remove(table, position, old_records[position])
+                self._add(table, position, change["record"])
+            elif op == "truncate":
+                old_records = old_database.get(table, [])
+                for position in range(change["length"], len(old_records)):
+                    self._remove(table, position, old_records[position])
+            else:
+                self._rebuild_table(new_database, table)
+        for table in self._tables:
+            records = new_database.get(table, [])
+            self.lengths[table] = len(records) if isinstance(records, list) else 0
+
+    def lookup(self, database, name, key, with_positions=False):
+        """Записи database с полем == key.
+
+        database может быть копией снимка с дописанными в конец записями
+        (рабочая копия транзакции): позиции проверяются, хвост просматривается.
+        """
+        table, field = INDEXES[name]
+        records = database.get(table, [])
+        if not isinstance(records, list):
+            return []
+        indexed_length = self.lengths.get(table, 0)
+        if len(records) < indexed_length:
+            positions = range(len(records))
+        else:
+            positions = sorted(self.positions[name].get(key, ()))
+            positions = list(positions) + list(range(indexed_length, len(records)))
+
+        found = []
+        for position in positions:
+            record = records[position]
+            if isinstance(record, dict) and record.get(field) == key:
+                found.append((position, record) if with_positions else record)
+        return found
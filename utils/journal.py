@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+
+# Журнал изменений для database.json: каждая запись — одна строка JSON с
+# номером seq и набором позиционных изменений (запись N таблицы T, длина
+# таблицы). Позиционные изменения нельзя применять повторно (после усечения
+# таблицы старые позиции пропадают), поэтому снимок хранит под ключом
+# SEQ_KEY номер последней вошедшей в него записи, а при чтении записи с
+# seq <= этого номера пропускаются — в том числе после сбоя между записью
+# снимка и чисткой журнала.
+SEQ_KEY = "_journal_seq"
+
+_lock = threading.RLock()
+_state = {"seq": 0, "entries": 0}
+
+
+def journal_path(snapshot_path):
+    return Path(snapshot_path).with_suffix(".journal")
+
+
+def diff_database(old, new):
+    """Список изменений, превращающих old в new. Записи сравниваются по позиции."""
+    changes = []
+    for key, value in new.items():
+        old_value = old.get(key)
+        if isinstance(value, list) and isinstance(old_value, list):
+            changes.extend(diff_table(key, old_value, value))
+        elif key not in old or old_value != value:
+            changes.append({"op": "put", "key": key, "value": value})
+    for key in old:
+        if key not in new:
+            changes.append({"op": "drop", "key": key})
+    return changes
+
+
+def diff_table(table, old_records, new_records):
+    """Изменения одной таблицы: записи на изменившихся позициях и новая длина."""
+    changes = []
+    for position, record in enumerate(new_records):
+        if position >= len(old_records) or old_records[position] != record:
+            changes.append({"op": "set", "table": table, "pos": position, "record": record})
+    if len(new_records) < len(old_records):
+        changes.append({"op": "truncate", "table": table, "length": len(new_records)})
+    return changes
+
+
+def apply_changes(database, changes):
+    for change in changes:
+        op = change.get("op")
+        if op == "set":
+            records = database.setdefault(change["table"], [])
+            position = change["pos"]
+            if position < len(records):
+                records[position] = change["record"]
+            elif position == len(records):
+                records.append(change["record"])
+            else:
+                raise ValueError(f"Пропуск позиций в журнале: {change['table']}[{position}]")
+        elif op == "truncate":
+            del database.setdefault(change["table"], [])[change["length"]:]
+        elif op == "put":
+            database[change["key"]] = change["value"]
+        elif op == "drop":
+            database.pop(change["key"], None)
+    return database
+
+
+def load(snapshot_path):
+    """Читает снимок и применяет к нему журнал. Оборванная последняя строка отбрасывается."""
+    snapshot_path = Path(snapshot_path)
+    path = journal_path(snapshot_path)
+    with _lock:
+        if snapshot_path.exists():
+            try:
+                with snapshot_path.open("r", encoding="utf-8") as file:
+                    database = json.load(file)
+            except json.JSONDecodeError as exc:
+                raise RuntimeError(f"Файл {snapshot_path} повреждён: {exc}") from exc
+            if not isinstance(database, dict):
+                raise RuntimeError(f"Файл {snapshot_path} не содержит JSON-объект")
+        elif path.exists():
+            database = {}
+        else:
+            return []
+
+        snapshot_seq = database.pop(SEQ_KEY, 0)
+        if not isinstance(snapshot_seq, int):
+            snapshot_seq = 0
+        _state["seq"] = snapshot_seq
+        _state["entries"] = 0
+        if not path.exists():
+            return database
+
+        valid_size = 0
+        with path.open("rb") as file:
+            for raw_line in file:
+                try:
+                    entry = json.loads(raw_line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    break
+                if not raw_line.endswith(b"\n"):
+                    break
+                valid_size += len(raw_line)
+                _state["entries"] += 1
+                if entry.get("seq", 0) <= snapshot_seq:
+                    continue
+                apply_changes(database, entry.get("changes", []))
+                _state["seq"] = max(_state["seq"], entry.get("seq", 0))
+
+        if valid_size != path.stat().st_size:
+            with path.open("r+b") as file:
+                file.truncate(valid_size)
+                file.flush()
+                os.fsync(file.fileno())
+        return database
+
+
+def append(snapshot_path, changes):
+    """Дописывает изменения в журнал и дожидается fsync. Возвращает номер записи."""
+    if not changes:
+        return _state["seq"]
+    with _lock:
+        seq = _state["seq"] + 1
+        line = json.dumps({"seq": seq, "changes": changes}, ensure_ascii=False) + "\n"
+        with journal_path(snapshot_path).open("ab") as file:
+            file.write(line.encode("utf-8"))
+            file.flush()
+            os.fsync(file.fileno())
+        _state["seq"] = seq
+        _state["entries"] += 1
+        return seq
+
+
+def last_seq():
+    return _state["seq"]
+
+
+def pending_entries():
+    return _state["entries"]
+
+
+def write_snapshot(snapshot_path, database, upto_seq=0):
+    """Атомарная запись снимка: временный файл, fsync, rename.
+
+    upto_seq — номер последней записи журнала, уже учтенной в database.
+    """
+    install_snapshot(snapshot_path, dump_snapshot(snapshot_path, database, upto_seq))
+
+
+def dump_snapshot(snapshot_path, database, upto_seq=0):
+    """Пишет снимок во временный файл рядом с snapshot_path и возвращает его путь.
+
+    Это долгая часть записи снимка; сам снимок при этом не меняется.
+    """
+    snapshot_path = Path(snapshot_path)
+    tmp_path = snapshot_path.with_name(f".{snapshot_path.name}.tmp")
+    with tmp_path.open("w", encoding="utf-8") as file:
+        json.dump({SEQ_KEY: upto_seq, **database}, file, ensure_ascii=False, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    return tmp_path
+
+
+def install_snapshot(snapshot_path, tmp_path):
+    """Атомарно заменяет снимок файлом из dump_snapshot."""
+    snapshot_path = Path(snapshot_path)
+    os.replace(tmp_path, snapshot_path)
+    _fsync_directory(snapshot_path.parent)
+
+
+def compact(snapshot_path, upto_seq):
+    """Убирает из журнала записи, уже попавшие в снимок (seq <= upto_seq)."""
+    path = journal_path(snapshot_path)
+    with _lock:
+        if not path.exists():
+            return
+        kept = []
+        with path.open("rb") as file:
+            for raw_line in file:
+                try:
+                    entry = json.loads(raw_line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    break
+                if entry.get("seq", 0) > upto_seq:
+                    kept.append(raw_line)
+
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with tmp_path.open("wb") as file:
+            file.writelines(kept)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+        _fsync_directory(path.parent)
+        _state["entries"] = len(kept)
+
+
+def _fsync_directory(directory):
+    try:
+        fd = os.open(str(directory or "."), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -1,38 +1,283 @@
 import os
 import smtplib
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
 from email.mime.text import MIMEText
 
 from dotenv import load_dotenv
 
 
-def send_yandex_email(recipient_email: str, subject: str, body: str) -> bool:
-    ok, _ = send_yandex_email_detailed(recipient_email, subject, body)
-    return ok
+@dataclass(frozen=True)
+class MailSettings:
+    sender_email: str | None
+    app_password: str | None
+    host: str = "smtp.yandex.ru"
+    port: int = 465
+    use_ssl: bool = True
+    timeout: float = 15
+    pool_size: int = 4
+    # Соединение, простоявшее дольше этого, перед отправкой проверяется NOOP.
+    check_after_seconds: float = 30
+    max_idle_seconds: float = 240
 
 
-def send_yandex_email_detailed(recipient_email: str, subject: str, body: str):
-    load_dotenv()
+_settings = None
+_settings_lock = threading.Lock()
+
+
+def mail_settings():
+    """Настройки почты из .env, читаются один раз на процесс."""
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            load_dotenv()
+            _settings = MailSettings(
+                sender_email=os.getenv("YANDEX_LOGIN"),
+                app_password=os.getenv("YANDEX_TOKEN"),
+                host=os.getenv("SMTP_HOST") or "smtp.yandex.ru",
+                port=int(os.getenv("SMTP_PORT") or 465),
+                use_ssl=(os.getenv("SMTP_SSL") or "1") != "0",
+                pool_size=int(os.getenv("SMTP_POOL_SIZE") or 4),
+            )
+        return _settings
+
+
+def reset_mailer():
+    """Закрывает пул и забывает настройки — следующая отправка перечитает .env."""
+    global _settings, _pool
+    with _settings_lock:
+        _settings = None
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+
+def _settings_error(settings):
+    if not settings.sender_email:
+        return "YANDEX_LOGIN не задан в .env"
+    if not settings.app_password:
+        return "YANDEX_TOKEN не задан в .env"
+    return ""
+
+
+def _response_code(exc):
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code
+    if isinstance(exc, smtplib.SMTPRecipientsRefused) and exc.recipients:
+        return next(iter(exc.recipients.values()))[0]
+    return None
+
+
+def smtp_error_text(exc):
+    """Текст ошибки отправки; ответ сервера начинается с кода: "SMTP 550 ..."."""
+    code = _response_code(exc)
+    if code is None:
+        return f"{type(exc).__name__}: {exc}"
+    return f"SMTP {code} {type(exc).__name__}: {exc}"
+
+
+def is_permanent_error(error):
+    """Постоянный отказ (5xx): повторная отправка того же письма не поможет."""
+    return (error or "").startswith("SMTP 5")
+
+
+class SMTPPool:
+    """Пул открытых SMTP-соединений.
+
+    Соединение берется из пула и возвращается после отправки. Если оно
+    простаивало дольше check_after_seconds, перед использованием идет NOOP;
+    разорванное соединение закрывается и заменяется новым. Отказ сервера
+    (4xx/5xx) на письмо возвращается сразу, без повтора, а соединение после
+    RSET остается в пуле.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(settings.pool_size)
+        self.connects = 0
+
+    def _connect(self):
+        settings = self.settings
+        if settings.use_ssl:
+            server = smtplib.SMTP_SSL(settings.host, settings.port, timeout=settings.timeout)
+        else:
+            server = smtplib.SMTP(settings.host, settings.port, timeout=settings.timeout)
+        server.ehlo()
+        # Локальная заглушка SMTP может не поддерживать AUTH — тогда вход не нужен.
+        if server.has_extn("auth"):
+            server.login(settings.sender_email, settings.app_password)
+        self.connects += 1
+        return server
+
+    @staticmethod
+    def _is_alive(server):
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
 
-    sender_email = os.getenv("YANDEX_LOGIN")
-    app_password = os.getenv("YANDEX_TOKEN")
+    @staticmethod
+    def _reset(server):
+        """RSET после отказа сервера; False, если соединение уже непригодно."""
+        try:
+            return server.rset()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
 
-    if not recipient_email:
-        return False, "recipient_email пустой"
-    if not sender_email:
-        return False, "YANDEX_LOGIN не задан в .env"
-    if not app_password:
-        return False, "YANDEX_TOKEN не задан в .env"
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            try:
+                server.close()
+            except OSError:
+                pass
 
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    return self._connect()
+                server, released_at = entry
+                idle_for = time.monotonic() - released_at
+                if idle_for > self.settings.max_idle_seconds:
+                    self._close(server)
+                    continue
+                if idle_for <= self.settings.check_after_seconds or self._is_alive(server):
+                    return server
+                self._close(server)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, server, broken=False):
+        try:
+            if broken:
+                self._close(server)
+            else:
+                with self._lock:
+                    self._idle.append((server, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for server, _ in idle:
+            self._close(server)
+
+    def send(self, messages, latencies=None):
+        """Отправляет [(recipient, MIMEText)] через одно соединение, [(ok, error)] по порядку.
+
+        В latencies (список), если он передан, добавляется время каждого
+        вызова sendmail в секундах.
+        """
+        results = []
+        server = None
+        try:
+            for recipient, msg in messages:
+                for attempt in range(2):
+                    if server is None:
+                        try:
+                            server = self.acquire()
+                        except Exception as exc:
+                            results.append((False, f"{type(exc).__name__}: {exc}"))
+                            break
+                    started = time.perf_counter()
+                    try:
+                        server.sendmail(self.settings.sender_email, [recipient], msg.as_string())
+                        results.append((True, ""))
+                        break
+                    except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as exc:
+                        # Сервер ответил отказом: соединение исправно, повтор тут не поможет.
+                        results.append((False, smtp_error_text(exc)))
+                        if not self._reset(server):
+                            self.release(server, broken=True)
+                            server = None
+                        break
+                    except OSError as exc:
+                        # SMTPException — тоже OSError, но обрыв соединения из них
+                        # только SMTPServerDisconnected.
+                        if isinstance(exc, smtplib.SMTPException) and not isinstance(
+                            exc, smtplib.SMTPServerDisconnected
+                        ):
+                            results.append((False, smtp_error_text(exc)))
+                            break
+                        # Соединение оборвалось — одна повторная попытка на новом.
+                        self.release(server, broken=True)
+                        server = None
+                        if attempt == 1:
+                            results.append((False, smtp_error_text(exc)))
+                    except Exception as exc:
+                        results.append((False, f"{type(exc).__name__}: {exc}"))
+                        break
+                    finally:
+                        if latencies is not None:
+                            latencies.append(time.perf_counter() - started)
+        finally:
+            if server is not None:
+                self.release(server)
+        return results
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def smtp_pool():
+    global _pool
+    settings = mail_settings()
+    with _pool_lock:
+        if _pool is None or _pool.settings is not settings:
+            _pool = SMTPPool(settings)
+        return _pool
+
+
+def _build_message(sender_email, recipient_email, subject, body):
     msg = MIMEText(body, "plain", "utf-8")
     msg["From"] = sender_email
     msg["To"] = recipient_email
     msg["Subject"] = subject
+    return msg
+
+
+def send_yandex_email(recipient_email: str, subject: str, body: str) -> bool:
+    ok, _ = send_yandex_email_detailed(recipient_email, subject, body)
+    return ok
+
+
+def send_yandex_email_detailed(recipient_email: str, subject: str, body: str):
+    return send_many([(recipient_email, subject, body)])[0]
+
+
+def send_many(messages, latencies=None):
+    """Отправляет пачку писем [(recipient, subject, body)] через одно соединение пула.
+
+    Возвращает [(ok, error_str)] в том же порядке; latencies — см. SMTPPool.send.
+    """
+    settings = mail_settings()
+    settings_error = _settings_error(settings)
+    results = [None] * len(messages)
+    outgoing = []
+    for number, (recipient_email, subject, body) in enumerate(messages):
+        if not recipient_email:
+            results[number] = (False, "recipient_email пустой")
+        elif settings_error:
+            results[number] = (False, settings_error)
+        else:
+            outgoing.append((number, recipient_email, _build_message(settings.sender_email, recipient_email, subject, body)))
 
-    try:
-        server = smtplib.SMTP_SSL("smtp.yandex.ru", 465, timeout=15)
-        server.login(sender_email, app_password)
-        server.sendmail(sender_email, [recipient_email], msg.as_string())
-        server.quit()
-        return True, ""
-    except Exception as exc:
-        return False, f"{type(exc).__name__}: {exc}"
+    if outgoing:
+        sent = smtp_pool().send([(recipient, msg) for _, recipient, msg in outgoing], latencies)
+        for (number, _, _), result in zip(outgoing, sent):
+            results[number] = result
+    return results
@@ -0,0 +1,252 @@
+from dataclasses import dataclass, field, fields
+from datetime import date, datetime
+from types import MappingProxyType
+from typing import ClassVar
+
+
+# Общие для всех моделей пустые extra/raw_dates и кортежи порядка ключей:
+# у большинства записей они совпадают, и отдельная копия на запись не нужна.
+_EMPTY = MappingProxyType({})
+_key_orders = {}
+
+
+def parse_iso_date(value):
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except (ValueError, TypeError):
+        return None
+
+
+class Record:
+    """Общая часть моделей: разбор записи БД и обратное преобразование без потерь.
+
+    Поля из DATE_FIELDS хранятся как date. Неизвестные ключи и значения дат,
+    которые не удалось разобрать, лежат в extra как есть, а key_order
+    запоминает порядок ключей исходной записи. Даты в неканоническом виде
+    ("2026-1-5") запоминаются в raw_dates и возвращаются в to_dict без
+    изменений, пока значение даты не поменялось.
+
+    Модели — разобранное представление поверх снимка БД, а не замена ему:
+    значения-строки модель делит с записью снимка, а свои у нее только
+    объект со слотами и даты. Пустые extra/raw_dates и одинаковые key_order
+    общие для всех моделей, поэтому их нельзя менять на месте.
+    """
+
+    __slots__ = ()
+
+    DATE_FIELDS: ClassVar[tuple] = ()
+    DERIVED_FIELDS: ClassVar[tuple] = ()
+    SERVICE_FIELDS: ClassVar[tuple] = ("extra", "key_order", "raw_dates")
+
+    @classmethod
+    def persisted_fields(cls):
+        skip = set(cls.SERVICE_FIELDS) | set(cls.DERIVED_FIELDS)
+        return [item.name for item in fields(cls) if item.name not in skip]
+
+    @classmethod
+    def from_dict(cls, record):
+        known = set(cls.persisted_fields())
+        values = {}
+        extra = {}
+        raw_dates = {}
+        for key, value in record.items():
+            if key not in known:
+                extra[key] = value
+            elif key in cls.DATE_FIELDS:
+                parsed = parse_iso_date(value)
+                if parsed is None and value is not None:
+                    extra[key] = value
+                else:
+                    values[key] = parsed
+                    if isinstance(value, str) and value != parsed.isoformat():
+                        raw_dates[key] = value
+            else:
+                values[key] = value
+        if cls.DATE_FIELDS:
+            values["raw_dates"] = raw_dates or _EMPTY
+        key_order = tuple(record)
+        key_order = _key_orders.setdefault(key_order, key_order)
+        model = cls(**values, extra=extra or _EMPTY, key_order=key_order)
+        model.derive()
+        return model
+
+    def derive(self):
+        pass
+
+    def to_dict(self):
+        keys = self.key_order or tuple(self.persisted_fields()) + tuple(self.extra)
+        record = {}
+        for key in keys:
+            if key in self.extra:
+                record[key] = self.extra[key]
+                continue
+            value = getattr(self, key)
+            if key in self.DATE_FIELDS and isinstance(value, date):
+                raw = self.raw_dates.get(key)
+                value = raw if raw is not None and parse_iso_date(raw) == value else value.isoformat()
+            record[key] = value
+        return record
+
+
+@dataclass(slots=True)
+class User(Record):
+    telegram_id: int | None = None
+    full_name: str | None = None
+    username: str | None = None
+    phone: str | None = None
+    address: str | None = None
+    email: str | None = None
+    acquisition_source: str | None = None
+    extra: dict = field(default_factory=dict)
+    key_order: tuple = ()
+
+
+@dataclass(slots=True)
+class Cell(Record):
+    number: str | None = None
+    warehouse_name: str | None = None
+    cell_size_code: str | None = None
+    is_occupied: bool | None = None
+    extra: dict = field(default_factory=dict)
+    key_order: tuple = ()
+
+
+@dataclass(slots=True)
+class RentalAgreement(Record):
+    DATE_FIELDS: ClassVar[tuple] = ("start_date", "end_date")
+
+    qr_code: str | None = None
+    user_telegram_id: int | None = None
+    cell_number: str | None = None
+    start_date: date | None = None
+    end_date: date | None = None
+    total_price: float | None = None
+    status: str | None = None
+    created_at: str | None = None
+    extra: dict = field(default_factory=dict)
+    key_order: tuple = ()
+    raw_dates: dict = field(default_factory=dict)
+
+
+@dataclass(slots=True)
+class DeliveryRequest(Record):
+    order_id: int | None = None
+    user_telegram_id: int | None = None
+    request_type: str | None = None
+    status: str | None = None
+    item_rental_agreement_qr_code: str | None = None
+    rental_agreement_qr_code: str | None = None
+    address: str | None = None
+    phone: str | None = None
+    email: str | None = None
+    volume_code: str | None = None
+    rent_days: int | None = None
+    requested_at: str | None = None
+    extra: dict = field(default_factory=dict)
+    key_order: tuple = ()
+
+
+@dataclass(slots=True)
+class Item(Record):
+    rental_agreement_qr_code: str | None = None
+    total_volume_m3: float | None = None
+    has_seasonal_items: bool | None = None
+    item_list: list | None = None
+    added_at: str | None = None
+    updated_at: str | None = None
+    removed_at: str | None = None
+    extra: dict = field(default_factory=dict)
+    key_order: tuple = ()
+
+
+@dataclass(slots=True)
+class Reminder(Record):
+    DATE_FIELDS: ClassVar[tuple] = ("due_on",)
+    DERIVED_FIELDS: ClassVar[tuple] = ("sent_on",)
+
+    rental_agreement_qr_code: str | None = None
+    sent_at: str | None = None
+    reminder_type: str | None = None
+    # День, за который положено напоминание (при догоняющем запуске раньше sent_at).
+    due_on: date | None = None
+    sent_on: date | None = None
+    extra: dict = field(default_factory=dict)
+    key_order: tuple = ()
+    raw_dates: dict = field(default_factory=dict)
+
+    def derive(self):
+        self.sent_on = parse_iso_date((self.sent_at or "")[:10])
+
+
+@dataclass(slots=True)
+class Payment(Record):
+    rental_agreement_qr_code: str | None = None
+    amount: float | None = None
+    paid_at: str | None = None
+    is_successful: bool | None = None
+    extra: dict = field(default_factory=dict)
+    key_order: tuple = ()
+
+
+@dataclass(slots=True)
+class OverdueTariff(Record):
+    DATE_FIELDS: ClassVar[tuple] = ("valid_from", "valid_until")
+
+    cell_size_code: str | None = None
+    daily_rate: float | None = None
+    valid_from: date | None = None
+    valid_until: date | None = None
+    extra: dict = field(default_factory=dict)
+    key_order: tuple = ()
+    raw_dates: dict = field(default_factory=dict)
+
+
+MODELS = {
+    "users": User,
+    "cells": Cell,
+    "rental_agreements": RentalAgreement,
+    "delivery_requests": DeliveryRequest,
+    "items": Item,
+    "reminders": Reminder,
+    "payments": Payment,
+    "overdue_tariffs": OverdueTariff,
+}
+
+
+class ModelView:
+    """Разобранные модели по таблицам сохраненного снимка, строятся по требованию."""
+
+    def __init__(self):
+        self.tables = {}
+
+    def table(self, database, name):
+        models = self.tables.get(name)
+        if models is None:
+            model_class = MODELS[name]
+            models = [
+                model_class.from_dict(record)
+                for record in database.get(name, [])
+                if isinstance(record, dict)
+            ]
+            self.tables[name] = models
+        return models
+
+    def apply_changes(self, changes):
+        for change in changes:
+            table = change.get("table") or change.get("key")
+            models = self.tables.get(table)
+            if models is None:
+                continue
+            op = change.get("op")
+            if op == "set" and isinstance(change["record"], dict) and change["pos"] <= len(models):
+                model = MODELS[table].from_dict(change["record"])
+                if change["pos"] < len(models):
+                    models[change["pos"]] = model
+                else:
+                    models.append(model)
+            elif op == "truncate":
+                del models[change["length"]:]
+            else:
+                self.tables.pop(table, None)
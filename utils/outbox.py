@@ -0,0 +1,250 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from .mailer import is_permanent_error, send_many
+from .reminder_stats import latency_summary
+
+
+OUTBOX_FILE = Path("outbox.sqlite3")
+STATUSES = ("pending", "sending", "sent", "dead")
+
+_connection = None
+_connection_path = None
+_lock = threading.RLock()
+_wakeup = threading.Event()
+_workers = []
+# Задержки SMTP (сек) последних отправленных воркерами писем.
+_smtp_latencies = deque(maxlen=1000)
+
+
+def outbox_settings():
+    return {
+        "workers": int(os.getenv("OUTBOX_WORKERS") or 2),
+        "max_attempts": int(os.getenv("OUTBOX_MAX_ATTEMPTS") or 5),
+        "retry_seconds": float(os.getenv("OUTBOX_RETRY_SECONDS") or 30),
+        "max_retry_seconds": float(os.getenv("OUTBOX_MAX_RETRY_SECONDS") or 3600),
+        "batch_size": int(os.getenv("OUTBOX_BATCH_SIZE") or 20),
+        "keep_sent_days": int(os.getenv("OUTBOX_KEEP_SENT_DAYS") or 7),
+    }
+
+
+def get_connection(path=None):
+    """Соединение с очередью писем (отдельный файл SQLite, WAL, synchronous=FULL)."""
+    global _connection, _connection_path
+
+    target = Path(path or os.getenv("OUTBOX_PATH") or OUTBOX_FILE)
+    with _lock:
+        if _connection is not None and _connection_path == target:
+            return _connection
+        if _connection is not None:
+            _connection.close()
+
+        connection = sqlite3.connect(str(target), check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=FULL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "dedup_key TEXT UNIQUE, "
+            "recipient TEXT NOT NULL, "
+            "subject TEXT NOT NULL, "
+            "body TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "next_attempt_at REAL NOT NULL, "
+            "last_error TEXT, "
+            "created_at REAL NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+        _connection = connection
+        _connection_path = target
+        return connection
+
+
+def enqueue_email(recipient, subject, body, dedup_key=None, path=None):
+    """Ставит письмо в очередь и сразу возвращает управление.
+
+    Возвращает False, если письмо с таким dedup_key уже есть в очереди
+    (в том числе отправленное, пока его не удалила очистка).
+    """
+    now = time.time()
+    with _lock:
+        cursor = get_connection(path).execute(
+            "INSERT OR IGNORE INTO outbox "
+            "(dedup_key, recipient, subject, body, next_attempt_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (dedup_key, recipient, subject, body, now, now, now),
+        )
+    if cursor.rowcount:
+        _wakeup.set()
+    return bool(cursor.rowcount)
+
+
+def claim_batch(limit, path=None, now=None):
+    """Забирает до limit писем, которым пора уходить: [(id, recipient, subject, body, attempts)]."""
+    now = time.time() if now is None else now
+    with _lock:
+        connection = get_connection(path)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = connection.execute(
+                "SELECT id, recipient, subject, body, attempts FROM outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            connection.executemany(
+                "UPDATE outbox SET status = 'sending', updated_at = ? WHERE id = ?",
+                [(now, row[0]) for row in rows],
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+    return rows
+
+
+def retry_delay(attempts, settings):
+    """Экспоненциальная пауза перед попыткой номер attempts + 1."""
+    return min(settings["retry_seconds"] * 2 ** (attempts - 1), settings["max_retry_seconds"])
+
+
+def record_results(claimed, results, settings=None, path=None, now=None):
+    """Отмечает итог отправки: sent, повтор с паузой или dead.
+
+    В dead письмо уходит после max_attempts попыток или сразу, если сервер
+    ответил постоянным отказом (5xx).
+    """
+    settings = settings or outbox_settings()
+    now = time.time() if now is None else now
+    sent = []
+    failed = []
+    for (message_id, _, _, _, attempts), (ok, error) in zip(claimed, results):
+        if ok:
+            sent.append((now, message_id))
+            continue
+        attempts += 1
+        if attempts >= settings["max_attempts"] or is_permanent_error(error):
+            failed.append(("dead", attempts, now, error, now, message_id))
+        else:
+            failed.append(("pending", attempts, now + retry_delay(attempts, settings), error, now, message_id))
+
+    with _lock:
+        connection = get_connection(path)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany("UPDATE outbox SET status = 'sent', updated_at = ? WHERE id = ?", sent)
+            connection.executemany(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ? "
+                "WHERE id = ?",
+                failed,
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+
+def recover_in_flight(path=None):
+    """Письма, зависшие в 'sending' после падения процесса, снова ставятся в очередь."""
+    with _lock:
+        cursor = get_connection(path).execute(
+            "UPDATE outbox SET status = 'pending', updated_at = ? WHERE status = 'sending'",
+            (time.time(),),
+        )
+    return cursor.rowcount
+
+
+def prune_sent(keep_days, path=None):
+    cutoff = time.time() - keep_days * 86400
+    with _lock:
+        cursor = get_connection(path).execute(
+            "DELETE FROM outbox WHERE status = 'sent' AND updated_at < ?",
+            (cutoff,),
+        )
+    return cursor.rowcount
+
+
+def outbox_stats(path=None):
+    """Глубина очереди по статусам и возраст самого старого неотправленного письма (сек)."""
+    with _lock:
+        connection = get_connection(path)
+        counts = dict(connection.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        oldest = connection.execute(
+            "SELECT MIN(created_at) FROM outbox WHERE status IN ('pending', 'sending')"
+        ).fetchone()[0]
+    stats = {status: counts.get(status, 0) for status in STATUSES}
+    stats["oldest_pending_seconds"] = int(time.time() - oldest) if oldest else 0
+    return stats
+
+
+def dead_letters(limit=20, path=None):
+    with _lock:
+        return get_connection(path).execute(
+            "SELECT id, recipient, subject, attempts, last_error FROM outbox "
+            "WHERE status = 'dead' ORDER BY updated_at DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+
+
+def requeue_dead(path=None):
+    """Возвращает все письма из dead-letter в очередь с обнуленным счетчиком попыток."""
+    now = time.time()
+    with _lock:
+        cursor = get_connection(path).execute(
+            "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ?, updated_at = ? "
+            "WHERE status = 'dead'",
+            (now, now),
+        )
+    if cursor.rowcount:
+        _wakeup.set()
+    return cursor.rowcount
+
+
+def process_outbox_once(settings=None, path=None):
+    """Одна итерация воркера: забрать пачку, отправить через пул SMTP, записать итог."""
+    settings = settings or outbox_settings()
+    claimed = claim_batch(settings["batch_size"], path)
+    if not claimed:
+        return 0
+    latencies = []
+    results = send_many([(recipient, subject, body) for _, recipient, subject, body, _ in claimed], latencies)
+    _smtp_latencies.extend(latencies)
+    record_results(claimed, results, settings, path)
+    return len(claimed)
+
+
+def smtp_latency_stats():
+    """Задержки SMTP последних писем из очереди: count/p50/p90/p99/max в секундах."""
+    return latency_summary(list(_smtp_latencies))
+
+
+def start_outbox_workers(workers=None, poll_seconds=5):
+    """Фоновые потоки, отправляющие письма из очереди."""
+    settings = outbox_settings()
+    recover_in_flight()
+    prune_sent(settings["keep_sent_days"])
+
+    def worker():
+        last_prune = time.monotonic()
+        while True:
+            try:
+                if process_outbox_once(settings):
+                    continue
+                if time.monotonic() - last_prune > 3600:
+                    prune_sent(settings["keep_sent_days"])
+                    last_prune = time.monotonic()
+            except Exception:
+                time.sleep(poll_seconds)
+            _wakeup.wait(poll_seconds)
+            _wakeup.clear()
+
+    for _ in range(workers or settings["workers"]):
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        _workers.append(thread)
+    return list(_workers)
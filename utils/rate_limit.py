@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+
+
+class TokenBucket:
+    """Потокобезопасный token bucket: rate токенов в секунду, не больше capacity в запасе."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def peek(self, tokens=1):
+        """Сколько секунд ждать до tokens токенов, ничего не забирая."""
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def try_acquire(self, tokens=1):
+        """Берет токены без ожидания; иначе возвращает, сколько секунд ждать."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0.0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def is_full(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens >= self.capacity
+
+
+class KeyedRateLimiter:
+    """Отдельный TokenBucket на каждый ключ (например, chat_id)."""
+
+    def __init__(self, rate, capacity=None, max_keys=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._evict_idle()
+                bucket = TokenBucket(self.rate, self.capacity)
+                self._buckets[key] = bucket
+            return bucket
+
+    def _evict_idle(self):
+        # Полный bucket ничем не отличается от нового — его можно забыть.
+        for key in [key for key, bucket in self._buckets.items() if bucket.is_full()]:
+            del self._buckets[key]
+
+    def peek(self, key, tokens=1):
+        with self._lock:
+            bucket = self._buckets.get(key)
+        return bucket.peek(tokens) if bucket is not None else 0.0
+
+    def try_acquire(self, key, tokens=1):
+        return self.bucket(key).try_acquire(tokens)
+
+    def acquire(self, key, tokens=1, timeout=None):
+        return self.bucket(key).acquire(tokens, timeout)
+
+
+_telegram_limits = {}
+_telegram_limits_lock = threading.Lock()
+
+
+def telegram_limits():
+    """Общие для процесса лимиты Telegram: (глобальный bucket, bucket на чат)."""
+    with _telegram_limits_lock:
+        if not _telegram_limits:
+            global_rate = float(os.getenv("TG_GLOBAL_RATE") or 30)
+            per_chat_rate = float(os.getenv("TG_PER_CHAT_RATE") or 1)
+            # Ответ на одно действие — обычно 2–3 сообщения подряд; Telegram
+            # допускает такие короткие всплески, средний темп остается 1/сек.
+            per_chat_burst = float(os.getenv("TG_PER_CHAT_BURST") or 3)
+            _telegram_limits["global"] = TokenBucket(global_rate)
+            _telegram_limits["per_chat"] = KeyedRateLimiter(per_chat_rate, capacity=per_chat_burst)
+        return _telegram_limits["global"], _telegram_limits["per_chat"]
+
+
+def acquire_telegram_slot(chat_id):
+    """Ждет, пока отправка в chat_id уложится и в общий, и в личный лимит чата."""
+    global_bucket, per_chat = telegram_limits()
+    per_chat.acquire(chat_id)
+    global_bucket.acquire()
@@ -0,0 +1,94 @@
+from datetime import date
+
+from .models import parse_iso_date
+
+
+# Напоминания до окончания аренды: дней до end_date -> тип напоминания.
+BEFORE_END = {30: "1m", 14: "2w", 7: "1w", 3: "3d"}
+OVERDUE_FINAL_DAYS = 180
+
+
+def overdue_reminder_type(days_overdue):
+    """Тип напоминания о просрочке для данного дня просрочки или None."""
+    if days_overdue == OVERDUE_FINAL_DAYS:
+        return "overdue_6m"
+    if days_overdue == 1:
+        return "overdue_start"
+    if days_overdue > 1 and days_overdue % 30 == 0:
+        return f"overdue_m{days_overdue // 30}"
+    return None
+
+
+def reminder_type_on(end_date, on_date):
+    """Какое напоминание положено договору с окончанием end_date в день on_date."""
+    days_left = (end_date - on_date).days
+    if days_left in BEFORE_END:
+        return BEFORE_END[days_left]
+    return overdue_reminder_type(-days_left)
+
+
+class ReminderCalendar:
+    """Активные договоры, разложенные по дате окончания.
+
+    Все даты срабатывания напоминаний выводятся из end_date, поэтому для дня D
+    достаточно заглянуть в корзины D+30/14/7/3, D-1, D-180 и D-30k.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.positions = {}
+
+    def add(self, position, rent):
+        end_ordinal = self._end_ordinal(rent)
+        if end_ordinal is None:
+            return
+        self.buckets.setdefault(end_ordinal, {})[rent["qr_code"]] = position
+        self.positions[position] = end_ordinal
+
+    def remove(self, position, rent):
+        end_ordinal = self.positions.pop(position, None)
+        if end_ordinal is None:
+            return
+        bucket = self.buckets.get(end_ordinal, {})
+        if bucket.get(rent.get("qr_code") if isinstance(rent, dict) else None) == position:
+            del bucket[rent["qr_code"]]
+        if not bucket:
+            self.buckets.pop(end_ordinal, None)
+
+    def clear(self):
+        self.buckets = {}
+        self.positions = {}
+
+    @staticmethod
+    def _end_ordinal(rent):
+        if not isinstance(rent, dict) or rent.get("status") != "Активна":
+            return None
+        if not rent.get("qr_code"):
+            return None
+        end_date = parse_iso_date(rent.get("end_date"))
+        return end_date.toordinal() if end_date else None
+
+    def due_on(self, on_date: date):
+        """[(позиция договора, qr_code, тип напоминания)] на день on_date в порядке договоров."""
+        day = on_date.toordinal()
+        due = []
+
+        def collect(end_ordinal, reminder_type):
+            for qr_code, position in self.buckets.get(end_ordinal, {}).items():
+                due.append((position, qr_code, reminder_type))
+
+        for days_left, reminder_type in BEFORE_END.items():
+            collect(day + days_left, reminder_type)
+
+        if self.buckets:
+            earliest_end = min(self.buckets)
+            days_overdue = 1
+            while day - days_overdue >= earliest_end:
+                reminder_type = overdue_reminder_type(days_overdue)
+                if reminder_type:
+                    collect(day - days_overdue, reminder_type)
+                # Просрочка: 1-й день, затем каждые 30 дней (180-й день — overdue_6m).
+                days_overdue = 30 if days_overdue < 30 else days_overdue + 30
+
+        due.sort()
+        return due
@@ -0,0 +1,81 @@
+import os
+import threading
+from datetime import date, timedelta
+
+from .models import parse_iso_date
+
+
+def dedup_retention_days():
+    return int(os.getenv("REMINDER_DEDUP_DAYS") or 7)
+
+
+class ReminderDedup:
+    """Отправленные напоминания за последние дни: дата -> {(qr_code, тип): число записей}.
+
+    Старые даты не загружаются и отбрасываются по мере смены дня, поэтому
+    размер индекса не зависит от длины списка reminders.
+    """
+
+    def __init__(self, retention_days=None):
+        self.retention_days = dedup_retention_days() if retention_days is None else retention_days
+        self.by_date = {}
+
+    def _key(self, record):
+        if not isinstance(record, dict):
+            return None, None
+        # Старые записи без due_on относятся к дню отправки.
+        sent_on = parse_iso_date(record.get("due_on")) or parse_iso_date((record.get("sent_at") or "")[:10])
+        if sent_on is None or sent_on < date.today() - timedelta(days=self.retention_days):
+            return None, None
+        return sent_on, (record.get("rental_agreement_qr_code"), record.get("reminder_type"))
+
+    def add(self, record):
+        sent_on, key = self._key(record)
+        if sent_on is None:
+            return
+        bucket = self.by_date.setdefault(sent_on, {})
+        bucket[key] = bucket.get(key, 0) + 1
+
+    def remove(self, record):
+        sent_on, key = self._key(record)
+        bucket = self.by_date.get(sent_on)
+        if not bucket or key not in bucket:
+            return
+        bucket[key] -= 1
+        if bucket[key] <= 0:
+            del bucket[key]
+
+    def clear(self):
+        self.by_date = {}
+
+    def prune(self, today=None):
+        oldest = (today or date.today()) - timedelta(days=self.retention_days)
+        for sent_on in [value for value in self.by_date if value < oldest]:
+            del self.by_date[sent_on]
+
+    def was_sent(self, qr_code, reminder_type, on_date):
+        return (qr_code, reminder_type) in self.by_date.get(on_date, {})
+
+
+class ReminderClaims:
+    """Напоминания, которые сейчас отправляются в этом процессе.
+
+    Два пересекающихся запуска (при старте, в фоновом потоке и по
+    /run_reminders) не смогут отправить одно и то же напоминание дважды:
+    напоминание занимается до отправки и освобождается после сохранения записи.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._claimed = set()
+
+    def claim(self, key, already_sent):
+        with self._lock:
+            if key in self._claimed or already_sent(*key):
+                return False
+            self._claimed.add(key)
+            return True
+
+    def release(self, keys):
+        with self._lock:
+            self._claimed.difference_update(keys)
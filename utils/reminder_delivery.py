@@ -0,0 +1,114 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from .outbox import enqueue_email
+from .telegram_queue import BULK, OPERATOR, send_message
+
+
+def delivery_workers():
+    return int(os.getenv("REMINDER_WORKERS") or 8)
+
+
+@dataclass(slots=True)
+class ReminderJob:
+    qr_code: str
+    reminder_type: str
+    user_id: int
+    text: str
+    email: str | None = None
+    email_subject: str | None = None
+    # День, за который положено напоминание (ISO): часть ключа дедупликации письма.
+    due_on: str | None = None
+
+
+@dataclass(slots=True)
+class DeliveryResult:
+    job: ReminderJob
+    telegram_ok: bool = False
+    email_ok: bool = False
+    email_error: str = ""
+
+    @property
+    def delivered(self):
+        return self.telegram_ok or self.email_ok
+
+
+def _timed(stats, channel, func, *args):
+    if stats is None:
+        return func(*args)
+    started = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        stats.record_send(channel, started, time.perf_counter())
+
+
+def _deliver_telegram(bot, job):
+    try:
+        send_message(bot, job.user_id, job.text, priority=BULK)
+        return True
+    except Exception:
+        return False
+
+
+def _enqueue_email(job):
+    """Письмо уходит через outbox: повторы и недоставленные письма ведет очередь."""
+    dedup_key = f"reminder:{job.qr_code}:{job.reminder_type}:{job.due_on}" if job.due_on else None
+    try:
+        enqueue_email(job.email, job.email_subject, job.text, dedup_key=dedup_key)
+        return True, ""
+    except Exception as exc:
+        return False, f"{type(exc).__name__}: {exc}"
+
+
+def deliver_reminders(bot, jobs, admin_chat_id=None, workers=None, stats=None):
+    """Рассылает напоминания пулом потоков с учетом лимитов Telegram.
+
+    Письма ставятся в outbox (email_ok — письмо надежно в очереди, уже
+    поставленное ранее с тем же ключом тоже считается), поэтому SMTP не
+    задерживает ни рассылку, ни сохранение записей о напоминаниях.
+    Возвращает DeliveryResult в порядке jobs и счетчики sent/email_sent/errors.
+    stats (ReminderRunStats) получает задержку каждой отправки по каналам.
+    """
+    results = [DeliveryResult(job) for job in jobs]
+    if not jobs:
+        return results, {"sent": 0, "email_sent": 0, "errors": 0}
+
+    with ThreadPoolExecutor(max_workers=workers or delivery_workers(), thread_name_prefix="reminders") as pool:
+        telegram_futures = [pool.submit(_timed, stats, "telegram", _deliver_telegram, bot, job) for job in jobs]
+        for result in results:
+            if result.job.email:
+                result.email_ok, result.email_error = _timed(stats, "email_enqueue", _enqueue_email, result.job)
+        for result, telegram_future in zip(results, telegram_futures):
+            result.telegram_ok = telegram_future.result()
+
+        counters = {"sent": 0, "email_sent": 0, "errors": 0}
+        notices = []
+        for result in results:
+            job = result.job
+            if result.telegram_ok:
+                counters["sent"] += 1
+            else:
+                counters["errors"] += 1
+                notices.append(f"Не удалось отправить Telegram-напоминание пользователю {job.user_id} ({job.qr_code}).")
+            if job.email:
+                if result.email_ok:
+                    counters["email_sent"] += 1
+                else:
+                    counters["errors"] += 1
+                    notices.append(f"Не удалось поставить email на {job.email} в очередь ({job.qr_code}). Ошибка: {result.email_error}")
+
+        if admin_chat_id:
+            for notice in notices:
+                pool.submit(_notify_admin, bot, admin_chat_id, notice)
+
+    return results, counters
+
+
+def _notify_admin(bot, admin_chat_id, text):
+    try:
+        send_message(bot, admin_chat_id, text, priority=OPERATOR)
+    except Exception:
+        pass
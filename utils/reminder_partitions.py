@@ -0,0 +1,103 @@
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from .db_utils import get_overdue_daily_rate
+from .models import RentalAgreement
+
+
+# Таблицы снимка, которые нужны для подготовки напоминаний в дочерних процессах.
+SNAPSHOT_TABLES = ("rental_agreements", "users", "cells", "overdue_tariffs")
+
+_worker_state = {}
+
+
+def reminder_partitions():
+    return max(int(os.getenv("REMINDER_PARTITIONS") or 1), 1)
+
+
+def partition_min_candidates():
+    # На малом числе напоминаний запуск процессов дороже самой работы.
+    return int(os.getenv("REMINDER_PARTITION_MIN") or 500)
+
+
+def partition_of(qr_code, partitions):
+    """Номер части для договора; crc32 не зависит от PYTHONHASHSEED процесса."""
+    return zlib.crc32(str(qr_code).encode("utf-8")) % partitions
+
+
+def split_candidates(candidates, partitions):
+    """Делит кандидатов (qr_code, тип) на части, сохраняя их номер в общем списке."""
+    parts = [[] for _ in range(partitions)]
+    for number, (qr_code, reminder_type) in enumerate(candidates):
+        parts[partition_of(qr_code, partitions)].append((number, qr_code, reminder_type))
+    return [part for part in parts if part]
+
+
+def _init_worker(snapshot):
+    """Дочерний процесс получает снимок один раз и строит по нему справочники."""
+    _worker_state["database"] = snapshot
+    _worker_state["agreements"] = {
+        record.get("qr_code"): record
+        for record in snapshot.get("rental_agreements", [])
+        if isinstance(record, dict)
+    }
+    _worker_state["users"] = {
+        user.get("telegram_id"): user
+        for user in snapshot.get("users", [])
+        if isinstance(user, dict)
+    }
+    _worker_state["cell_sizes"] = {
+        cell.get("number"): cell.get("cell_size_code")
+        for cell in snapshot.get("cells", [])
+        if isinstance(cell, dict)
+    }
+    _worker_state["rates"] = {}
+
+
+def _daily_rate(cell_number, on_date):
+    cell_size_code = _worker_state["cell_sizes"].get(cell_number)
+    if not cell_size_code:
+        return None
+    rates = _worker_state["rates"]
+    key = (cell_size_code, on_date)
+    if key not in rates:
+        rates[key] = get_overdue_daily_rate(_worker_state["database"], cell_size_code, on_date)
+    return rates[key]
+
+
+def _prepare_partition(candidates, on_date, today):
+    # Импорт здесь: reminders сам импортирует этот модуль.
+    from .reminders import needs_overdue_tariff, reminder_job
+
+    agreements = _worker_state["agreements"]
+    prepared = []
+    for number, qr_code, reminder_type in candidates:
+        rent = RentalAgreement.from_dict(agreements[qr_code])
+        daily_rate = _daily_rate(rent.cell_number, on_date) if needs_overdue_tariff(reminder_type) else None
+        user = _worker_state["users"].get(rent.user_telegram_id)
+        prepared.append((number, reminder_job(rent, reminder_type, on_date, today, user, daily_rate)))
+    return prepared
+
+
+def prepare_jobs_partitioned(database, candidates, on_date, today, partitions):
+    """Готовит ReminderJob по кандидатам в пуле из partitions процессов.
+
+    Кандидаты (qr_code, тип) делятся по crc32(qr_code); каждая часть
+    обрабатывается над копией снимка только для чтения, договор ищется по
+    qr_code. Результаты сливаются в порядке candidates — так же, как при
+    последовательной обработке.
+    """
+    snapshot = {table: database.get(table, []) for table in SNAPSHOT_TABLES}
+    parts = split_candidates(candidates, partitions)
+    with ProcessPoolExecutor(
+        max_workers=len(parts),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(snapshot,),
+    ) as pool:
+        futures = [pool.submit(_prepare_partition, part, on_date, today) for part in parts]
+        prepared = [item for future in futures for item in future.result()]
+    prepared.sort(key=lambda item: item[0])
+    return [job for _, job in prepared]
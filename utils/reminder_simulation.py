@@ -0,0 +1,89 @@
+import json
+import sys
+from datetime import timedelta
+
+from .db_utils import db_snapshot, get_overdue_daily_rate, load_models
+from .models import parse_iso_date
+from .reminder_calendar import ReminderCalendar
+from .reminders import REMINDER_TEXTS
+
+
+def simulate_reminders(start_date, end_date, database=None):
+    """Какие напоминания ушли бы с start_date по end_date включительно (dry-run).
+
+    Ничего не отправляет и не пишет в БД: считается, что договоры остаются в
+    текущем состоянии, а каждое напоминание доставляется. Возвращает список
+    {"date", "qr_code", "reminder_type", "user_telegram_id", "channels",
+    "daily_rate"} в порядке дней и договоров; daily_rate — тариф просрочки
+    на этот день (get_overdue_daily_rate) для напоминаний о просрочке.
+    """
+    if database is None:
+        database = db_snapshot()
+    # load_models пропускает не-словари, поэтому позиции в календаре — номера моделей.
+    agreements = load_models(database, "rental_agreements")
+    calendar = ReminderCalendar()
+    records = (record for record in database.get("rental_agreements", []) if isinstance(record, dict))
+    for position, rent in enumerate(records):
+        calendar.add(position, rent)
+
+    users = {
+        user.get("telegram_id"): user
+        for user in database.get("users", [])
+        if isinstance(user, dict)
+    }
+    cell_sizes = {
+        cell.get("number"): cell.get("cell_size_code")
+        for cell in database.get("cells", [])
+        if isinstance(cell, dict)
+    }
+    rates = {}
+
+    def daily_rate(cell_size_code, on_date):
+        key = (cell_size_code, on_date)
+        if key not in rates:
+            rates[key] = get_overdue_daily_rate(database, cell_size_code, on_date) if cell_size_code else None
+        return rates[key]
+
+    planned = []
+    day = start_date
+    while day <= end_date:
+        for position, qr_code, reminder_type in calendar.due_on(day):
+            rent = agreements[position]
+            if not rent.user_telegram_id:
+                continue
+            user = users.get(rent.user_telegram_id) or {}
+            channels = ["telegram", "email"] if user.get("email") else ["telegram"]
+            rate = None
+            if reminder_type not in REMINDER_TEXTS and reminder_type != "overdue_6m":
+                rate = daily_rate(cell_sizes.get(rent.cell_number), day)
+            planned.append(
+                {
+                    "date": day.isoformat(),
+                    "qr_code": qr_code,
+                    "reminder_type": reminder_type,
+                    "user_telegram_id": rent.user_telegram_id,
+                    "channels": channels,
+                    "daily_rate": rate,
+                }
+            )
+        day += timedelta(days=1)
+    return planned
+
+
+def summarize_simulation(planned):
+    """Итоги dry-run: число напоминаний по типам и по каналам."""
+    by_type = {}
+    by_channel = {}
+    for entry in planned:
+        by_type[entry["reminder_type"]] = by_type.get(entry["reminder_type"], 0) + 1
+        for channel in entry["channels"]:
+            by_channel[channel] = by_channel.get(channel, 0) + 1
+    return {"total": len(planned), "by_type": by_type, "by_channel": by_channel}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or not all(parse_iso_date(value) for value in sys.argv[1:]):
+        print("Использование: python -m utils.reminder_simulation <ГГГГ-ММ-ДД> <ГГГГ-ММ-ДД>")
+        sys.exit(1)
+    for planned_entry in simulate_reminders(parse_iso_date(sys.argv[1]), parse_iso_date(sys.argv[2])):
+        print(json.dumps(planned_entry, ensure_ascii=False))
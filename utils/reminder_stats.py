@@ -0,0 +1,179 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+STATS_FILE = Path("reminder_stats.jsonl")
+PHASES = ("load", "candidates", "tariffs", "partitions", "telegram", "email_enqueue", "save")
+
+
+def stats_history_size():
+    return int(os.getenv("REMINDER_STATS_HISTORY") or 100)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class ReminderRunStats:
+    """Замеры одного запуска напоминаний: время по фазам, типы, задержки отправки.
+
+    Фазы telegram и email_enqueue идут параллельно в пуле потоков, поэтому
+    для них записывается время от первой отправки до последней, а задержка
+    каждой отдельной отправки попадает в latencies. email_enqueue — это
+    постановка письма в outbox; сама отправка по SMTP идет позже в воркере
+    очереди, ее задержки собирает outbox.smtp_latency_stats().
+    """
+
+    def __init__(self, on_date):
+        self.on_date = on_date
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self.phases = {}
+        self.by_type = {}
+        self.latencies = {"telegram": [], "email_enqueue": []}
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - started)
+
+    def add_phase(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count_type(self, reminder_type):
+        self.by_type[reminder_type] = self.by_type.get(reminder_type, 0) + 1
+
+    def record_send(self, channel, started, finished):
+        """Одна отправка по каналу: started/finished — значения time.perf_counter()."""
+        with self._lock:
+            self.latencies[channel].append(finished - started)
+            first, last = self._windows.get(channel, (started, finished))
+            self._windows[channel] = (min(first, started), max(last, finished))
+
+    def finish_sends(self):
+        with self._lock:
+            for channel, (first, last) in self._windows.items():
+                self.phases[channel] = self.phases.get(channel, 0.0) + (last - first)
+            self._windows = {}
+
+    def to_dict(self, counters=None):
+        latency = {channel: latency_summary(values) for channel, values in self.latencies.items()}
+        return {
+            "on_date": self.on_date.isoformat(),
+            "started_at": self.started_at.isoformat(timespec="seconds").replace("+00:00", "Z"),
+            "total_seconds": round(time.perf_counter() - self._started, 4),
+            "phases": {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            "by_type": dict(self.by_type),
+            "latency": {
+                channel: {key: round(value, 4) if isinstance(value, float) else value for key, value in values.items()}
+                for channel, values in latency.items()
+            },
+            "counters": dict(counters or {}),
+        }
+
+
+_history_lock = threading.Lock()
+
+
+def save_run_stats(entry, path=None):
+    """Дописывает запуск в историю и оставляет последние REMINDER_STATS_HISTORY записей."""
+    path = Path(path) if path else STATS_FILE
+    with _history_lock:
+        history = load_run_stats(path=path)
+        history.append(entry)
+        history = history[-stats_history_size():]
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            for item in history:
+                file.write(json.dumps(item, ensure_ascii=False) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+
+def load_run_stats(limit=None, path=None):
+    path = Path(path) if path else STATS_FILE
+    if not path.exists():
+        return []
+    history = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                try:
+                    history.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return history[-limit:] if limit else history
+
+
+def latency_summary(values):
+    """count/p50/p90/p99/max по списку задержек в секундах."""
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.5),
+        "p90": percentile(values, 0.9),
+        "p99": percentile(values, 0.99),
+        "max": values[-1] if values else None,
+    }
+
+
+def _latency_line(channel, values, unit="отправок"):
+    return (
+        f"{channel}: {values['count']} {unit}, p50 {values['p50']:.3f}, "
+        f"p90 {values['p90']:.3f}, p99 {values['p99']:.3f}, max {values['max']:.3f} сек."
+    )
+
+
+def format_run_stats(history, smtp_latency=None):
+    """Текст для /reminder_stats: последний запуск подробно и сводка по истории.
+
+    smtp_latency — задержки отправки писем воркером outbox (latency_summary).
+    """
+    smtp_line = None
+    if smtp_latency and smtp_latency.get("count"):
+        smtp_line = _latency_line("SMTP (outbox, последние письма)", smtp_latency, "писем")
+    if not history:
+        return "\n".join(["Статистики запусков напоминаний пока нет.", *([smtp_line] if smtp_line else [])])
+    last = history[-1]
+    counters = last.get("counters", {})
+    lines = [
+        f"Последний запуск: {last['started_at']} (за {last['on_date']}), {last.get('total_seconds', 0):.2f} сек.",
+        f"Telegram: {counters.get('sent', 0)}, Email: {counters.get('email_sent', 0)}, Ошибки: {counters.get('errors', 0)}",
+        "Фазы, сек: " + ", ".join(
+            f"{name} {last['phases'][name]:.3f}" for name in PHASES if name in last.get("phases", {})
+        ),
+    ]
+    if last.get("by_type"):
+        lines.append("По типам: " + ", ".join(f"{name} — {count}" for name, count in sorted(last["by_type"].items())))
+    for channel, values in last.get("latency", {}).items():
+        if values.get("count"):
+            lines.append(_latency_line(channel, values))
+    if smtp_line:
+        lines.append(smtp_line)
+
+    if len(history) > 1:
+        totals = [entry.get("total_seconds", 0) for entry in history]
+        sent = sum(entry.get("counters", {}).get("sent", 0) for entry in history)
+        errors = sum(entry.get("counters", {}).get("errors", 0) for entry in history)
+        lines.append("")
+        lines.append(
+            f"Последние {len(history)} запусков: Telegram {sent}, ошибок {errors}, "
+            f"время запуска среднее {sum(totals) / len(totals):.2f} сек., максимум {max(totals):.2f} сек."
+        )
+    return "\n".join(lines)
@@ -1,158 +1,257 @@
-from datetime import datetime, date, timezone
+import os
+import threading
+from datetime import datetime, date, timedelta, timezone
 
 from .db_utils import (
-    db_reader,
-    save_database,
+    db_snapshot,
+    due_reminders,
     find_user,
     get_cell_by_number,
     get_overdue_daily_rate,
+    load_models,
+    reminder_already_sent,
+    run_in_transaction,
 )
-from .mailer import send_yandex_email_detailed
+from .models import parse_iso_date
+from .reminder_dedup import ReminderClaims, dedup_retention_days
+from .reminder_delivery import ReminderJob, deliver_reminders
+from .reminder_partitions import partition_min_candidates, prepare_jobs_partitioned, reminder_partitions
+from .reminder_stats import ReminderRunStats, save_run_stats
 
 
-def process_rent_reminders(bot, admin_chat_id=None):
-    database = db_reader()
+_claims = ReminderClaims()
+_scheduled_run_lock = threading.Lock()
+
+REMINDER_TEXTS = {
+    "1m": "До окончания аренды остался 1 месяц.",
+    "2w": "До окончания аренды осталось 2 недели.",
+    "1w": "До окончания аренды осталась 1 неделя.",
+    "3d": "До окончания аренды осталось 3 дня.",
+}
+
+
+def process_rent_reminders(bot, admin_chat_id=None, on_date=None, partitions=None):
+    """Рассылает напоминания, положенные в день on_date (по умолчанию сегодня).
+
+    Для прошедшего дня (догоняющий запуск после простоя) типы напоминаний
+    определяются по on_date, а запись помечается due_on=on_date, так что
+    повторный запуск за тот же день ничего не отправит. Напоминания
+    "до окончания аренды" по уже закончившимся договорам пропускаются — их
+    заменяют напоминания о просрочке.
+
+    При partitions > 1 (REMINDER_PARTITIONS) тексты напоминаний готовятся в
+    пуле процессов по частям, разбитым по qr_code; занятие напоминаний,
+    отправка и запись результата остаются в этом процессе.
+    """
+    today = date.today()
+    on_date = on_date or today
+    stats = ReminderRunStats(on_date)
+    with stats.phase("load"):
+        database, due = due_reminders(on_date)
+        if isinstance(database, dict):
+            # Договоры ищутся по qr_code: позиции календаря относятся к сырой
+            # таблице, где могут быть и не-словари, а модели строятся без них.
+            agreements = {rent.qr_code: rent for rent in load_models(database, "rental_agreements")}
     if not isinstance(database, dict):
         return {"sent": 0, "email_sent": 0, "errors": 1}
 
-    today = date.today()
-    sent_count = 0
-    email_sent_count = 0
-    errors = 0
-    changed = False
-
-    reminder_plan = [
-        (30, "1m", "До окончания аренды остался 1 месяц."),
-        (14, "2w", "До окончания аренды осталось 2 недели."),
-        (7, "1w", "До окончания аренды осталась 1 неделя."),
-        (3, "3d", "До окончания аренды осталось 3 дня."),
-    ]
-
-    for rent in database.get("rental_agreements", []):
-        if rent.get("status") != "Активна":
-            continue
-
-        end_date = _parse_iso_date(rent.get("end_date"))
-        qr_code = rent.get("qr_code")
-        user_id = rent.get("user_telegram_id")
-        if not end_date or not qr_code or not user_id:
-            continue
-
-        user = find_user(database, user_id) or {}
-        full_name = user.get("full_name") or "Клиент"
-        user_email = user.get("email")
-        days_left = (end_date - today).days
-        message = None
-        reminder_type = None
-        email_subject = None
-
-        for offset, code, text in reminder_plan:
-            if days_left == offset and not _reminder_sent_today(database, qr_code, code, today):
-                message = (
-                    f"{text}\n"
-                    f"Договор: {qr_code}\n"
-                    f"Ячейка: {rent.get('cell_number')}\n"
-                    f"Дата окончания: {rent.get('end_date')}"
-                )
-                reminder_type = code
-                email_subject = f"SelfStorage: напоминание по договору {qr_code}"
-                break
-
-        if message is None:
-            days_overdue = (today - end_date).days
-            if days_overdue == 180:
-                reminder_type = "overdue_6m"
-                if not _reminder_sent_today(database, qr_code, reminder_type, today):
-                    message = (
-                        "Срок просроченного хранения достиг 6 месяцев.\n"
-                        f"Договор: {qr_code}\n"
-                        "Свяжитесь с нами срочно, чтобы согласовать дальнейшие действия."
-                    )
-                    email_subject = f"SelfStorage: 6 месяцев просрочки по договору {qr_code}"
-            elif days_overdue == 1 or (days_overdue > 1 and days_overdue % 30 == 0):
-                overdue_type = "overdue_start" if days_overdue == 1 else f"overdue_m{days_overdue // 30}"
-                if not _reminder_sent_today(database, qr_code, overdue_type, today):
-                    cell = get_cell_by_number(database, rent.get("cell_number"))
-                    cell_size_code = cell.get("cell_size_code") if cell else None
-                    daily_rate = get_overdue_daily_rate(database, cell_size_code, today) if cell_size_code else None
-                    tariff_text = (
-                        f"Повышенный тариф: {daily_rate} руб./день."
-                        if daily_rate is not None
-                        else "Повышенный тариф применяется согласно вашему договору."
-                    )
-                    message = (
-                        "Срок аренды истёк.\n"
-                        f"Договор: {qr_code}\n"
-                        f"Дата окончания: {rent.get('end_date')}\n"
-                        "Вещи хранятся до 6 месяцев после окончания срока аренды.\n"
-                        f"{tariff_text}\n"
-                        "Пожалуйста, заберите вещи как можно скорее."
+    candidates = []
+    claimed = []
+
+    try:
+        with stats.phase("candidates"):
+            for _, qr_code, reminder_type in due:
+                rent = agreements.get(qr_code)
+                if not reminder_still_due(rent, qr_code, reminder_type, on_date, today):
+                    continue
+                claim_key = (qr_code, reminder_type, on_date)
+                if not _claims.claim(claim_key, reminder_already_sent):
+                    continue
+                claimed.append(claim_key)
+                candidates.append((qr_code, reminder_type))
+                stats.count_type(reminder_type)
+
+        if partitions is None:
+            partitions = reminder_partitions()
+        if partitions > 1 and len(candidates) >= partition_min_candidates():
+            with stats.phase("partitions"):
+                jobs = prepare_jobs_partitioned(database, candidates, on_date, today, partitions)
+        else:
+            with stats.phase("tariffs"):
+                rates = {
+                    qr_code: overdue_daily_rate_for(database, agreements[qr_code], on_date)
+                    for qr_code, reminder_type in candidates
+                    if needs_overdue_tariff(reminder_type)
+                }
+            with stats.phase("candidates"):
+                jobs = [
+                    reminder_job(
+                        agreements[qr_code],
+                        reminder_type,
+                        on_date,
+                        today,
+                        find_user(database, agreements[qr_code].user_telegram_id),
+                        rates.get(qr_code),
                     )
-                    reminder_type = overdue_type
-                    email_subject = f"SelfStorage: просрочка по договору {qr_code}"
-
-        if message is None or reminder_type is None:
-            continue
-
-        try:
-            bot.send_message(user_id, f"{full_name},\n\n{message}")
-            sent_count += 1
-        except Exception:
-            errors += 1
-            if admin_chat_id:
-                try:
-                    bot.send_message(admin_chat_id, f"Не удалось отправить Telegram-напоминание пользователю {user_id} ({qr_code}).")
-                except Exception:
-                    pass
-
-        if user_email:
-            email_ok, email_error = send_yandex_email_detailed(user_email, email_subject, f"{full_name},\n\n{message}")
-            if email_ok:
-                email_sent_count += 1
-            else:
-                errors += 1
-                if admin_chat_id:
-                    try:
-                        bot.send_message(
-                            admin_chat_id,
-                            f"Не удалось отправить email на {user_email} ({qr_code}). Ошибка: {email_error}"
-                        )
-                    except Exception:
-                        pass
-
-        _add_reminder_record(database, qr_code, reminder_type)
-        changed = True
-
-    if changed:
-        save_database(database)
-
-    return {"sent": sent_count, "email_sent": email_sent_count, "errors": errors}
-
-
-def _parse_iso_date(value):
+                    for qr_code, reminder_type in candidates
+                ]
+
+        results, counters = deliver_reminders(bot, jobs, admin_chat_id, stats=stats)
+        stats.finish_sends()
+
+        # Отправка идет по снимку БД без блокировки, а записи о напоминаниях
+        # добавляются к актуальному состоянию одной транзакцией. Напоминание,
+        # не доставленное ни в Telegram, ни на почту, не записывается и будет
+        # отправлено при следующем запуске.
+        delivered = [result.job for result in results if result.delivered]
+        if delivered:
+            with stats.phase("save"):
+                run_in_transaction(_add_reminder_records, delivered, on_date)
+    finally:
+        _claims.release(claimed)
+
     try:
-        return datetime.strptime(value, "%Y-%m-%d").date()
-    except (ValueError, TypeError):
-        return None
+        save_run_stats(stats.to_dict(counters))
+    except OSError:
+        pass
+    return counters
+
+
+def catchup_days_limit():
+    # Дальше, чем помнит индекс отправленных напоминаний, догонять нельзя.
+    return min(int(os.getenv("REMINDER_CATCHUP_DAYS") or 7), dedup_retention_days())
+
+
+def pending_reminder_days(database, today=None, max_days=None, include_today=True):
+    """Дни с последнего обработанного (database["scheduler"]) по today включительно.
+
+    include_today=False — только прошедшие дни, без today.
+    """
+    today = today or date.today()
+    max_days = catchup_days_limit() if max_days is None else max_days
+    state = database.get("scheduler") if isinstance(database, dict) else None
+    last_day = parse_iso_date((state or {}).get("reminders_last_day"))
+    first_day = today - timedelta(days=max(max_days - 1, 0))
+    if last_day is not None:
+        first_day = max(first_day, last_day + timedelta(days=1))
+    last = today if include_today else today - timedelta(days=1)
+    return [first_day + timedelta(days=offset) for offset in range((last - first_day).days + 1)]
+
+
+def run_scheduled_reminders(bot, admin_chat_id=None, today=None, include_today=True):
+    """Плановый запуск: отрабатывает сегодняшний день и все пропущенные после простоя.
+
+    Каждый день обрабатывается со своими типами напоминаний, после чего он
+    отмечается в database["scheduler"]["reminders_last_day"]. С
+    include_today=False (догон при старте до времени рассылки) сегодняшний
+    день остается плановому запуску.
+    """
+    totals = {"sent": 0, "email_sent": 0, "errors": 0, "days": 0}
+    with _scheduled_run_lock:
+        for day in pending_reminder_days(db_snapshot(), today, include_today=include_today):
+            result = process_rent_reminders(bot, admin_chat_id, on_date=day)
+            for key, value in result.items():
+                totals[key] += value
+            totals["days"] += 1
+            run_in_transaction(_mark_reminder_day, day)
+    return totals
+
+
+def reminder_still_due(rent, qr_code, reminder_type, on_date, today):
+    """Нужно ли еще отправлять напоминание по договору (модель RentalAgreement)."""
+    if rent is None or rent.qr_code != qr_code or rent.status != "Активна":
+        return False
+    if not rent.end_date or not rent.user_telegram_id:
+        return False
+    if on_date < today and reminder_type in REMINDER_TEXTS and rent.end_date <= today:
+        return False
+    return True
+
+
+def needs_overdue_tariff(reminder_type):
+    return reminder_type not in REMINDER_TEXTS and reminder_type != "overdue_6m"
+
+
+def reminder_job(rent, reminder_type, on_date, today, user, daily_rate):
+    user = user or {}
+    full_name = user.get("full_name") or "Клиент"
+    message, email_subject = build_reminder(rent, reminder_type, on_date, daily_rate, sent_on=today)
+    return ReminderJob(
+        qr_code=rent.qr_code,
+        reminder_type=reminder_type,
+        user_id=rent.user_telegram_id,
+        text=f"{full_name},\n\n{message}",
+        email=user.get("email"),
+        email_subject=email_subject,
+        due_on=on_date.isoformat(),
+    )
+
+
+def overdue_daily_rate_for(database, rent, on_date):
+    cell = get_cell_by_number(database, rent.cell_number)
+    cell_size_code = cell.get("cell_size_code") if cell else None
+    return get_overdue_daily_rate(database, cell_size_code, on_date) if cell_size_code else None
+
+
+def build_reminder(rent, reminder_type, on_date, daily_rate=None, sent_on=None):
+    """Текст напоминания и тема письма для договора (модель RentalAgreement).
+
+    daily_rate — тариф просрочки на on_date (см. overdue_daily_rate_for).
+    sent_on — день фактической отправки, если он позже on_date: тогда
+    напоминание до окончания аренды называет оставшиеся на этот день дни.
+    """
+    qr_code = rent.qr_code
+    if reminder_type in REMINDER_TEXTS:
+        heading = REMINDER_TEXTS[reminder_type]
+        if sent_on is not None and sent_on != on_date:
+            heading = f"До окончания аренды осталось {(rent.end_date - sent_on).days} дн."
+        message = (
+            f"{heading}\n"
+            f"Договор: {qr_code}\n"
+            f"Ячейка: {rent.cell_number}\n"
+            f"Дата окончания: {rent.end_date.isoformat()}"
+        )
+        return message, f"SelfStorage: напоминание по договору {qr_code}"
+
+    if reminder_type == "overdue_6m":
+        message = (
+            "Срок просроченного хранения достиг 6 месяцев.\n"
+            f"Договор: {qr_code}\n"
+            "Свяжитесь с нами срочно, чтобы согласовать дальнейшие действия."
+        )
+        return message, f"SelfStorage: 6 месяцев просрочки по договору {qr_code}"
+
+    tariff_text = (
+        f"Повышенный тариф: {daily_rate} руб./день."
+        if daily_rate is not None
+        else "Повышенный тариф применяется согласно вашему договору."
+    )
+    message = (
+        "Срок аренды истёк.\n"
+        f"Договор: {qr_code}\n"
+        f"Дата окончания: {rent.end_date.isoformat()}\n"
+        "Вещи хранятся до 6 месяцев после окончания срока аренды.\n"
+        f"{tariff_text}\n"
+        "Пожалуйста, заберите вещи как можно скорее."
+    )
+    return message, f"SelfStorage: просрочка по договору {qr_code}"
+
+
+def _add_reminder_records(database, jobs, due_on):
+    for job in jobs:
+        _add_reminder_record(database, job.qr_code, job.reminder_type, due_on)
 
 
-def _reminder_sent_today(database, qr_code, reminder_type, on_date):
-    for reminder in database.get("reminders", []):
-        if reminder.get("rental_agreement_qr_code") != qr_code:
-            continue
-        if reminder.get("reminder_type") != reminder_type:
-            continue
-        sent_at = reminder.get("sent_at", "")
-        if sent_at[:10] == on_date.isoformat():
-            return True
-    return False
+def _mark_reminder_day(database, day):
+    database.setdefault("scheduler", {})["reminders_last_day"] = day.isoformat()
 
 
-def _add_reminder_record(database, qr_code, reminder_type):
+def _add_reminder_record(database, qr_code, reminder_type, due_on):
     database.setdefault("reminders", []).append(
         {
             "rental_agreement_qr_code": qr_code,
             "sent_at": datetime.now(timezone.utc).isoformat(timespec='seconds').replace("+00:00", "Z"),
             "reminder_type": reminder_type,
+            "due_on": due_on.isoformat(),
         }
     )
@@ -0,0 +1,44 @@
+import json
+import os
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+from .db_utils import db_snapshot, load_models, requests_by_status, warehouse_availability
+
+
+REPORTS_DIR = Path("reports")
+
+
+def build_report_snapshot(database, on_date=None):
+    """Ежедневный срез: договоры по статусам, просрочки, новые заявки, свободные ячейки."""
+    on_date = on_date or date.today()
+    agreements_by_status = {}
+    overdue = 0
+    for rent in load_models(database, "rental_agreements"):
+        agreements_by_status[rent.status] = agreements_by_status.get(rent.status, 0) + 1
+        if rent.status == "Активна" and rent.end_date and rent.end_date < on_date:
+            overdue += 1
+
+    free_counts = warehouse_availability(database)["free_counts"]
+    return {
+        "date": on_date.isoformat(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z"),
+        "agreements_by_status": agreements_by_status,
+        "overdue_agreements": overdue,
+        "pending_requests": len(requests_by_status(database, "pending")),
+        "free_cells": {
+            warehouse: sum(sizes.values())
+            for warehouse, sizes in free_counts.items()
+        },
+    }
+
+
+def save_report_snapshot(on_date=None):
+    """Дописывает срез в reports/snapshots.jsonl и возвращает его."""
+    snapshot = build_report_snapshot(db_snapshot(), on_date)
+    REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+    with open(REPORTS_DIR / "snapshots.jsonl", "a", encoding="utf-8") as file:
+        file.write(json.dumps(snapshot, ensure_ascii=False) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+    return snapshot
@@ -0,0 +1,66 @@
+class MessageRouter:
+    """Маршрутизация входящих сообщений словарями вместо перебора фильтров.
+
+    Порядок: команда (/start, /start@bot, /start payload) -> точный текст
+    кнопки -> обработчик по умолчанию, который передает сообщение
+    обработчику состояния сессии через dispatch_state. Каждый шаг — один
+    поиск в словаре, поэтому время не зависит от числа обработчиков.
+    """
+
+    def __init__(self):
+        self.commands = {}
+        self.texts = {}
+        self.states = {}
+        self.default_handler = None
+
+    @staticmethod
+    def _register(table, keys, kind):
+        def decorator(func):
+            for key in keys:
+                if key in table:
+                    raise ValueError(f"{kind} {key!r} уже зарегистрирован: {table[key].__name__}")
+                table[key] = func
+            return func
+        return decorator
+
+    def command(self, *names):
+        return self._register(self.commands, names, "Команда")
+
+    def text(self, *texts):
+        return self._register(self.texts, texts, "Текст")
+
+    def state(self, *states):
+        """Обработчик состояния вызывается как handler(message, session)."""
+        return self._register(self.states, states, "Состояние")
+
+    def default(self, func):
+        self.default_handler = func
+        return func
+
+    @staticmethod
+    def command_name(text):
+        if not text or not text.startswith("/"):
+            return None
+        return text.split(maxsplit=1)[0][1:].split("@", 1)[0]
+
+    def resolve(self, message):
+        """Обработчик для сообщения по команде или тексту кнопки (без учета состояния)."""
+        text = message.text
+        name = self.command_name(text)
+        if name is not None and name in self.commands:
+            return self.commands[name]
+        return self.texts.get(text)
+
+    def dispatch(self, message):
+        handler = self.resolve(message) or self.default_handler
+        if handler is not None:
+            return handler(message)
+        return None
+
+    def dispatch_state(self, message, session):
+        """Обработчик состояния сессии; False, если для состояния его нет."""
+        handler = self.states.get(session.get("state"))
+        if handler is None:
+            return False
+        handler(message, session)
+        return True
@@ -0,0 +1,127 @@
+import os
+from datetime import datetime
+
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+from .archive import archive_closed_records
+from .db_utils import check_cells_occupancy
+from .reminders import run_scheduled_reminders
+from .reports import save_report_snapshot
+from .sessions import purge_expired_sessions
+
+
+SCHEDULER_FILE = "scheduler.sqlite3"
+
+# Задания хранятся в SQLite и восстанавливаются после перезапуска, поэтому в
+# хранилище попадают только ссылки на функции модуля. Бот и чат оператора в
+# задание не сериализуются — задания берут их отсюда.
+_context = {"bot": None, "admin_chat_id": None}
+
+
+def scheduler_settings():
+    return {
+        "path": os.getenv("SCHEDULER_PATH") or SCHEDULER_FILE,
+        "timezone": os.getenv("SCHEDULER_TIMEZONE") or None,
+        "reminders_cron": os.getenv("REMINDERS_CRON") or "0 10 * * *",
+        "archive_cron": os.getenv("ARCHIVE_CRON") or "30 3 * * *",
+        "report_cron": os.getenv("REPORT_CRON") or "55 23 * * *",
+        "cells_check_seconds": int(os.getenv("CELLS_CHECK_SECONDS") or 600),
+        "sessions_purge_seconds": int(os.getenv("SESSIONS_PURGE_SECONDS") or 3600),
+        # Насколько поздно еще можно выполнить пропущенный запуск задания.
+        "misfire_grace_seconds": int(os.getenv("SCHEDULER_MISFIRE_GRACE_SECONDS") or 24 * 3600),
+    }
+
+
+def reminders_job(include_today=True):
+    bot = _context["bot"]
+    admin_chat_id = _context["admin_chat_id"]
+    result = run_scheduled_reminders(bot, admin_chat_id, include_today=include_today)
+    if result["days"] > (1 if include_today else 0) and admin_chat_id:
+        try:
+            bot.send_message(
+                admin_chat_id,
+                f"Напоминания догнали пропущенные дни: {result['days']}.\n"
+                f"Telegram: {result['sent']}\nEmail: {result['email_sent']}\nОшибки: {result['errors']}",
+            )
+        except Exception:
+            pass
+    return result
+
+
+def fired_today(trigger, now=None):
+    """Прошло ли уже сегодня время срабатывания cron-триггера."""
+    now = now or datetime.now(trigger.timezone)
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    fire_time = trigger.get_next_fire_time(None, midnight)
+    return fire_time is not None and fire_time <= now
+
+
+def reminders_catch_up_job():
+    """Догон при старте: пропущенные дни, а сегодняшний — только если время рассылки уже прошло."""
+    settings = scheduler_settings()
+    trigger = CronTrigger.from_crontab(settings["reminders_cron"], timezone=settings["timezone"])
+    return reminders_job(include_today=fired_today(trigger))
+
+
+def archive_job():
+    return archive_closed_records()
+
+
+def integrity_job():
+    return check_cells_occupancy()
+
+
+def report_job():
+    return save_report_snapshot()
+
+
+def sessions_job():
+    return purge_expired_sessions()
+
+
+def _jobs(settings):
+    timezone = settings["timezone"]
+    return {
+        "reminders": (reminders_job, CronTrigger.from_crontab(settings["reminders_cron"], timezone=timezone)),
+        "archive": (archive_job, CronTrigger.from_crontab(settings["archive_cron"], timezone=timezone)),
+        "report_snapshot": (report_job, CronTrigger.from_crontab(settings["report_cron"], timezone=timezone)),
+        "cells_integrity": (integrity_job, IntervalTrigger(seconds=settings["cells_check_seconds"], timezone=timezone)),
+        "sessions_purge": (sessions_job, IntervalTrigger(seconds=settings["sessions_purge_seconds"], timezone=timezone)),
+    }
+
+
+def start_scheduler(bot, admin_chat_id=None, catch_up=True):
+    """Запускает планировщик с постоянным хранилищем заданий.
+
+    Задания, расписание которых не поменялось, остаются в хранилище как есть,
+    и пропущенный за время простоя запуск выполняется один раз (coalesce) в
+    пределах misfire_grace_seconds. Напоминания, кроме того, сами догоняют
+    пропущенные дни при старте (catch_up) — см. run_scheduled_reminders;
+    сегодняшние напоминания до времени REMINDERS_CRON при этом не уходят.
+    """
+    settings = scheduler_settings()
+    _context["bot"] = bot
+    _context["admin_chat_id"] = admin_chat_id
+
+    scheduler = BackgroundScheduler(
+        jobstores={"default": SQLAlchemyJobStore(url=f"sqlite:///{settings['path']}")},
+        job_defaults={
+            "coalesce": True,
+            "max_instances": 1,
+            "misfire_grace_time": settings["misfire_grace_seconds"],
+        },
+        timezone=settings["timezone"],
+    )
+    scheduler.start(paused=True)
+    for job_id, (func, trigger) in _jobs(settings).items():
+        existing = scheduler.get_job(job_id)
+        if existing is not None and str(existing.trigger) == str(trigger):
+            continue
+        scheduler.add_job(func, trigger, id=job_id, name=job_id, replace_existing=True)
+    if catch_up:
+        scheduler.add_job(reminders_catch_up_job, id="reminders_catch_up", replace_existing=True)
+    scheduler.resume()
+    return scheduler
@@ -0,0 +1,226 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+
+SESSIONS_FILE = Path("sessions.sqlite3")
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def session_settings():
+    return {
+        "path": os.getenv("SESSIONS_PATH") or str(SESSIONS_FILE),
+        # Сессия без действий дольше этого срока удаляется (и из памяти, и с диска).
+        "ttl_seconds": float(os.getenv("SESSION_TTL_SECONDS") or 24 * 3600),
+        # Ограничения кеша в памяти; вытесненные сессии остаются на диске.
+        "max_cached": int(os.getenv("SESSION_CACHE_SIZE") or 5000),
+        "max_cached_bytes": int(os.getenv("SESSION_CACHE_BYTES") or 8 * 1024 * 1024),
+    }
+
+
+class _Entry:
+    __slots__ = ("session", "blob", "touched_at", "saved_at")
+
+    def __init__(self, session, blob, touched_at, saved_at):
+        self.session = session
+        self.blob = blob
+        self.touched_at = touched_at
+        self.saved_at = saved_at
+
+
+class SessionStore:
+    """Сессии диалогов: LRU-кеш в памяти поверх SQLite.
+
+    Интерфейс как у словаря (get, store[user_id] = ..., pop), чтобы
+    обработчики работали с сессией так же, как раньше. Обработчик меняет
+    словарь сессии на месте, поэтому сообщение обрабатывается внутри
+    activity(user_id): на выходе commit пишет сессию на диск, только если
+    она изменилась. Сессии без действий дольше ttl_seconds удаляются; кеш
+    в памяти ограничен max_cached записями и max_cached_bytes байтами
+    JSON — лишнее вытесняется по LRU и при следующем обращении читается
+    с диска.
+    """
+
+    def __init__(self, path, ttl_seconds=24 * 3600, max_cached=5000, max_cached_bytes=8 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_cached = max_cached
+        self.max_cached_bytes = max_cached_bytes
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._active = {}
+        self._lock = threading.RLock()
+        self.counters = {"hits": 0, "loads": 0, "evicted": 0, "expired": 0, "writes": 0}
+
+        self._connection = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "user_id INTEGER PRIMARY KEY, "
+            "data TEXT NOT NULL, "
+            "touched_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS sessions_touched ON sessions (touched_at)")
+
+    def _expired(self, touched_at, now):
+        return now - touched_at > self.ttl_seconds
+
+    def _cache_put(self, user_id, entry):
+        self._cache_drop(user_id)
+        self._cache[user_id] = entry
+        self._cached_bytes += len(entry.blob)
+
+    def _cache_drop(self, user_id):
+        entry = self._cache.pop(user_id, None)
+        if entry is not None:
+            self._cached_bytes -= len(entry.blob)
+        return entry
+
+    def _shrink(self):
+        # Сессии, которые сейчас обрабатываются, не вытесняются: обработчик
+        # держит ссылку на словарь и еще не записал изменения.
+        for user_id in list(self._cache):
+            if len(self._cache) <= self.max_cached and self._cached_bytes <= self.max_cached_bytes:
+                break
+            if user_id in self._active:
+                continue
+            self._cache_drop(user_id)
+            self.counters["evicted"] += 1
+
+    def get(self, user_id, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is not None:
+                if self._expired(entry.touched_at, now):
+                    self._delete(user_id)
+                    self.counters["expired"] += 1
+                    return default
+                self._cache.move_to_end(user_id)
+                self.counters["hits"] += 1
+                return entry.session
+
+            row = self._connection.execute(
+                "SELECT data, touched_at FROM sessions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is None:
+                return default
+            blob, touched_at = row
+            if self._expired(touched_at, now):
+                self._delete(user_id)
+                self.counters["expired"] += 1
+                return default
+            entry = _Entry(json.loads(blob), blob, touched_at, touched_at)
+            self._cache_put(user_id, entry)
+            self.counters["loads"] += 1
+            self._shrink()
+            return entry.session
+
+    def __setitem__(self, user_id, session):
+        """Новая сессия сразу пишется на диск."""
+        with self._lock:
+            self._cache_put(user_id, _Entry(session, "", time.time(), None))
+            self.commit(user_id)
+
+    def pop(self, user_id, default=None):
+        with self._lock:
+            entry = self._cache.get(user_id)
+            session = entry.session if entry is not None else None
+            self._delete(user_id)
+            return session if session is not None else default
+
+    def _delete(self, user_id):
+        self._cache_drop(user_id)
+        self._connection.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def commit(self, user_id):
+        """Пишет сессию на диск, если она изменилась; отмечает активность пользователя.
+
+        Если данные не менялись, время активности на диске обновляется не
+        чаще раза в минуту — этого достаточно для TTL в часах.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is None:
+                return False
+            blob = json.dumps(entry.session, ensure_ascii=False, separators=(",", ":"))
+            entry.touched_at = now
+            if blob == entry.blob and entry.saved_at is not None and now - entry.saved_at < 60:
+                return False
+            self._connection.execute(
+                "INSERT INTO sessions (user_id, data, touched_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, touched_at = excluded.touched_at",
+                (user_id, blob, now),
+            )
+            self._cached_bytes += len(blob) - len(entry.blob)
+            entry.blob = blob
+            entry.saved_at = now
+            self.counters["writes"] += 1
+            self._shrink()
+            return True
+
+    @contextmanager
+    def activity(self, user_id):
+        """Обработка одного сообщения пользователя: в конце сессия сохраняется."""
+        with self._lock:
+            self._active[user_id] = self._active.get(user_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                if self._active[user_id] == 1:
+                    del self._active[user_id]
+                else:
+                    self._active[user_id] -= 1
+                self.commit(user_id)
+
+    def purge_expired(self):
+        """Удаляет просроченные сессии; возвращает их число на диске."""
+        now = time.time()
+        with self._lock:
+            for user_id in [key for key, entry in self._cache.items() if self._expired(entry.touched_at, now)]:
+                self._cache_drop(user_id)
+            cursor = self._connection.execute(
+                "DELETE FROM sessions WHERE touched_at < ?", (now - self.ttl_seconds,)
+            )
+            self.counters["expired"] += cursor.rowcount
+            return cursor.rowcount
+
+    def stats(self):
+        with self._lock:
+            stored = self._connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return {
+                "stored": stored,
+                "cached": len(self._cache),
+                "cached_bytes": self._cached_bytes,
+                **self.counters,
+            }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def session_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            settings = session_settings()
+            _store = SessionStore(
+                settings["path"],
+                ttl_seconds=settings["ttl_seconds"],
+                max_cached=settings["max_cached"],
+                max_cached_bytes=settings["max_cached_bytes"],
+            )
+        return _store
+
+
+def purge_expired_sessions():
+    return session_store().purge_expired()
@@ -0,0 +1,278 @@
+import json
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+
+from . import journal
+
+
+SQLITE_FILE = Path("database.sqlite3")
+
+# Колонки, вынесенные из записи для индексов и SQL-запросов к файлу (отчеты,
+# разбор инцидентов через sqlite3). Бот ищет записи по индексу в памяти
+# (utils/indexes.py), одинаковому для обоих хранилищ. Сама запись целиком
+# хранится в payload, чтобы формат database.json восстанавливался без потерь.
+TABLES = {
+    "users": {
+        "columns": {"telegram_id": "INTEGER", "email": "TEXT"},
+        "indexes": [("telegram_id",)],
+    },
+    "cell_sizes": {
+        "columns": {"code": "TEXT"},
+        "indexes": [("code",)],
+    },
+    "warehouses": {
+        "columns": {"name": "TEXT"},
+        "indexes": [("name",)],
+    },
+    "cells": {
+        "columns": {
+            "number": "TEXT",
+            "warehouse_name": "TEXT",
+            "cell_size_code": "TEXT",
+            "is_occupied": "INTEGER",
+        },
+        "indexes": [("number",), ("warehouse_name", "cell_size_code", "is_occupied")],
+    },
+    "rental_agreements": {
+        "columns": {
+            "qr_code": "TEXT",
+            "user_telegram_id": "INTEGER",
+            "cell_number": "TEXT",
+            "status": "TEXT",
+            "end_date": "TEXT",
+        },
+        "indexes": [("qr_code",), ("user_telegram_id", "status"), ("status", "end_date")],
+    },
+    "delivery_requests": {
+        "columns": {
+            "order_id": "INTEGER",
+            "user_telegram_id": "INTEGER",
+            "status": "TEXT",
+            "request_type": "TEXT",
+        },
+        "indexes": [("order_id",), ("status",), ("user_telegram_id",)],
+    },
+    "items": {
+        "columns": {"rental_agreement_qr_code": "TEXT", "removed_at": "TEXT"},
+        "indexes": [("rental_agreement_qr_code",)],
+    },
+    "reminders": {
+        "columns": {
+            "rental_agreement_qr_code": "TEXT",
+            "reminder_type": "TEXT",
+            "sent_at": "TEXT",
+        },
+        "indexes": [("rental_agreement_qr_code", "reminder_type", "sent_at")],
+    },
+    "payments": {
+        "columns": {"rental_agreement_qr_code": "TEXT", "paid_at": "TEXT"},
+        "indexes": [("rental_agreement_qr_code",)],
+    },
+    "overdue_tariffs": {
+        "columns": {"cell_size_code": "TEXT", "valid_from": "TEXT", "valid_until": "TEXT"},
+        "indexes": [("cell_size_code", "valid_from")],
+    },
+}
+
+_lock = threading.RLock()
+_connection = None
+_connection_path = None
+
+
+def _dump(record):
+    return json.dumps(record, ensure_ascii=False)
+
+
+def _column_value(record, column):
+    if not isinstance(record, dict):
+        return None
+    value = record.get(column)
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (dict, list)):
+        return None
+    return value
+
+
+def get_connection(path=None):
+    """Открывает (один раз на процесс) соединение с SQLite в режиме WAL."""
+    global _connection, _connection_path
+
+    target = Path(path) if path else SQLITE_FILE
+    with _lock:
+        if _connection is not None and _connection_path == target:
+            return _connection
+        if _connection is not None:
+            _connection.close()
+
+        connection = sqlite3.connect(str(target), check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        _create_schema(connection)
+        _connection = connection
+        _connection_path = target
+        return connection
+
+
+def _create_schema(connection):
+    for table, spec in TABLES.items():
+        columns = ", ".join(f"{name} {column_type}" for name, column_type in spec["columns"].items())
+        connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "position INTEGER PRIMARY KEY, "
+            f"{columns}, "
+            "payload TEXT NOT NULL)"
+        )
+        for index_columns in spec["indexes"]:
+            index_name = f"idx_{table}_{'_'.join(index_columns)}"
+            connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({', '.join(index_columns)})"
+            )
+    # Коллекции верхнего уровня, для которых нет отдельной таблицы.
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS collections (name TEXT PRIMARY KEY, payload TEXT NOT NULL)"
+    )
+
+
+def load_database(path=None):
+    """Собирает словарь в формате database.json из таблиц SQLite.
+
+    Читается все хранилище, поэтому db_utils вызывает загрузку только при
+    старте и после изменений из другого соединения (см. data_version);
+    собственные сохранения обновляют снимок в памяти без перечитывания.
+    """
+    with _lock:
+        connection = get_connection(path)
+        database = {}
+        for table in TABLES:
+            rows = connection.execute(f"SELECT payload FROM {table} ORDER BY position").fetchall()
+            database[table] = [json.loads(row[0]) for row in rows]
+        for name, payload in connection.execute("SELECT name, payload FROM collections"):
+            database[name] = json.loads(payload)
+        return database
+
+
+def data_version(path=None):
+    """Меняется, когда БД изменило другое соединение (например, импорт из JSON)."""
+    with _lock:
+        connection = get_connection(path)
+        return connection.execute("PRAGMA data_version").fetchone()[0]
+
+
+def save_changes(database, changes, path=None):
+    """Записывает изменения (формат journal.diff_database) одной транзакцией.
+
+    Стоимость зависит от числа изменений, а не от размера БД: запись
+    таблицы — одна строка по позиции, усечение — DELETE хвоста.
+    database — новое состояние, из него берутся коллекции целиком.
+    """
+    with _lock:
+        connection = get_connection(path)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            _write_changes(connection, database, changes)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+
+def _write_changes(connection, database, changes):
+    collections = []
+    rows, rows_table = [], None
+    for change in changes:
+        op = change["op"]
+        name = change.get("table") or change.get("key")
+        if op == "set" and name in TABLES:
+            if rows_table != name:
+                _upsert_rows(connection, rows_table, rows)
+                rows, rows_table = [], name
+            rows.append((change["pos"], change["record"]))
+            continue
+        _upsert_rows(connection, rows_table, rows)
+        rows, rows_table = [], None
+
+        if name not in TABLES:
+            collections.append(name)
+        elif op == "truncate":
+            connection.execute(f"DELETE FROM {name} WHERE position >= ?", (change["length"],))
+        else:
+            # Таблица заменена или удалена целиком.
+            connection.execute(f"DELETE FROM {name}")
+            connection.execute("DELETE FROM collections WHERE name = ?", (name,))
+            value = change.get("value")
+            if op == "put" and isinstance(value, list):
+                _upsert_rows(connection, name, list(enumerate(value)))
+            elif op == "put":
+                collections.append(name)
+    _upsert_rows(connection, rows_table, rows)
+
+    for name in dict.fromkeys(collections):
+        if name in database:
+            connection.execute(
+                "INSERT INTO collections (name, payload) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET payload = excluded.payload",
+                (name, _dump(database[name])),
+            )
+        else:
+            connection.execute("DELETE FROM collections WHERE name = ?", (name,))
+
+
+def _upsert_rows(connection, table, rows):
+    if not rows:
+        return
+    columns = list(TABLES[table]["columns"])
+    placeholders = ", ".join("?" for _ in range(len(columns) + 2))
+    connection.executemany(
+        f"INSERT INTO {table} (position, {', '.join(columns)}, payload) VALUES ({placeholders}) "
+        f"ON CONFLICT(position) DO UPDATE SET "
+        + ", ".join(f"{column} = excluded.{column}" for column in columns + ["payload"]),
+        [
+            (position, *[_column_value(record, column) for column in columns], _dump(record))
+            for position, record in rows
+        ],
+    )
+
+
+def import_json_database(json_path, sqlite_path=None):
+    """Разовый перенос database.json в SQLite одной транзакцией. Существующие данные заменяются.
+
+    Снимок читается вместе с журналом database.journal, так что изменения,
+    еще не попавшие в снимок контрольной точкой, тоже переносятся. Запускать
+    при остановленном боте.
+    """
+    database = journal.load(json_path)
+    if not isinstance(database, dict):
+        # Нет ни снимка, ни журнала.
+        raise FileNotFoundError(json_path)
+
+    with _lock:
+        connection = get_connection(sqlite_path)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for table in TABLES:
+                connection.execute(f"DELETE FROM {table}")
+            connection.execute("DELETE FROM collections")
+            _write_changes(
+                connection,
+                database,
+                [{"op": "put", "key": key, "value": value} for key, value in database.items()],
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    return {table: len(database.get(table, [])) for table in TABLES}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Использование: python -m utils.sqlite_storage <database.json> [database.sqlite3]")
+        sys.exit(1)
+    counts = import_json_database(sys.argv[1], sys.argv[2] if len(sys.argv) == 3 else None)
+    for table_name, count in counts.items():
+        print(f"{table_name}: {count}")
@@ -0,0 +1,246 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from .rate_limit import acquire_telegram_slot, telegram_limits
+
+
+# Очереди приоритетов: ответы пользователям, уведомления оператору, рассылки.
+INTERACTIVE = 0
+OPERATOR = 1
+BULK = 2
+LANES = (INTERACTIVE, OPERATOR, BULK)
+
+QUEUED_METHODS = ("send_message", "send_photo", "send_document")
+
+logger = logging.getLogger(__name__)
+
+_deferred = threading.local()
+
+
+def retry_after_seconds(exc):
+    """retry_after из ответа Telegram 429 или None для остальных ошибок."""
+    if getattr(exc, "error_code", None) != 429:
+        return None
+    result_json = getattr(exc, "result_json", None) or {}
+    parameters = result_json.get("parameters") or {}
+    return float(parameters.get("retry_after") or 1)
+
+
+class _Outgoing:
+    __slots__ = ("seq", "chat_id", "method", "args", "kwargs", "future", "attempts")
+
+    def __init__(self, seq, chat_id, method, args, kwargs):
+        self.seq = seq
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.attempts = 0
+
+
+class TelegramSendQueue:
+    """Единая очередь исходящих сообщений бота.
+
+    Воркеры берут сообщения по приоритету (INTERACTIVE, затем OPERATOR, затем
+    BULK), соблюдая общий лимит Telegram и лимит на чат. Сообщения одного чата
+    внутри очереди уходят строго по порядку и не больше одного одновременно.
+    На ответ 429 чат ставится на паузу на retry_after, а сообщение
+    возвращается в начало своей очереди.
+    """
+
+    def __init__(self, bot, workers=None, max_retries=None):
+        self.bot = bot
+        self.workers = workers or int(os.getenv("TG_SEND_WORKERS") or 4)
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("TG_SEND_RETRIES") or 3)
+        self.global_bucket, self.per_chat = telegram_limits()
+        self._lanes = {lane: deque() for lane in LANES}
+        self._busy_chats = set()
+        self._paused_until = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self.sent = 0
+        self.failed = 0
+        self.throttled = 0
+
+    def start(self):
+        for _ in range(self.workers - len(self._threads)):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, chat_id, method, *args, priority=INTERACTIVE, **kwargs):
+        """Ставит вызов bot.<method>(chat_id, ...) в очередь и возвращает Future.
+
+        Результат можно не ждать (fire-and-forget) или дождаться через
+        future.result() — там будет ответ Telegram или исключение.
+        """
+        item = _Outgoing(next(self._seq), chat_id, method, args, kwargs)
+        with self._cond:
+            self._lanes[priority].append(item)
+            self._cond.notify()
+        return item.future
+
+    def send_message(self, chat_id, text, priority=INTERACTIVE, **kwargs):
+        return self.submit(chat_id, "send_message", text, priority=priority, **kwargs)
+
+    def depth(self):
+        with self._cond:
+            return {lane: len(items) for lane, items in self._lanes.items()}
+
+    def stats(self):
+        depth = self.depth()
+        return {
+            "interactive": depth[INTERACTIVE],
+            "operator": depth[OPERATOR],
+            "bulk": depth[BULK],
+            "sent": self.sent,
+            "failed": self.failed,
+            "throttled": self.throttled,
+        }
+
+    def _next_ready(self, now):
+        """Первое сообщение, которое можно отправить сейчас, или (None, сколько ждать)."""
+        wait = None
+        for lane in LANES:
+            blocked = set()
+            for index, item in enumerate(self._lanes[lane]):
+                chat_id = item.chat_id
+                if chat_id in blocked:
+                    continue
+                # Следующие сообщения этого чата в очереди ждут текущее.
+                blocked.add(chat_id)
+                if chat_id in self._busy_chats:
+                    continue
+                chat_wait = max(self._paused_until.get(chat_id, 0) - now, self.per_chat.peek(chat_id))
+                if chat_wait > 0:
+                    wait = chat_wait if wait is None else min(wait, chat_wait)
+                    continue
+                return lane, index, None
+        return None, None, wait
+
+    def _take(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                lane, index, wait = self._next_ready(now)
+                if lane is None:
+                    self._cond.wait(wait)
+                    continue
+                global_wait = self.global_bucket.try_acquire()
+                if global_wait:
+                    self._cond.wait(global_wait)
+                    continue
+                items = self._lanes[lane]
+                item = items[index]
+                del items[index]
+                self.per_chat.try_acquire(item.chat_id)
+                self._paused_until.pop(item.chat_id, None)
+                self._busy_chats.add(item.chat_id)
+                return lane, item
+
+    def _done(self, item, counter, lane=None, retry_after=None):
+        with self._cond:
+            setattr(self, counter, getattr(self, counter) + 1)
+            self._busy_chats.discard(item.chat_id)
+            if retry_after is not None:
+                self._paused_until[item.chat_id] = time.monotonic() + retry_after
+                self._lanes[lane].appendleft(item)
+            self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            lane, item = self._take()
+            item.attempts += 1
+            for arg in item.args:
+                # Файлы (QR-код в BytesIO) при повторе отправляются с начала.
+                if hasattr(arg, "seek"):
+                    arg.seek(0)
+            try:
+                result = getattr(self.bot, item.method)(item.chat_id, *item.args, **item.kwargs)
+            except Exception as exc:
+                retry_after = retry_after_seconds(exc)
+                if retry_after is not None and item.attempts <= self.max_retries:
+                    self._done(item, "throttled", lane, retry_after)
+                    continue
+                self._done(item, "failed")
+                item.future.set_exception(exc)
+                continue
+            self._done(item, "sent")
+            item.future.set_result(result)
+
+
+@contextmanager
+def deferred_sends():
+    """Отправки QueuedBot внутри блока не ждут очереди в этом потоке.
+
+    Вызов возвращает Future, а сами Future собираются в список, который
+    вызывающий ждет позже (asyncio-режим ждет их в event loop, не занимая
+    поток executor). Порядок сообщений одного чата задает очередь.
+    """
+    futures = []
+    _deferred.futures = futures
+    try:
+        yield futures
+    finally:
+        _deferred.futures = None
+
+
+def _log_failed_send(future):
+    error = future.exception()
+    if error is not None:
+        logger.error("Сообщение не отправлено: %s: %s", type(error).__name__, error)
+
+
+class QueuedBot:
+    """Обертка над TeleBot: send_message/send_photo/send_document идут через очередь.
+
+    По умолчанию вызов не ждет отправки: сообщение ставится в очередь, порядок
+    сообщений одного чата задает она же, а ошибка отправки пишется в лог.
+    Так обработчик, отправляющий много сообщений, не держит поток диспетчера
+    (и закрепленных за ним пользователей) на лимите чата. Внутри
+    deferred_sends() Future собираются для вызывающего. Кому нужен результат
+    (например, успех отправки), передает wait=True — вызов вернет то же, что
+    TeleBot, или поднимет его исключение; wait=False возвращает Future.
+    Сообщения в чаты из operator_chats по умолчанию идут очередью OPERATOR,
+    остальные — INTERACTIVE. Все прочие атрибуты берутся у исходного бота.
+    """
+
+    def __init__(self, bot, queue, operator_chats=()):
+        self._bot = bot
+        self.queue = queue
+        self.operator_chats = {str(chat) for chat in operator_chats if chat}
+
+    def __getattr__(self, name):
+        if name in QUEUED_METHODS:
+            def queued(chat_id, *args, priority=None, wait=None, **kwargs):
+                if priority is None:
+                    priority = OPERATOR if str(chat_id) in self.operator_chats else INTERACTIVE
+                future = self.queue.submit(chat_id, name, *args, priority=priority, **kwargs)
+                if wait:
+                    return future.result()
+                if wait is None:
+                    deferred = getattr(_deferred, "futures", None)
+                    if deferred is not None:
+                        deferred.append(future)
+                    else:
+                        future.add_done_callback(_log_failed_send)
+                return future
+            return queued
+        return getattr(self._bot, name)
+
+
+def send_message(bot, chat_id, text, priority=BULK, **kwargs):
+    """Отправка с нужным приоритетом, если bot — QueuedBot; иначе напрямую по лимитам."""
+    if isinstance(bot, QueuedBot):
+        return bot.send_message(chat_id, text, priority=priority, wait=True, **kwargs)
+    acquire_telegram_slot(chat_id)
+    return bot.send_message(chat_id, text, **kwargs)
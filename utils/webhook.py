@@ -0,0 +1,181 @@
+import hmac
+import json
+import os
+import sys
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY_BYTES = 1024 * 1024
+
+
+def webhook_settings():
+    return {
+        "url": os.getenv("WEBHOOK_URL"),
+        "secret": os.getenv("WEBHOOK_SECRET"),
+        "host": os.getenv("WEBHOOK_HOST") or "0.0.0.0",
+        "port": int(os.getenv("WEBHOOK_PORT") or 8443),
+        "path": os.getenv("WEBHOOK_PATH") or "/telegram",
+        "workers": int(os.getenv("WEBHOOK_WORKERS") or 8),
+        "queue_size": int(os.getenv("WEBHOOK_QUEUE") or 100),
+        # Сколько ждать свободного места в очереди, прежде чем ответить 503.
+        "accept_timeout": float(os.getenv("WEBHOOK_ACCEPT_TIMEOUT") or 2),
+    }
+
+
+class WebhookServer:
+    """HTTP-сервер для webhook Telegram с ограниченным пулом обработки.
+
+    Каждый POST с верным секретом (заголовок X-Telegram-Bot-Api-Secret-Token)
+    ставится в пул из workers потоков, не больше queue_size обновлений
+    одновременно (в работе и в ожидании). Если места нет дольше
+    accept_timeout, сервер отвечает 503 — Telegram повторит доставку позже.
+    """
+
+    def __init__(self, dispatch, secret, host="0.0.0.0", port=8443, path="/telegram",
+                 workers=8, queue_size=100, accept_timeout=2.0):
+        if not secret:
+            raise ValueError("Для webhook нужен секрет (WEBHOOK_SECRET)")
+        self.dispatch = dispatch
+        self.secret = secret.encode("utf-8")
+        self.path = path
+        self.accept_timeout = accept_timeout
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="webhook")
+        self._lock = threading.Lock()
+        self.counters = {"accepted": 0, "rejected": 0, "busy": 0, "failed": 0}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                server.handle_post(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle_post(self, request):
+        if request.path != self.path:
+            return self._reply(request, 404)
+        token = (request.headers.get(SECRET_HEADER) or "").encode("utf-8")
+        if not hmac.compare_digest(token, self.secret):
+            self._count("rejected")
+            return self._reply(request, 403)
+
+        length = int(request.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            return self._reply(request, 413 if length > MAX_BODY_BYTES else 400)
+        try:
+            update = json.loads(request.rfile.read(length))
+        except (ValueError, UnicodeDecodeError):
+            return self._reply(request, 400)
+
+        if not self._slots.acquire(timeout=self.accept_timeout):
+            self._count("busy")
+            return self._reply(request, 503, {"Retry-After": "1"})
+        try:
+            self._pool.submit(self._run, update)
+        except RuntimeError:
+            self._slots.release()
+            return self._reply(request, 503)
+        self._count("accepted")
+        return self._reply(request, 200)
+
+    def _run(self, update):
+        try:
+            self.dispatch(update)
+        except Exception:
+            self._count("failed")
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _reply(request, status, headers=None):
+        request.send_response(status)
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.send_header("Content-Length", "0")
+        request.end_headers()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._pool.shutdown(wait=True)
+
+
+def build_webhook_server(dispatch):
+    """WebhookServer по настройкам WEBHOOK_*; возвращает (server, settings)."""
+    settings = webhook_settings()
+    if not settings["url"]:
+        raise RuntimeError("WEBHOOK_URL не задан в переменных окружения")
+    server = WebhookServer(
+        dispatch,
+        secret=settings["secret"],
+        host=settings["host"],
+        port=settings["port"],
+        path=settings["path"],
+        workers=settings["workers"],
+        queue_size=settings["queue_size"],
+        accept_timeout=settings["accept_timeout"],
+    )
+    return server, settings
+
+
+def replay_updates(updates_path, url, secret):
+    """Отправляет записанные обновления (по одному JSON в строке) на локальный webhook."""
+    statuses = {}
+    with open(updates_path, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            request = urllib.request.Request(
+                url,
+                data=line.encode("utf-8"),
+                headers={"Content-Type": "application/json", SECRET_HEADER: secret},
+                method="POST",
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    status = response.status
+            except urllib.error.HTTPError as exc:
+                status = exc.code
+            statuses[status] = statuses.get(status, 0) + 1
+    return statuses
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("Использование: python -m utils.webhook <updates.jsonl> <url> <secret>")
+        sys.exit(1)
+    for status_code, count in sorted(replay_updates(*sys.argv[1:]).items()):
+        print(f"{status_code}: {count}")
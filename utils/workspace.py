@@ -0,0 +1,249 @@
+import copy
+
+from . import journal
+
+
+def copy_record(record):
+    """Копия записи вместе с вложенными списками и словарями (item_list и т.п.)."""
+    if isinstance(record, dict):
+        return {
+            key: copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+            for key, value in record.items()
+        }
+    if isinstance(record, list):
+        return copy.deepcopy(record)
+    return record
+
+
+def detach_changes(changes):
+    """Копирует записи изменений, чтобы новый снимок не делил их с рабочей копией."""
+    detached = []
+    for change in changes:
+        if change["op"] == "set":
+            change = {**change, "record": copy_record(change["record"])}
+        elif change["op"] == "put":
+            change = {**change, "value": copy.deepcopy(change["value"])}
+        detached.append(change)
+    return detached
+
+
+class TrackedTable(list):
+    """Таблица рабочей копии транзакции.
+
+    Хранит ссылки на записи сохраненного снимка и копирует запись при первом
+    обращении к ней, запоминая позицию. При сохранении сравниваются только
+    эти позиции и дописанный хвост. Операции, сдвигающие позиции (удаление,
+    вставка, сортировка), помечают таблицу, и она сравнивается целиком.
+    """
+
+    def __init__(self, base):
+        super().__init__(base)
+        self.base = base
+        self.touched = set()
+        self.reshaped = False
+        # id записей, которые уже принадлежат рабочей копии: их не копируем.
+        self._owned = set()
+
+    def _own(self, value):
+        self._owned.add(id(value))
+        return value
+
+    def _read(self, position):
+        record = list.__getitem__(self, position)
+        if isinstance(record, (dict, list)) and id(record) not in self._owned:
+            record = self._own(copy_record(record))
+            list.__setitem__(self, position, record)
+        self.touched.add(position)
+        return record
+
+    def _position(self, index):
+        position = index.__index__()
+        return position + len(self) if position < 0 else position
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._read(position) for position in range(*index.indices(len(self)))]
+        list.__getitem__(self, index)
+        return self._read(self._position(index))
+
+    def __iter__(self):
+        position = 0
+        while position < len(self):
+            yield self._read(position)
+            position += 1
+
+    def __reversed__(self):
+        for position in range(len(self) - 1, -1, -1):
+            yield self._read(position)
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = list(value)
+            for record in value:
+                self._own(record)
+            self.reshaped = True
+            list.__setitem__(self, index, value)
+            return
+        list.__setitem__(self, index, self._own(value))
+        self.touched.add(self._position(index))
+
+    def append(self, value):
+        list.append(self, self._own(value))
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __add__(self, other):
+        return self.copy() + list(other)
+
+    def copy(self):
+        return [self._read(position) for position in range(len(self))]
+
+    def pop(self, index=-1):
+        self.reshaped = True
+        record = list.pop(self, index)
+        return record if id(record) in self._owned else copy_record(record)
+
+    def insert(self, index, value):
+        self.reshaped = True
+        list.insert(self, index, self._own(value))
+
+    def __delitem__(self, index):
+        self.reshaped = True
+        list.__delitem__(self, index)
+
+    def remove(self, value):
+        self.reshaped = True
+        list.remove(self, value)
+
+    def clear(self):
+        self.reshaped = True
+        list.clear(self)
+
+    def sort(self, *args, **kwargs):
+        self.reshaped = True
+        list.sort(self, *args, **kwargs)
+
+    def reverse(self):
+        self.reshaped = True
+        list.reverse(self)
+
+    def __imul__(self, count):
+        self.reshaped = True
+        return list.__imul__(self, count)
+
+    def raw(self):
+        """Содержимое без копирования записей — только для сравнения при сохранении."""
+        return list.copy(self)
+
+    def changes(self, table):
+        if self.reshaped:
+            return journal.diff_table(table, self.base, self.raw())
+        base_length = len(self.base)
+        positions = sorted(position for position in self.touched if position < base_length)
+        positions += range(base_length, len(self))
+        changes = []
+        for position in positions:
+            record = list.__getitem__(self, position)
+            if position >= base_length or self.base[position] != record:
+                changes.append({"op": "set", "table": table, "pos": position, "record": record})
+        return changes
+
+
+class Workspace(dict):
+    """Рабочая копия БД в транзакции с учетом изменений.
+
+    Таблицы оборачиваются в TrackedTable при первом обращении, прочие
+    изменяемые значения копируются. Поэтому стоимость транзакции зависит
+    от числа прочитанных и измененных записей, а не от размера БД.
+    """
+
+    def __init__(self, base):
+        super().__init__(base)
+        self.base = base
+        self._touched = {}
+
+    def _value(self, key):
+        value = dict.__getitem__(self, key)
+        if key in self._touched:
+            return value
+        if isinstance(value, list):
+            value = TrackedTable(value)
+        elif isinstance(value, dict):
+            value = copy.deepcopy(value)
+        else:
+            return value
+        dict.__setitem__(self, key, value)
+        self._touched[key] = None
+        return value
+
+    def __getitem__(self, key):
+        dict.__getitem__(self, key)
+        return self._value(key)
+
+    def get(self, key, default=None):
+        return self._value(key) if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self._value(key)
+        self[key] = default
+        return default
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._touched[key] = None
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._touched[key] = None
+
+    def pop(self, key, *default):
+        if key not in self:
+            return dict.pop(self, key, *default)
+        value = self._value(key)
+        del self[key]
+        return value
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    def values(self):
+        return [self._value(key) for key in self]
+
+    def items(self):
+        return [(key, self._value(key)) for key in self]
+
+    def copy(self):
+        return dict(self.items())
+
+    def changes(self):
+        """Изменения относительно base только по затронутым ключам и записям."""
+        changes = []
+        for key in self._touched:
+            if key not in self:
+                if key in self.base:
+                    changes.append({"op": "drop", "key": key})
+                continue
+            value = dict.__getitem__(self, key)
+            old_value = self.base.get(key)
+            if isinstance(value, TrackedTable) and value.base is old_value:
+                changes.extend(value.changes(key))
+                continue
+            if isinstance(value, TrackedTable):
+                value = value.raw()
+            if isinstance(value, list) and isinstance(old_value, list):
+                changes.extend(journal.diff_table(key, old_value, value))
+            elif key not in self.base or old_value != value:
+                changes.append({"op": "put", "key": key, "value": value})
+        return changes